@@ -0,0 +1,423 @@
+"""
+Approximate nearest neighbor search for the player comparison model, for when there are millions of vectors.
+
+The SimilarityEngine scores every query against every season, and the KD-tree in neighbor_index.py still has to open
+ a large share of its leaves with 14 features. That's fine for ~10k season vectors, but comparing rolling game windows
+ means millions of vectors, and at that size the float matrix alone is hundreds of MB. IVFPQIndex trades a little
+ recall for speed and memory, like FAISS's IVF-PQ:
+
+- IVF: k-means splits the vectors into n_lists cells. A query only scans the nprobe cells whose centroids are closest to
+  it, so the work per query is about nprobe / n_lists of a full scan.
+- PQ: each vector is stored as its residual from the cell centroid, cut into n_subspaces groups of features. Every group
+  is replaced by the id of the nearest of 256 codewords learned for it, so a vector takes n_subspaces bytes.
+  Distances to a query come from one small lookup table per probed cell, so the scan is table lookups and adds.
+- rerank: optionally the best rerank * k candidates are scored again with exact distances from the full vectors (an
+  in memory array or a memory mapped .npy, only the candidate rows get read).
+
+nprobe (and rerank) set the recall / latency tradeoff and can be changed per query. With the defaults a vector costs 7
+ bytes of codes plus a 4 byte row id, so 10 million vectors take about 110 MB.
+
+Measured against SimilarityEngine.top_k_rows on player_general_traditional_per_game_data.csv (9,662 seasons with
+ gp > 10, normalized by season like fantasy_model.py, the 10 nearest seasons of every 2017-18 season, mean_abs), with
+ `python ann.py`:
+
+     nprobe  rerank  recall@10  ms/query
+      exact              1.000      0.51
+          1       0      0.440      0.15
+          4       0      0.786      0.39
+         16       0      0.900      1.25
+          4      10      0.818      0.48
+         16      10      0.994      1.39
+
+At this size the exact engine is as fast, so the approximate mode is for the bigger matrices. On ~1M vectors (100
+ noisy copies of the same seasons, float32 and memory mapped for reranking) the index has 3,125 lists, takes 11 MB,
+ builds in 46s with a 170 MB peak, and answers in 0.85 ms per query at nprobe 8 / rerank 10 with recall@10 0.98,
+ against 42 ms for the exact engine. Without rerank recall levels off around 0.80, which is the quantization error.
+
+Both metrics of similarity.py are supported. Lists are trained with euclidean k-means either way, and rows with a
+ missing stat are left out of the index, the same as the exact engine giving them an infinite distance.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from similarity import block_distances, feature_matrix, metrics, norm_cols
+
+
+def assign(points, centroids, block_cells=1 << 22):
+    """
+    Nearest centroid (euclidean) of every point. Points go in blocks of about block_cells distances, so assigning
+     millions of points to thousands of centroids only ever holds a few tens of MB of distances.
+    """
+    labels = np.empty(points.shape[0], dtype=np.int64)
+    # |p - c|^2 = |p|^2 + |c|^2 - 2 p.c, and |p|^2 is the same for every centroid so it can be left out of the argmin
+    half_sq = (centroids ** 2).sum(axis=1) / 2
+    block = max(1, block_cells // max(1, centroids.shape[0]))
+    for start in range(0, points.shape[0], block):
+        scores = np.asarray(points[start:start + block], dtype=np.float64) @ centroids.T
+        np.subtract(half_sq[None, :], scores, out=scores)
+        labels[start:start + block] = scores.argmin(axis=1)
+    return labels
+
+
+def kmeans(points, n_clusters, n_iter=20, seed=0):
+    """
+    Lloyd's k-means. Returns the centroids, shape (n_clusters, n_features).
+
+    Clusters that end up empty are restarted from a random point, so every centroid stays in use.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, points.shape[0])
+    centroids = points[rng.choice(points.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(points, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = points[rng.choice(points.shape[0], empty.sum(), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    Inverted file index with product quantized residuals over a matrix of player vectors.
+
+    Results use the row numbers of the matrix it was built from, like SimilarityEngine, and top_k / top_k_rows take
+     and return the same things, so the index can stand in for the engine in project_player and project_season.
+
+    n_lists: number of k-means cells. Defaults to 4 * sqrt(rows), with at least 32 rows per cell and at most 4096 cells.
+    n_subspaces: number of byte codes per vector. Must divide the number of features.
+    nprobe: cells scanned per query by default
+    rerank: by default, rescore the best rerank * k candidates with exact distances (0 turns it off). Needs vectors.
+    vectors: full vectors to rerank with, e.g. np.load(path, mmap_mode='r'). keep_vectors=True keeps the matrix itself.
+    train_size: rows sampled to train the cells and codebooks
+    """
+
+    def __init__(self, matrix, n_lists=None, n_subspaces=7, metric='mean_abs', nprobe=8, rerank=0, vectors=None,
+                 keep_vectors=False, train_size=100000, n_iter=20, seed=0):
+        if metric not in metrics:
+            raise ValueError('Unknown metric {}. Choose one of {}'.format(metric, metrics))
+        matrix = np.asarray(matrix)
+        n_features = matrix.shape[1]
+        if n_features % n_subspaces:
+            raise ValueError('n_subspaces {} must divide the {} features'.format(n_subspaces, n_features))
+        self.metric = metric
+        self.n_rows = 0
+        self.n_features = n_features
+        self.n_subspaces = n_subspaces
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.vectors = matrix if keep_vectors and vectors is None else vectors
+
+        # Train on a sample of the rows, so building over a memory mapped matrix only reads the sample twice
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(matrix.shape[0], min(train_size, matrix.shape[0]), replace=False))
+        train = np.asarray(matrix[sample], dtype=np.float64)
+        train = train[np.isfinite(train).all(axis=1)]
+        if not len(train):
+            raise ValueError('No rows without missing values to index')
+        if n_lists is None:
+            n_finite = len(train) * matrix.shape[0] / len(sample)
+            n_lists = int(max(1, min(4 * np.sqrt(n_finite), n_finite // 32, len(train) // 32, 4096)))
+
+        self.centroids = kmeans(train, n_lists, n_iter=n_iter, seed=seed)
+        self.n_lists = self.centroids.shape[0]
+        residuals = train - self.centroids[assign(train, self.centroids)]
+        sub = n_features // n_subspaces
+        self.codebooks = np.stack([
+            kmeans(residuals[:, s * sub:(s + 1) * sub], 256, n_iter=n_iter, seed=seed + 1 + s)
+            for s in range(n_subspaces)
+        ])
+
+        self.list_ids = np.empty(0, dtype=np.int32)
+        self.codes = np.empty((0, n_subspaces), dtype=np.uint8)
+        self.offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        self._row_positions = None
+        self._add(matrix)
+
+    @classmethod
+    def from_frame(cls, df, cols=None, **kwargs):
+        """Build an index over the normalized stat columns of a dataframe."""
+        return cls(feature_matrix(df, cols or norm_cols), **kwargs)
+
+    @classmethod
+    def from_engine(cls, engine, **kwargs):
+        """Build an index over a SimilarityEngine's matrix, reranking with it unless vectors says otherwise."""
+        kwargs.setdefault('vectors', engine.matrix)
+        return cls(engine.matrix, metric=engine.metric, **kwargs)
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def nbytes(self):
+        """Memory held by the index itself, leaving out vectors."""
+        return sum(array.nbytes for array in [self.centroids, self.codebooks, self.list_ids, self.codes, self.offsets])
+
+    # Encoding
+
+    def encode(self, matrix):
+        """(cell, codes) for every row of a matrix."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        cells = assign(matrix, self.centroids)
+        residuals = matrix - self.centroids[cells]
+        sub = self.n_features // self.n_subspaces
+        codes = np.empty((matrix.shape[0], self.n_subspaces), dtype=np.uint8)
+        for s in range(self.n_subspaces):
+            codes[:, s] = assign(residuals[:, s * sub:(s + 1) * sub], self.codebooks[s])
+        return cells, codes
+
+    def decode(self, rows):
+        """Approximate vectors of indexed rows, rebuilt from their cell centroid and codes. Unindexed rows give NaN."""
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        decoded = np.full((len(rows), self.n_features), np.nan)
+        pos = self._positions(rows)
+        found = pos >= 0
+        cells = np.searchsorted(self.offsets, pos[found], side='right') - 1
+        parts = self.codebooks[np.arange(self.n_subspaces), self.codes[pos[found]]]
+        decoded[found] = self.centroids[cells] + parts.reshape(len(cells), -1)
+        return decoded
+
+    def add(self, matrix, vectors=None):
+        """
+        Add vectors to the index with the cells and codebooks it was trained with, so new game windows don't need a
+         rebuild. They get the row numbers following on from the rows already there.
+
+        Reranking reads the full vectors of candidate rows, so they have to cover the new rows too. An in memory vectors
+         array gets the new rows appended. A memory mapped one can't grow, so pass vectors holding every row, old and
+         new (e.g. the .npy file with the new rows written to its end, mapped again).
+        """
+        matrix = np.asarray(matrix)
+        n_total = self.n_rows + matrix.shape[0]
+        if vectors is not None:
+            if len(vectors) != n_total:
+                raise ValueError('vectors has {} rows, but the index will have {}'.format(len(vectors), n_total))
+            self.vectors = vectors
+        elif isinstance(self.vectors, np.memmap):
+            raise ValueError('The rerank vectors are memory mapped and can\'t grow. Pass vectors with every row.')
+        elif self.vectors is not None:
+            self.vectors = np.concatenate([self.vectors, matrix.astype(self.vectors.dtype, copy=False)])
+        self._add(matrix)
+
+    def _add(self, matrix):
+        rows, cells, codes = [], [], []
+        # Encode in blocks so adding millions of rows (maybe memory mapped) never holds more than one block of floats
+        block = 262144
+        for start in range(0, matrix.shape[0], block):
+            chunk = matrix[start:start + block]
+            finite = np.flatnonzero(np.isfinite(chunk).all(axis=1))
+            block_cells, block_codes = self.encode(chunk[finite])
+            rows.append(finite + self.n_rows + start)
+            cells.append(block_cells)
+            codes.append(block_codes)
+        self.n_rows += matrix.shape[0]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        codes = np.concatenate(codes) if codes else np.empty((0, self.n_subspaces), dtype=np.uint8)
+
+        # Keep everything sorted by cell, so a cell is the slice offsets[cell]:offsets[cell + 1]
+        old_cells = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+        all_cells = np.concatenate([old_cells, cells])
+        order = np.argsort(all_cells, kind='stable')
+        self.list_ids = np.concatenate([self.list_ids, np.asarray(rows, dtype=np.int32)])[order]
+        self.codes = np.concatenate([self.codes, codes])[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(all_cells, minlength=self.n_lists))])
+        self._row_positions = None
+
+    def _positions(self, rows):
+        # Position of every row in list_ids, -1 for rows that aren't indexed. Built the first time it's needed.
+        if self._row_positions is None:
+            self._row_positions = np.full(self.n_rows, -1, dtype=np.int64)
+            self._row_positions[self.list_ids] = np.arange(len(self.list_ids))
+        return self._row_positions[rows]
+
+    # Queries
+
+    def _tables(self, query, cells):
+        """Distance from the query's residual to every codeword, per probed cell: shape (len(cells), n_subspaces, 256)."""
+        residuals = (query[None, :] - self.centroids[cells]).reshape(len(cells), self.n_subspaces, 1, -1)
+        diff = residuals - self.codebooks[None]
+        if self.metric == 'mean_abs':
+            return np.abs(diff).sum(axis=3)
+        return (diff ** 2).sum(axis=3)
+
+    def _search(self, query, k, rerank, exclude, candidates, cells):
+        starts, stops = self.offsets[cells], self.offsets[cells + 1]
+        lengths = stops - starts
+        positions = np.repeat(stops - lengths.cumsum(), lengths) + np.arange(lengths.sum())
+        rows = self.list_ids[positions].astype(np.int64)
+
+        tables = self._tables(query, cells)
+        probe = np.repeat(np.arange(len(cells)), lengths)
+        dist = tables[probe[:, None], np.arange(self.n_subspaces)[None, :], self.codes[positions]].sum(axis=1)
+        if self.metric == 'mean_abs':
+            dist /= self.n_features
+        else:
+            dist = np.sqrt(dist)
+
+        keep = np.ones(len(rows), dtype=bool)
+        if candidates is not None:
+            keep &= candidates[rows]
+        if exclude is not None:
+            keep &= rows != exclude
+        rows, dist = rows[keep], dist[keep]
+
+        if rerank and self.vectors is not None and len(rows) > k:
+            # Exact distances for the best rerank * k candidates only
+            shortlist = np.argpartition(dist, min(rerank * k, len(rows)) - 1)[:rerank * k]
+            # Read them in row order, which is much kinder to a memory mapped file
+            rows = np.sort(rows[shortlist])
+            dist = block_distances(query[None, :], np.asarray(self.vectors[rows], dtype=np.float64), self.metric)[0]
+        if len(rows) > k:
+            top = np.argpartition(dist, k - 1)[:k]
+            rows, dist = rows[top], dist[top]
+        order = np.argsort(dist, kind='stable')
+        return rows[order], dist[order]
+
+    def top_k(self, queries, k=10, exclude=None, candidates=None, nprobe=None, rerank=None):
+        """
+        Approximate k nearest rows for every query vector. Same arguments and results as SimilarityEngine.top_k.
+
+        nprobe, rerank: override the index defaults for these queries
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        rerank = self.rerank if rerank is None else rerank
+        if exclude is not None:
+            exclude = np.asarray(exclude).reshape(-1)
+
+        best_idx = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        best_dist = np.full((queries.shape[0], k), np.inf)
+        finite = np.isfinite(queries).all(axis=1)
+        # Closest cells for every query at once, then one vectorized scan per query over its cells
+        cell_dist = np.full((queries.shape[0], self.n_lists), np.inf)
+        cell_dist[finite] = block_distances(queries[finite], self.centroids, self.metric)
+        if nprobe < self.n_lists:
+            probes = np.argpartition(cell_dist, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.n_lists), cell_dist.shape)
+        for i in np.flatnonzero(finite):
+            own = exclude[i] if exclude is not None else None
+            rows, dist = self._search(queries[i], k, rerank, own, candidates, probes[i])
+            best_idx[i, :len(rows)] = rows
+            best_dist[i, :len(rows)] = dist
+        return best_idx, best_dist
+
+    def top_k_rows(self, rows, k=10, exclude_self=True, candidates=None, nprobe=None, rerank=None):
+        """Same as top_k, but the queries are rows already in the index (from vectors, or decoded when there are none)."""
+        rows = np.asarray(rows).reshape(-1)
+        queries = np.asarray(self.vectors[rows], dtype=np.float64) if self.vectors is not None else self.decode(rows)
+        exclude = rows if exclude_self else None
+        return self.top_k(queries, k=k, exclude=exclude, candidates=candidates, nprobe=nprobe, rerank=rerank)
+
+    # Persistence
+
+    def save(self, path):
+        """Write the index to a single .npz file. Rerank vectors aren't included, pass them to load again."""
+        np.savez(
+            path,
+            centroids=self.centroids,
+            codebooks=self.codebooks,
+            list_ids=self.list_ids,
+            codes=self.codes,
+            offsets=self.offsets,
+            settings=np.array([self.metric, str(self.n_rows), str(self.nprobe), str(self.rerank)])
+        )
+
+    @classmethod
+    def load(cls, path, vectors=None):
+        """Read an index written by save."""
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.centroids = data['centroids']
+        index.codebooks = data['codebooks']
+        index.list_ids = data['list_ids']
+        index.codes = data['codes']
+        index.offsets = data['offsets']
+        index.metric = str(data['settings'][0])
+        index.n_rows = int(data['settings'][1])
+        index.nprobe = int(data['settings'][2])
+        index.rerank = int(data['settings'][3])
+        index.n_lists, index.n_features = index.centroids.shape
+        index.n_subspaces = index.codebooks.shape[0]
+        index.vectors = vectors
+        index._row_positions = None
+        return index
+
+
+def recall_at_k(exact_idx, approx_idx):
+    """Share of the exact k nearest rows that the approximate search found too, over every query."""
+    exact_idx, approx_idx = np.asarray(exact_idx), np.asarray(approx_idx)
+    found = total = 0
+    for exact, approx in zip(exact_idx, approx_idx):
+        exact = exact[exact >= 0]
+        found += np.isin(exact, approx).sum()
+        total += len(exact)
+    return found / total if total else 1.0
+
+
+def measure_recall(engine, index, rows, k=10, settings=((1, 0), (4, 0), (16, 0), (4, 10), (16, 10))):
+    """
+    Recall@k of the index against the exact engine for the query rows, for every (nprobe, rerank) setting.
+
+    Returns a list of dicts with nprobe, rerank, recall and ms per query, and the exact engine's ms per query as the
+     first entry (nprobe and rerank None).
+    """
+    started = time.perf_counter()
+    exact_idx, _ = engine.top_k_rows(rows, k=k)
+    results = [{
+        'nprobe': None, 'rerank': None, 'recall': 1.0, 'ms_per_query': 1000 * (time.perf_counter() - started) / len(rows)
+    }]
+    for nprobe, rerank in settings:
+        started = time.perf_counter()
+        approx_idx, _ = index.top_k_rows(rows, k=k, nprobe=nprobe, rerank=rerank)
+        seconds = time.perf_counter() - started
+        results.append({
+            'nprobe': nprobe,
+            'rerank': rerank,
+            'recall': recall_at_k(exact_idx, approx_idx),
+            'ms_per_query': 1000 * seconds / len(rows),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of IVFPQIndex against exact search.')
+    parser.add_argument('--scale', type=int, default=1, help='benchmark.py synthetic data scale, 1 is the real data')
+    parser.add_argument('--season', default='2017-18', help='query with every season from this year')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    # Imported here so the index itself doesn't depend on the benchmark or the CSV loaders
+    from benchmark import synthetic_data
+    from csv_cache import read_csv_cached
+    from normalization import normalize
+    from similarity import SimilarityEngine, stats
+
+    df = read_csv_cached(synthetic_data(args.scale)['per_game']).dropna(how='all')
+    df = df[df['gp'] > 10]
+    df_normalized, _ = normalize(df, stats, by='season_id', method='minmax')
+    df_normalized = df_normalized.reset_index(drop=True)
+    engine = SimilarityEngine(df_normalized)
+
+    started = time.perf_counter()
+    index = IVFPQIndex.from_engine(engine)
+    print(f"{len(index)} vectors, {index.n_lists} lists, built in {time.perf_counter() - started:.1f}s, "
+          f"{index.nbytes / 1024 ** 2:.1f} MB of codes ({engine.matrix.nbytes / 1024 ** 2:.1f} MB as floats)")
+
+    rows = np.flatnonzero(df_normalized['season_id'] == args.season)[:args.queries]
+    print(f"{'nprobe':>7} {'rerank':>7} {'recall@' + str(args.k):>10} {'ms/query':>9}")
+    for result in measure_recall(engine, index, rows, k=args.k):
+        nprobe = 'exact' if result['nprobe'] is None else result['nprobe']
+        rerank = '' if result['rerank'] is None else result['rerank']
+        print(f"{nprobe:>7} {rerank:>7} {result['recall']:>10.3f} {result['ms_per_query']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+asyncio backend for scraping the stats.nba.com endpoints.
+
+The thread pool scrapers in scraper.py use a fixed number of workers, sleep a flat 10 seconds after any failure, and every
+ nba_api endpoint object opens its own connection. This module talks to the same endpoints directly over one pooled
+ aiohttp session (keep-alive connections are reused across requests) and controls its own pace:
+
+- a token bucket caps the request rate at a budget we choose up front
+- an additive-increase / multiplicative-decrease controller adjusts how many requests are in flight. Fast, clean
+  responses slowly raise the limit. Errors, throttling (429 / 5xx) and slow responses cut it, along with the token rate.
+- failed requests back off exponentially with full jitter, so retries from many players don't line up
+
+Payloads are the same JSON the nba_api endpoint classes parse, so frames_from_payload gives back the same dataframes.
+ base_url can point at a local stand-in server for testing.
+"""
+
+import asyncio
+import random
+import time
+
+import aiohttp
+import pandas as pd
+
+from scraper import endpoint_result_sets, frames_from_payload, player_params
+from scraper import headers as nba_headers
+from instrumentation import count, instrumented
+from response_cache import CacheMiss
+from scrape_checkpoint import ScrapeCheckpoint
+
+stats_base_url = 'https://stats.nba.com/stats'
+
+# aiohttp can't decode brotli without an extra package, so only ask for encodings it understands
+async_headers = dict(nba_headers, **{'Accept-Encoding': 'gzip, deflate'})
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """A failure worth retrying: a throttle, server error, timeout, dropped connection or cut off body."""
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to capacity. Every request spends one token."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AdaptiveLimiter:
+    """
+    Caps the number of requests in flight and moves that cap with what the server tells us.
+
+    Every success with a latency under slow_latency adds 1 / limit to the limit (so about +1 per limit's worth of
+     requests) and speeds the token bucket up by 2%. Any error, throttle or slow response halves both, at most once per
+     cooldown seconds so a burst of failures from one bad moment only counts once.
+
+    max_rate: the most the token bucket can be sped back up to. Defaults to the bucket's starting rate, so the rate we
+     start with is a hard ceiling: the limiter only ever slows down from it and recovers back to it.
+    """
+
+    def __init__(self, bucket, initial=4, minimum=1, maximum=32, slow_latency=5.0, cooldown=2.0, max_rate=None):
+        self.bucket = bucket
+        self.max_rate = max_rate if max_rate is not None else bucket.rate
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_latency = slow_latency
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        await self.bucket.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, latency, ok):
+        # Smoothed latency so one slow response doesn't swing the estimate too far
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if ok and latency < self.slow_latency:
+            self.successes += 1
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.bucket.rate = min(self.max_rate, self.bucket.rate * 1.02)
+            return
+        if not ok:
+            self.failures += 1
+        now = time.monotonic()
+        if now - self.last_decrease >= self.cooldown:
+            self.last_decrease = now
+            self.limit = max(self.minimum, self.limit / 2)
+            self.bucket.rate = max(0.2, self.bucket.rate / 2)
+
+    def stats(self):
+        return {
+            'limit': round(self.limit, 2),
+            'rate': round(self.bucket.rate, 2),
+            'latency': self.latency,
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter: a random wait between 0 and base * 2^attempt (capped)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AsyncScraper:
+    """
+    Pooled, rate controlled client for the stats.nba.com endpoints.
+
+    Use it as an async context manager, or call the synchronous scrape_players helper below.
+
+    rate: requests per second to start at. The request rate never goes above max_rate, which defaults to rate.
+    """
+
+    def __init__(self, base_url=stats_base_url, headers=None, rate=5.0, initial_concurrency=4, max_concurrency=32,
+                 retries=5, timeout=30, backoff_base=1.0, backoff_cap=60.0, slow_latency=5.0, cache=None, offline=False,
+                 max_rate=None, cooldown=2.0):
+        self.base_url = base_url.rstrip('/')
+        # Optional ResponseCache, checked before any request goes out
+        self.cache = cache
+        self.offline = offline
+        self.headers = headers or async_headers
+        self.bucket = TokenBucket(rate)
+        self.limiter = AdaptiveLimiter(
+            self.bucket, initial=initial_concurrency, maximum=max_concurrency, slow_latency=slow_latency,
+            cooldown=cooldown, max_rate=max_rate
+        )
+        self.retries = retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.session = None
+
+    async def __aenter__(self):
+        # One connector for the whole run, so connections stay open and get reused between requests
+        connector = aiohttp.TCPConnector(limit=self.limiter.maximum, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(headers=self.headers, timeout=self.timeout, connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _request(self, endpoint, params):
+        url = '{}/{}'.format(self.base_url, endpoint)
+        async with self.limiter:
+            start = time.monotonic()
+            try:
+                async with self.session.get(url, params=params) as response:
+                    if response.status in retry_statuses:
+                        raise TransientError('HTTP {}'.format(response.status))
+                    response.raise_for_status()
+                    payload = await response.json(content_type=None)
+            # A body cut off mid-transfer shows up as a payload error, or as a ValueError when what did arrive isn't
+            #  valid JSON. Either way the next attempt can get the whole thing
+            except (TransientError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                    aiohttp.ServerTimeoutError, asyncio.TimeoutError, ValueError) as e:
+                self.limiter.record(time.monotonic() - start, ok=False)
+                count('async_scraper.transient_errors')
+                raise TransientError(str(e) or type(e).__name__) from e
+            self.limiter.record(time.monotonic() - start, ok=True)
+            return payload
+
+    @instrumented()
+    async def fetch(self, endpoint, params):
+        """Fetch one endpoint payload, retrying transient failures with jittered backoff."""
+        if self.cache is not None:
+            payload = self.cache.get(endpoint, params, allow_stale=self.offline)
+            if payload is not None:
+                return payload
+            if self.offline:
+                raise CacheMiss('{} {} is not in the cache'.format(endpoint, params))
+        for attempt in range(self.retries):
+            try:
+                payload = await self._request(endpoint, params)
+                if self.cache is not None:
+                    self.cache.put(endpoint, params, payload)
+                return payload
+            except TransientError:
+                if attempt + 1 == self.retries:
+                    raise
+                count('async_scraper.retries')
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+
+    async def fetch_frame(self, endpoint, params):
+        payload = await self.fetch(endpoint, params)
+        frames = frames_from_payload(payload)
+        return frames[endpoint_result_sets[endpoint]] if endpoint in endpoint_result_sets else payload
+
+    async def fetch_players(self, endpoint, player_ids, on_result):
+        """Fetch endpoint for every player. on_result(player_id, df, error) is called as each one finishes."""
+        async def one(player_id):
+            try:
+                df = await self.fetch_frame(endpoint, player_params(endpoint, player_id))
+            except Exception as e:
+                count('async_scraper.failed_players')
+                on_result(player_id, None, e)
+                return
+            on_result(player_id, df, None)
+
+        await asyncio.gather(*(one(player_id) for player_id in player_ids))
+
+
+def scrape_players(player_ids, endpoint='playercareerstats', checkpoint_dir=None, retry_failed=True, sink=None,
+                   **scraper_kwargs):
+    """
+    Synchronous entry point: scrape one endpoint for every player and return the combined dataframe.
+
+    checkpoint_dir and sink work the same way as in scraper.get_player_career_stats, so an async run can resume a thread
+     pool run and the other way around. With a sink the result is a ShardedDataset.
+    """
+    player_ids = list(player_ids)
+    checkpoint = ScrapeCheckpoint(checkpoint_dir) if checkpoint_dir is not None else None
+    todo = checkpoint.pending(player_ids, retry_failed=retry_failed) if checkpoint is not None else player_ids
+    results = []
+
+    def on_result(player_id, df, error):
+        if error is not None:
+            print(f"Error fetching {endpoint} for player ID {player_id}: {error}")
+        if checkpoint is not None:
+            if df is not None:
+                checkpoint.record_done(player_id, df)
+            else:
+                checkpoint.record_failed(player_id, error)
+        elif df is not None and sink is not None:
+            sink.append(df)
+        elif df is not None:
+            results.append(df)
+
+    async def run():
+        async with AsyncScraper(**scraper_kwargs) as scraper:
+            await scraper.fetch_players(endpoint, todo, on_result)
+            print(f"Scraped {len(todo)} players: {scraper.limiter.stats()}")
+
+    asyncio.run(run())
+
+    if checkpoint is not None and sink is not None:
+        checkpoint.write_results(sink, player_ids)
+    if sink is not None:
+        return sink.dataset()
+    if checkpoint is not None:
+        return checkpoint.load_results(player_ids)
+    results = [df for df in results if not df.empty]
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
@@ -0,0 +1,146 @@
+"""
+Walk-forward backtest for the player comparison projection in tutorial/fantasy_model.py.
+
+fantasy_model.py ends with "Compare to actuals to see accuracy", but nothing ever did. Backtest replays history one
+ season at a time: for every season it projects the following season for each player, using only seasons before it as
+ neighbors (so the neighbors' "next seasons" are at latest the season we project from), and scores the projections
+ against what actually happened, per stat (MAE / RMSE) and in fantasy points.
+
+The expensive part is the neighbor search, and it doesn't depend on k or the weighting. So for each min_gp cutoff we
+ search once for the k_max nearest neighbors of every player, with the seasons spread over a process pool, and keep the
+ result. Every k <= k_max and every weighting is then just a slice of those neighbors and a weighted average, which is
+ what makes sweeping k, weighting and min_gp across all seasons cheap.
+
+The players we score on are fixed by eval_min_gp (played more than that many games in both seasons), no matter which
+ min_gp the model uses, so the numbers from different cutoffs are comparable. min_gp only decides which seasons go into
+ the normalization and can be picked as neighbors.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from normalization import fit_group_stats
+from projection import parallel_top_k, weighted_projection
+from scoring import fantasy_points
+from season_store import SeasonStore
+from similarity import SimilarityEngine, feature_matrix, stats
+
+
+class Backtest:
+
+    def __init__(self, df, k_max=20, metric='mean_abs', eval_min_gp=10, first_season=None, workers=None):
+        """
+        df: per season stats with raw stat columns and gp, e.g. player_general_traditional_per_game_data.csv with the
+         empty rows dropped but no games played cutoff applied yet
+        k_max: largest k we'll ask for. Neighbors are searched once at this size.
+        first_season: first season to project from. Defaults to the second season in the data, since the first one has
+         no earlier seasons to borrow neighbors from.
+        workers: processes for the neighbor search, see projection.parallel_top_k
+        """
+        self.store = SeasonStore(df)
+        self.df = self.store.df
+        self.k_max = k_max
+        self.metric = metric
+        self.workers = workers
+        self.gp = self.df['gp'].to_numpy(dtype=np.float64)
+        self.next_gp = np.where(self.store.next_rows >= 0, self.gp[np.maximum(self.store.next_rows, 0)], np.nan)
+
+        first_code = self.store.season_codes[first_season] if first_season is not None else 1
+        # The last season has nothing after it to score against
+        self.season_codes = list(range(max(first_code, 1), self.store.n_seasons - 1))
+        self.eval_rows = {
+            code: np.flatnonzero(
+                (self.store.season_index == code) & (self.gp > eval_min_gp) & (self.next_gp > eval_min_gp)
+            )
+            for code in self.season_codes
+        }
+        self.actuals = {
+            code: self.store.gather(self.store.next_rows[rows], stats) for code, rows in self.eval_rows.items()
+        }
+        self._neighbors = {}
+
+    def engine(self, min_gp):
+        """Engine over every row, normalized by season with the min / max of the rows that pass min_gp."""
+        kept = self.gp > min_gp
+        season_stats, _ = fit_group_stats(self.df[kept], stats, by='season_id')
+        df_normalized = season_stats.transform(self.df, method='minmax')
+        return SimilarityEngine(matrix=feature_matrix(df_normalized), metric=self.metric)
+
+    def neighbors(self, min_gp=10):
+        """{season code: (neighbor rows, distances)} at k_max for a cutoff, searched once and then reused."""
+        if min_gp not in self._neighbors:
+            engine = self.engine(min_gp)
+            # A neighbor has to pass the cutoff in its own season and the next one, like in the filtered model data
+            usable = (self.gp > min_gp) & (self.next_gp > min_gp)
+            tasks = [(self.eval_rows[code], usable & (self.store.season_index < code)) for code in self.season_codes]
+            results = parallel_top_k(engine, tasks, k=self.k_max, workers=self.workers)
+            self._neighbors[min_gp] = dict(zip(self.season_codes, results))
+        return self._neighbors[min_gp]
+
+    def run(self, k=10, weighting='inverse', min_gp=10):
+        """
+        Project and score every season.
+
+        Returns (summary, by_season). summary has one row per stat plus a fantasy_pts row with the MAE, RMSE and bias
+         (mean of projected - actual) over every projected player. by_season has the same numbers for each season.
+        """
+        if k > self.k_max:
+            raise ValueError('k {} is bigger than k_max {}'.format(k, self.k_max))
+        neighbors = self.neighbors(min_gp)
+        projected, actual, seasons = [], [], []
+        for code in self.season_codes:
+            neighbor_rows, neighbor_distances = neighbors[code]
+            projected.append(weighted_projection(
+                self.store, neighbor_rows[:, :k], neighbor_distances[:, :k],
+                max_season=self.store.seasons[code], weighting=weighting
+            ))
+            actual.append(self.actuals[code])
+            seasons.append(np.full(len(self.eval_rows[code]), code))
+        projected = np.concatenate(projected)
+        actual = np.concatenate(actual)
+        seasons = np.concatenate(seasons)
+
+        df_projected = pd.DataFrame(projected, columns=stats)
+        df_actual = pd.DataFrame(actual, columns=stats)
+        df_projected['fantasy_pts'] = fantasy_points(df_projected)
+        df_actual['fantasy_pts'] = fantasy_points(df_actual)
+        errors = df_projected - df_actual
+
+        summary = error_table(errors)
+        season_ids = pd.Series(np.asarray(self.store.seasons)[seasons], name='season_id')
+        by_season = errors.groupby(season_ids).apply(error_table)
+        return summary, by_season
+
+    def sweep(self, ks=(5, 10, 15, 20), weightings=('inverse', 'rank', 'uniform'), min_gps=(5, 10, 20)):
+        """
+        Backtest every combination of k, weighting and min_gp.
+
+        Returns one row per combination with the fantasy_pts MAE / RMSE / bias and the MAE averaged over the 14 stats,
+         sorted from the lowest fantasy_pts MAE.
+        """
+        rows = []
+        for min_gp, k, weighting in itertools.product(min_gps, ks, weightings):
+            summary, _ = self.run(k=k, weighting=weighting, min_gp=min_gp)
+            rows.append({
+                'min_gp': min_gp,
+                'k': k,
+                'weighting': weighting,
+                'fantasy_mae': summary.loc['fantasy_pts', 'mae'],
+                'fantasy_rmse': summary.loc['fantasy_pts', 'rmse'],
+                'fantasy_bias': summary.loc['fantasy_pts', 'bias'],
+                'stat_mae': summary.loc[stats, 'mae'].mean(),
+                'players': int(summary.loc['fantasy_pts', 'n']),
+            })
+        return pd.DataFrame(rows).sort_values('fantasy_mae', kind='stable').reset_index(drop=True)
+
+
+def error_table(errors):
+    """MAE / RMSE / bias / count for every column of a dataframe of projected - actual errors."""
+    return pd.DataFrame({
+        'mae': errors.abs().mean(),
+        'rmse': np.sqrt((errors ** 2).mean()),
+        'bias': errors.mean(),
+        'n': errors.count(),
+    })
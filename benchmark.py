@@ -0,0 +1,328 @@
+"""
+Benchmarks for every stage of the projection and ranking pipeline.
+
+Each stage is timed (best of --repeat runs) and then run once more under tracemalloc to get its peak memory: loading the
+ per game CSV (plain pd.read_csv and a warm read_csv_cached), cleaning and the gp filter, per season normalization,
+ building the SeasonStore and feature matrix, distances from a few players to every season, top-k neighbor ranking,
+ the weighted projection, season_ranking.ipynb's combined z-score ranking index and the lookups it answers.
+
+The stages run on the real CSVs (scale 1) and on synthetic copies at 10x, 100x and 1000x. A synthetic copy repeats every
+ player scale times under new ids, with a little multiplicative noise on the stats, so it has the same schema, seasons
+ and distributions as the real data. Generated CSVs are kept in bench_data/ and reused by later runs.
+
+Results are compared against a baseline JSON (written with --save-baseline): a stage more than --tolerance times slower
+ than its baseline is flagged, and so is any stage whose result checksum changed or that the baseline has no entry for.
+ The script exits with status 1 when anything is flagged. benchmark_baseline.json holds the scale 1, 10 and 100 results
+ from a reference run; timings from another machine are best compared against a baseline saved there first.
+
+    python benchmark.py
+    python benchmark.py --scales 1 10 100 1000 --repeat 1
+    python benchmark.py --save-baseline
+
+1000x is about 10 million player seasons and needs several GB of memory.
+"""
+
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from csv_cache import read_csv_cached
+from loaders import load_career_stats, load_player_info
+from normalization import normalize
+from projection import weighted_projection
+from ranking import RankingIndex, combined_score
+from season_store import SeasonStore
+from similarity import SimilarityEngine, stats
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+per_game_csv = os.path.join(repo_folder, 'nba-stats-csv', 'player_general_traditional_per_game_data.csv')
+career_csv = os.path.join(repo_folder, 'df_player_career_stats.csv')
+player_info_csv = os.path.join(repo_folder, 'df_player_info.csv')
+data_folder = os.path.join(repo_folder, 'bench_data')
+baseline_file = os.path.join(repo_folder, 'benchmark_baseline.json')
+
+# Synthetic players get ids above every real one: copy c of player p is p + c * id_offset
+id_offset = 10000000
+
+# The stats season_ranking.ipynb turns into z-scores
+ranking_stats = ['min', 'fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'ast', 'stl', 'tov', 'blk', 'pts']
+position_mapping = {
+    'Guard': 'Guard', 'Forward': 'Forward', 'Center': 'Center', 'Guard-Forward': 'Guard', 'Forward-Guard': 'Forward',
+    'Forward-Center': 'Forward', 'Center-Forward': 'Center',
+}
+
+
+def scale_frame(df, scale, id_col, noisy_cols, seed=0):
+    """
+    Stack scale copies of df, giving each copy new ids and multiplying noisy_cols by lognormal noise (about +-10%).
+
+    The first copy is the original data unchanged.
+    """
+    if scale == 1:
+        return df.copy()
+    rng = np.random.default_rng(seed)
+    copies = [df]
+    noisy_cols = [col for col in noisy_cols if col in df.columns]
+    for copy in range(1, scale):
+        df_copy = df.copy()
+        df_copy[id_col] = df_copy[id_col] + copy * id_offset
+        noise = rng.lognormal(0, 0.1, size=(len(df_copy), len(noisy_cols)))
+        df_copy[noisy_cols] = df_copy[noisy_cols].to_numpy(dtype=np.float64) * noise
+        copies.append(df_copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def synthetic_data(scale, folder=data_folder, seed=0):
+    """Paths to the per game, career stats and player info CSVs at a scale, generating them the first time."""
+    if scale == 1:
+        return {'per_game': per_game_csv, 'career': career_csv, 'player_info': player_info_csv}
+    os.makedirs(folder, exist_ok=True)
+    paths = {
+        name: os.path.join(folder, '{}_x{}.csv'.format(name, scale)) for name in ['per_game', 'career', 'player_info']
+    }
+    if not all(os.path.exists(path) for path in paths.values()):
+        print(f"Generating {scale}x synthetic data in {folder}")
+        per_game = scale_frame(pd.read_csv(per_game_csv), scale, 'player_id', stats, seed)
+        career = pd.read_csv(career_csv)
+        career = scale_frame(career, scale, 'PLAYER_ID', [col.upper() for col in ranking_stats], seed)
+        player_info = scale_frame(pd.read_csv(player_info_csv), scale, 'PERSON_ID', [], seed)
+        # Write to a temporary name first so a run that gets cut off doesn't leave a half written CSV behind
+        for name, df in [('per_game', per_game), ('career', career), ('player_info', player_info)]:
+            df.to_csv(paths[name] + '.tmp', index=False)
+            os.replace(paths[name] + '.tmp', paths[name])
+    return paths
+
+
+def stage_load_csv(ctx):
+    return pd.read_csv(ctx['paths']['per_game'])
+
+
+def stage_load_cached(ctx):
+    return read_csv_cached(ctx['paths']['per_game'], cache_dir=ctx['cache_dir'])
+
+
+def stage_clean(ctx):
+    df = ctx['load_csv'].dropna(how='all')
+    return df[df['gp'] > ctx['min_gp']]
+
+
+def stage_normalize(ctx):
+    return normalize(ctx['clean'], stats, by='season_id', method='minmax')[0]
+
+
+def stage_season_store(ctx):
+    return SeasonStore(ctx['normalize'])
+
+
+def stage_feature_matrix(ctx):
+    return SimilarityEngine(ctx['season_store'].df)
+
+
+def stage_distances(ctx):
+    engine = ctx['feature_matrix']
+    return np.stack([engine.distances(engine.matrix[row]) for row in ctx['query_rows'][:ctx['n_distance_queries']]])
+
+
+def stage_neighbors(ctx):
+    return ctx['feature_matrix'].top_k_rows(ctx['query_rows'], k=10)
+
+
+def stage_projection(ctx):
+    neighbor_rows, neighbor_distances = ctx['neighbors']
+    return weighted_projection(ctx['season_store'], neighbor_rows, neighbor_distances)
+
+
+def stage_ranking(ctx):
+    """season_ranking.ipynb from the scrubbing cell through building the ranking index."""
+    df_stats = ctx['career'].copy()
+    df_player_info = ctx['player_info']
+    df_stats.columns = df_stats.columns.str.lower()
+    df_stats = df_stats.dropna(how='all')
+    df_stats = df_stats[df_stats['gp'] >= 10]
+    df_stats = df_stats[df_stats['season_start'] >= 1979]
+    gp = df_stats['gp'].to_numpy(dtype=np.float64)
+    for stat in ranking_stats:
+        df_stats[stat] = df_stats[stat].to_numpy(dtype=np.float64) / gp
+    positions = pd.DataFrame({
+        'player_id': df_player_info['PERSON_ID'],
+        'position': df_player_info['POSITION'].map(position_mapping),
+    })
+    df_stats = df_stats.merge(positions, on='player_id', how='left')
+    df_stats, _ = normalize(df_stats, ranking_stats, by=['season_id', 'position'], method='zscore')
+    df_stats['combined_score'] = combined_score(df_stats)
+    return RankingIndex(df_stats)
+
+
+def stage_ranking_queries(ctx):
+    """The notebook's interactive lookups: the top 25 overall, the top 25 of the latest season and 100 players' seasons."""
+    ranking = ctx['ranking']
+    frames = [ranking.top(25), ranking.top(25, season_id=ranking.seasons[-1])]
+    step = max(1, len(ranking.player_ids) // 100)
+    frames.extend(ranking.player_seasons(player_id) for player_id in ranking.player_ids[::step])
+    return pd.concat(frames)
+
+
+# Stages in the order they run. Each one's result is stored under its name for the stages after it.
+stages = [
+    ('load_csv', stage_load_csv),
+    ('load_cached', stage_load_cached),
+    ('clean', stage_clean),
+    ('normalize', stage_normalize),
+    ('season_store', stage_season_store),
+    ('feature_matrix', stage_feature_matrix),
+    ('distances', stage_distances),
+    ('neighbors', stage_neighbors),
+    ('projection', stage_projection),
+    ('ranking', stage_ranking),
+    ('ranking_queries', stage_ranking_queries),
+]
+
+
+def checksum(result):
+    """A number summarizing a stage's output, so a change in results shows up next to a change in speed."""
+    if isinstance(result, tuple):
+        return float(sum(checksum(part) for part in result))
+    if isinstance(result, SeasonStore):
+        return float(result.next_rows.sum())
+    if isinstance(result, SimilarityEngine):
+        result = result.matrix
+    if isinstance(result, RankingIndex):
+        result = result.ranks()
+    if isinstance(result, pd.DataFrame):
+        result = result.select_dtypes('number').to_numpy(dtype=np.float64)
+    values = np.asarray(result, dtype=np.float64)
+    return float(np.nansum(np.where(np.isfinite(values), values, 0)))
+
+
+def rows_of(result):
+    if isinstance(result, tuple):
+        return rows_of(result[0])
+    return len(result)
+
+
+def time_stage(fn, ctx, repeat=3, memory=True):
+    """Best time over repeat runs, plus peak traced memory in MB from one extra run when memory is on."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn(ctx)
+        seconds.append(time.perf_counter() - start)
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn(ctx)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return result, min(seconds), peak_mb
+
+
+def run_scale(scale, repeat=3, memory=True, min_gp=10, n_queries=256, n_distance_queries=8, seed=0):
+    """Run every stage at one scale and return a list of result dicts."""
+    paths = synthetic_data(scale, seed=seed)
+    ctx = {
+        'paths': paths,
+        'cache_dir': os.path.join(data_folder, '.csv_cache'),
+        'min_gp': min_gp,
+        'n_distance_queries': n_distance_queries,
+    }
+    # Warm the binary cache so load_cached measures the repeat-run case, and load the ranking inputs untimed
+    read_csv_cached(paths['per_game'], cache_dir=ctx['cache_dir'])
+    ctx['career'] = load_career_stats(paths['career'])
+    ctx['player_info'] = load_player_info(paths['player_info'])
+
+    results = []
+    for name, fn in stages:
+        if name == 'distances':
+            # Query with the latest season's players, the ones we would be projecting
+            store = ctx['season_store']
+            ctx['query_rows'] = np.flatnonzero(store.season_index == store.n_seasons - 1)[:n_queries]
+        result, seconds, peak_mb = time_stage(fn, ctx, repeat=repeat, memory=memory)
+        ctx[name] = result
+        results.append({
+            'scale': scale,
+            'stage': name,
+            'rows': rows_of(result),
+            'seconds': seconds,
+            'peak_mb': peak_mb,
+            'checksum': checksum(result),
+        })
+        peak = '' if peak_mb is None else f", peak {peak_mb:.1f} MB"
+        print(f"{scale}x {name}: {seconds:.4f}s{peak}")
+    return results
+
+
+def compare(results, baseline, tolerance=1.5, min_seconds=0.01, require_baseline=True):
+    """
+    Add baseline_seconds / ratio / flags columns. ratio is seconds / baseline seconds.
+
+    Stages have to be at least min_seconds slower as well as tolerance times slower to be flagged, so millisecond stages
+     don't get flagged for timer noise.
+    require_baseline: flag stages the baseline has no entry for, so a missing baseline can't pass as no regressions
+    """
+    df = pd.DataFrame(results)
+    base = {(entry['scale'], entry['stage']): entry for entry in baseline}
+    df['baseline_seconds'] = [base.get((s, name), {}).get('seconds') for s, name in zip(df['scale'], df['stage'])]
+    df['ratio'] = df['seconds'] / df['baseline_seconds'].astype(np.float64)
+    flags = []
+    for row in df.itertuples():
+        entry = base.get((row.scale, row.stage))
+        flag = []
+        if entry is None and require_baseline:
+            flag.append('no baseline')
+        if entry is not None and row.ratio > tolerance and row.seconds - entry['seconds'] > min_seconds:
+            flag.append('slower')
+        if entry is not None and not np.isclose(row.checksum, entry['checksum'], rtol=1e-6, atol=1e-9):
+            flag.append('result changed')
+        flags.append(', '.join(flag))
+    df['flags'] = flags
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--baseline', default=baseline_file)
+    parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='flag stages this many times slower')
+    parser.add_argument('--output', help='optional CSV to write the results table to')
+    args = parser.parse_args(argv)
+
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale, repeat=args.repeat, memory=not args.no_memory))
+
+    baseline = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save_baseline:
+        print(f"No baseline at {args.baseline}, so every stage is flagged. Write one with --save-baseline")
+    df = compare(results, baseline, tolerance=args.tolerance, require_baseline=not args.save_baseline)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(df.drop(columns=['checksum']).round(4).to_string(index=False))
+    if args.output:
+        df.to_csv(args.output, index=False)
+
+    if args.save_baseline:
+        # Keep baseline entries for scales we didn't run this time
+        ran = {(entry['scale'], entry['stage']) for entry in results}
+        kept = [entry for entry in baseline if (entry['scale'], entry['stage']) not in ran]
+        with open(args.baseline, 'w') as f:
+            json.dump(kept + results, f, indent=1)
+        print(f"Saved baseline to {args.baseline}")
+    return 1 if (df['flags'] != '').any() else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,230 @@
+"""
+Consensus projections from every projection source in nba-stats-csv.
+
+The FantasyPros sheets (ESPN_CBS_... and Hashtag_CBS_...Average_Projections.csv) name players and teams but have no ids,
+ and the model's projections (player_proj_df.csv, 2018_19_projections_*.csv) have ids, sometimes names, and proj_*
+ columns. They used to be combined with a chain of pd.merge calls on names, with manual cleanup every time a spelling
+ didn't line up.
+
+Here every source is resolved onto one set of player keys:
+
+- PlayerKeys holds one key per player, found by player_id, by folded name (name_search.fold_name, so accents, case and
+  punctuation don't matter) or by name and team when two players share a name. Names that don't match a key exactly
+  are looked up in the NameIndex to find their player_id, so 'Nikola Jokić' and 'Nikola Jokic' land on the same key.
+- Consensus standardizes each source to the same stat columns, resolves its rows to key codes with those dict lookups and
+  keeps the values as one (rows x stats) array. Adding a source is one pass over its rows.
+- consensus() scatters every source into a (players x sources x stats) array and takes the weighted average over the
+  sources that have each stat, all in one vectorized pass.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from name_search import build_name_index, fold_name
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+
+# Stat columns of the consensus table. Sources only need some of them: each stat is averaged over the sources that have it.
+consensus_stats = [
+    'gp', 'min', 'pts', 'fgm', 'fga', 'fg_pct', 'fg3m', 'fg3a', 'ftm', 'fta', 'ft_pct', 'oreb', 'dreb', 'reb', 'ast', 'stl',
+    'tov', 'blk',
+]
+
+fantasypros_columns = {
+    'GP': 'gp', 'MIN': 'min', 'PTS': 'pts', 'FG%': 'fg_pct', '3PM': 'fg3m', 'FT%': 'ft_pct', 'REB': 'reb', 'AST': 'ast',
+    'STL': 'stl', 'TO': 'tov', 'BLK': 'blk',
+}
+model_columns = {'proj_' + col: col for col in consensus_stats}
+
+# (name, csv, id column, name column, team column, stat columns, weight) for the sources we combine by default.
+# 2018_19_projections_no_player_name.csv / _plus_real_player_name.csv hold the same model projections as player_proj_df.csv,
+# so they're left out rather than counted twice.
+projection_sources = [
+    ('espn_cbs', 'nba-stats-csv/ESPN_CBS_FantasyPros_Fantasy_Basketball_Overall_2018_Average_Projections.csv',
+     None, 'Player', 'Team', fantasypros_columns, 1.0),
+    ('hashtag_cbs', 'nba-stats-csv/Hashtag_CBS_FantasyPros_Fantasy_Basketball_Overall_2018_Average_Projections.csv',
+     None, 'Player', 'Team', fantasypros_columns, 1.0),
+    ('model', 'nba-stats-csv/player_proj_df.csv', 'player_id', 'player_name', None, model_columns, 1.0),
+]
+
+
+def standardize_stats(df, columns):
+    """
+    A float array (rows x consensus_stats) from df's stat columns, renamed with columns. Rebounds and percentages are
+     worked out from their parts when a source only has the parts.
+    """
+    stats = pd.DataFrame(index=df.index)
+    for source_col, col in columns.items():
+        if source_col in df.columns:
+            stats[col] = pd.to_numeric(df[source_col], errors='coerce')
+    if 'reb' not in stats and {'oreb', 'dreb'} <= set(stats.columns):
+        stats['reb'] = stats['oreb'] + stats['dreb']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if 'fg_pct' not in stats and {'fgm', 'fga'} <= set(stats.columns):
+            stats['fg_pct'] = stats['fgm'] / stats['fga']
+        if 'ft_pct' not in stats and {'ftm', 'fta'} <= set(stats.columns):
+            stats['ft_pct'] = stats['ftm'] / stats['fta']
+    return stats.reindex(columns=consensus_stats).to_numpy(dtype=np.float64)
+
+
+class PlayerKeys:
+    """
+    One key (an integer code) per player, with the player_id, name and team we know for it.
+
+    Keys found only by a name that doesn't resolve to a player_id get player_id -1, and later sources with the same
+     folded name land on the same key.
+    """
+
+    def __init__(self, name_index=None):
+        self._name_index = name_index
+        self.player_ids = []
+        self.names = []
+        self.teams = []
+        self.by_id = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    @property
+    def name_index(self):
+        # Only built the first time a name needs resolving to an id
+        if self._name_index is None:
+            self._name_index = build_name_index()
+        return self._name_index
+
+    def _new(self, player_id, name, team):
+        code = len(self.player_ids)
+        self.player_ids.append(-1 if player_id is None else int(player_id))
+        self.names.append(name)
+        self.teams.append(team)
+        if player_id is not None:
+            self.by_id[int(player_id)] = code
+        if name is not None:
+            self.by_name.setdefault(fold_name(name), []).append(code)
+        return code
+
+    def _fill(self, code, name, team):
+        if self.names[code] is None and name is not None:
+            self.names[code] = name
+            self.by_name.setdefault(fold_name(name), []).append(code)
+        if self.teams[code] is None and team is not None:
+            self.teams[code] = team
+
+    def code(self, player_id=None, name=None, team=None):
+        """Key code for a player, adding a key if we haven't seen him."""
+        if player_id is not None:
+            code = self.by_id.get(int(player_id))
+            if code is None:
+                code = self._new(player_id, name, team)
+            self._fill(code, name, team)
+            return code
+
+        codes = self.by_name.get(fold_name(name), [])
+        if team is not None:
+            # A key on another team is a different player with the same name, unless the NameIndex says otherwise below
+            codes = [code for code in codes if self.teams[code] in (None, team)]
+        if codes:
+            self._fill(codes[0], None, team)
+            return codes[0]
+
+        player_id = self.name_index.resolve(name)
+        if player_id is not None:
+            return self.code(player_id, name, team)
+        return self._new(None, name, team)
+
+    def codes(self, player_ids=None, names=None, teams=None):
+        """code for every row of a source, as an int array."""
+        n = len(next(values for values in [player_ids, names, teams] if values is not None))
+        player_ids = [None] * n if player_ids is None else player_ids
+        names = [None] * n if names is None else names
+        teams = [None] * n if teams is None else teams
+        return np.array([
+            self.code(
+                None if player_id is None or pd.isna(player_id) else player_id,
+                name if isinstance(name, str) else None,
+                team if isinstance(team, str) else None,
+            )
+            for player_id, name, team in zip(player_ids, names, teams)
+        ], dtype=np.int64)
+
+    def frame(self):
+        return pd.DataFrame({'player_id': self.player_ids, 'player_name': self.names, 'team': self.teams})
+
+
+class Consensus:
+    """Projection sources resolved onto PlayerKeys, combined with per source weights."""
+
+    def __init__(self, keys=None):
+        self.keys = keys if keys is not None else PlayerKeys()
+        self.sources = []
+        self.weights = {}
+        self._codes = {}
+        self._values = {}
+
+    def add_source(self, name, df, id_col=None, name_col=None, team_col=None, columns=None, weight=1.0):
+        """
+        Resolve one projection source onto the player keys.
+
+        df: the source's rows. Rows without an id or a name (like the FantasyPros footer) are skipped, and when a player
+         shows up more than once the first row is kept.
+        columns: source column -> consensus_stats column, e.g. fantasypros_columns or model_columns
+        """
+        if id_col is None and name_col is None:
+            raise ValueError('Source {} needs an id column or a name column'.format(name))
+        key_col = id_col if id_col is not None else name_col
+        df = df[df[key_col].notna()]
+        codes = self.keys.codes(
+            df[id_col].tolist() if id_col is not None else None,
+            df[name_col].tolist() if name_col is not None and name_col in df.columns else None,
+            df[team_col].tolist() if team_col is not None and team_col in df.columns else None,
+        )
+        values = standardize_stats(df, columns or {col: col for col in consensus_stats})
+        codes, first = np.unique(codes, return_index=True)
+        if name not in self.weights:
+            self.sources.append(name)
+        self.weights[name] = weight
+        self._codes[name] = codes
+        self._values[name] = values[first]
+
+    def values(self, sources=None):
+        """Every source scattered onto the keys: a (players x sources x stats) array, NaN where a source has nothing."""
+        sources = sources or self.sources
+        values = np.full((len(self.keys), len(sources), len(consensus_stats)), np.nan)
+        for i, name in enumerate(sources):
+            values[self._codes[name], i] = self._values[name]
+        return values
+
+    def consensus(self, weights=None, min_sources=1):
+        """
+        Weighted average of every stat over the sources that have it.
+
+        weights: optional {source: weight} to override the weights the sources were added with
+        min_sources: leave out players covered by fewer sources than this
+        Returns the key columns, one column per stat, and sources (how many sources covered the player).
+        """
+        weights = dict(self.weights, **(weights or {}))
+        values = self.values()
+        source_weights = np.array([weights[name] for name in self.sources], dtype=np.float64)[None, :, None]
+        present = ~np.isnan(values)
+        total = (present * source_weights).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averaged = (np.where(present, values, 0) * source_weights).sum(axis=1) / total
+        df = self.keys.frame()
+        df[consensus_stats] = averaged
+        df['sources'] = present.any(axis=2).sum(axis=1)
+        return df[df['sources'] >= min_sources].reset_index(drop=True)
+
+
+def load_consensus(sources=None, folder=repo_folder, name_index=None):
+    """Consensus over (name, csv, id column, name column, team column, columns, weight) sources, by default all of them."""
+    consensus = Consensus(PlayerKeys(name_index))
+    for name, path, id_col, name_col, team_col, columns, weight in sources or projection_sources:
+        path = os.path.join(folder, path)
+        if not os.path.exists(path):
+            print(f"Skipping missing projection source {path}")
+            continue
+        consensus.add_source(name, pd.read_csv(path), id_col, name_col, team_col, columns, weight)
+    return consensus
@@ -0,0 +1,254 @@
+"""
+Binary columnar cache for the CSVs in this repo.
+
+Every script and notebook re-parses the same CSV files with pd.read_csv on every run. read_csv_cached parses a CSV once,
+ writes each column to its own .npy file (strings are stored as integer codes plus a table of unique values), and on
+ later runs loads those binary columns instead. The .npy files can be memory-mapped, so a load mostly costs a few file
+ opens.
+
+Each cache remembers the size, modified time and SHA-1 checksum of the CSV it came from. If the size or modified time
+ changes we re-check the checksum, and if the contents really changed the cache is rebuilt automatically.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+# Bump this whenever the on-disk layout changes so old caches get rebuilt
+format_version = 2
+
+cache_folder = '.csv_cache'
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def source_fingerprint(path, checksum=True):
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if checksum:
+        fingerprint['sha1'] = file_checksum(path)
+    return fingerprint
+
+
+# read_csv arguments that make it return a reader instead of a dataframe
+streaming_options = ['chunksize', 'iterator']
+
+
+def has_callable(value):
+    if callable(value):
+        return True
+    if isinstance(value, dict):
+        return any(has_callable(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(has_callable(item) for item in value)
+    return False
+
+
+def uncacheable_options(read_csv_kwargs):
+    """
+    The read_csv arguments a cache can't be keyed on, or can't stand in for.
+
+    Functions (converters, date_parser, ...) only have their repr to go on, which holds their memory address, so every
+     run would get a new cache folder. chunksize and iterator make read_csv return a reader rather than a dataframe.
+    """
+    return [
+        key for key, value in (read_csv_kwargs or {}).items()
+        if has_callable(value) or (key in streaming_options and value not in (None, False))
+    ]
+
+
+def cache_path(path, read_csv_kwargs=None, cache_dir=None):
+    """Where the cache for a CSV read with the given read_csv arguments lives."""
+    uncacheable = uncacheable_options(read_csv_kwargs)
+    if uncacheable:
+        raise ValueError("read_csv arguments {} can't be cached".format(uncacheable))
+    path = os.path.abspath(path)
+    options = json.dumps(read_csv_kwargs or {}, sort_keys=True, default=str)
+    options_hash = hashlib.sha1(options.encode()).hexdigest()[:10]
+    folder = cache_dir or os.path.join(os.path.dirname(path), cache_folder)
+    return os.path.join(folder, '{}-{}'.format(os.path.basename(path), options_hash))
+
+
+# Columnar frame format
+
+def write_frame(df, directory, extra_meta=None):
+    """
+    Write a dataframe as one .npy file per column plus a meta.json describing the columns.
+
+    An index other than the default 0..n-1 (e.g. from read_csv's index_col) is written as ordinary columns, and
+     meta.json records which ones, so read_frame gives back the same index.
+    The directory is written under a temporary name and renamed into place at the end, so a crash never leaves a half
+     written cache behind.
+    """
+    index = None
+    default_index = isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1
+    if not default_index or df.index.name is not None:
+        names = list(df.index.names)
+        df = df.reset_index()
+        index = {'columns': list(df.columns[:len(names)]), 'names': names}
+
+    directory = os.path.abspath(directory)
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp = os.path.join(parent, '.tmp-{}'.format(uuid.uuid4().hex))
+    os.makedirs(tmp)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        info = {'name': name, 'file': '{}.npy'.format(i)}
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            info['kind'] = 'category'
+            codes, categories = col.cat.codes.to_numpy(), col.cat.categories
+        elif col.dtype == object or pd.api.types.is_string_dtype(col.dtype):
+            info['kind'] = 'object'
+            codes, categories = pd.factorize(col, use_na_sentinel=True)
+        else:
+            info['kind'] = 'numeric'
+            info['dtype'] = str(col.dtype)
+            values = col.to_numpy()
+            if values.dtype.kind == 'M':
+                info['kind'] = 'datetime'
+                values = values.view('int64')
+            np.save(os.path.join(tmp, info['file']), np.ascontiguousarray(values))
+            columns.append(info)
+            continue
+
+        # Strings go to disk as small integer codes plus one unicode array of the unique values
+        codes = np.asarray(codes, dtype=np.int32 if len(categories) > 32767 else np.int16)
+        categories = pd.Index(categories)
+        info['categories_file'] = '{}_categories.npy'.format(i)
+        np.save(os.path.join(tmp, info['file']), codes)
+        if categories.inferred_type in ('string', 'empty'):
+            info['categories_dtype'] = 'str'
+            np.save(os.path.join(tmp, info['categories_file']), categories.to_numpy(dtype=str))
+        elif categories.dtype != object:
+            info['categories_dtype'] = str(categories.dtype)
+            np.save(os.path.join(tmp, info['categories_file']), categories.to_numpy())
+        else:
+            # A column mixing strings and numbers has to keep its python objects, so it can't be memory-mapped
+            info['categories_dtype'] = 'object'
+            np.save(os.path.join(tmp, info['categories_file']), categories.to_numpy(), allow_pickle=True)
+        columns.append(info)
+
+    meta = {'format_version': format_version, 'n_rows': len(df), 'columns': columns, 'index': index}
+    meta.update(extra_meta or {})
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp, directory)
+
+
+def read_meta(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        return json.load(f)
+
+
+def read_frame(directory, mmap=True, columns=None, meta=None):
+    """
+    Load a dataframe written by write_frame.
+
+    When mmap is True the column files are memory-mapped copy-on-write, so pages are only read when they're used and
+     editing the dataframe never touches the files on disk.
+    """
+    meta = meta or read_meta(directory)
+    mmap_mode = 'c' if mmap else None
+    index = meta.get('index')
+    if columns is not None and index is not None:
+        columns = list(columns) + index['columns']
+    data = {}
+    for info in meta['columns']:
+        if columns is not None and info['name'] not in columns:
+            continue
+        values = np.asarray(np.load(os.path.join(directory, info['file']), mmap_mode=mmap_mode))
+        if info['kind'] == 'numeric':
+            data[info['name']] = values
+        elif info['kind'] == 'datetime':
+            data[info['name']] = values.view('datetime64[ns]')
+        else:
+            categories = np.load(
+                os.path.join(directory, info['categories_file']), allow_pickle=info['categories_dtype'] == 'object'
+            )
+            if info['kind'] == 'category':
+                data[info['name']] = pd.Categorical.from_codes(values, categories=pd.Index(categories))
+            else:
+                # Plain string columns come back as object arrays, exactly like pd.read_csv returns them
+                strings = np.append(categories.astype(object), np.nan).take(values)
+                data[info['name']] = strings
+    df = pd.DataFrame(data, copy=False)
+    if index is not None:
+        df = df.set_index(index['columns'])
+        df.index.names = index['names']
+    return df
+
+
+# CSV cache
+
+def cache_is_fresh(path, meta):
+    """Check a cache against its source CSV. Returns (fresh, fingerprint to store if only the mtime moved)."""
+    if meta.get('format_version') != format_version:
+        return False, None
+    cached = meta.get('source', {})
+    current = source_fingerprint(path, checksum=False)
+    if current['size'] == cached.get('size') and current['mtime_ns'] == cached.get('mtime_ns'):
+        return True, None
+    if current['size'] != cached.get('size'):
+        return False, None
+    # Same size but a new modified time, e.g. after a git checkout. Only the checksum can tell us if it changed.
+    current['sha1'] = file_checksum(path)
+    return current['sha1'] == cached.get('sha1'), current
+
+
+@instrumented(rows=len)
+def read_csv_cached(path, cache_dir=None, mmap=True, refresh=False, **read_csv_kwargs):
+    """
+    Drop-in replacement for pd.read_csv(path, **read_csv_kwargs) backed by the binary columnar cache.
+
+    refresh: ignore any existing cache and rebuild it from the CSV
+    Arguments the cache can't handle (see uncacheable_options) skip it with a warning and go straight to pd.read_csv.
+    """
+    uncacheable = uncacheable_options(read_csv_kwargs)
+    if uncacheable:
+        warnings.warn("Not caching {}: read_csv arguments {} can't be cached".format(path, uncacheable))
+        return pd.read_csv(path, **read_csv_kwargs)
+    directory = cache_path(path, read_csv_kwargs, cache_dir)
+    if not refresh and os.path.exists(os.path.join(directory, 'meta.json')):
+        meta = read_meta(directory)
+        fresh, touched = cache_is_fresh(path, meta)
+        if fresh:
+            if touched is not None:
+                meta['source'] = touched
+                with open(os.path.join(directory, 'meta.json'), 'w') as f:
+                    json.dump(meta, f, indent=1)
+            return read_frame(directory, mmap=mmap, meta=meta)
+
+    df = pd.read_csv(path, **read_csv_kwargs)
+    try:
+        write_frame(df, directory, extra_meta={'source': source_fingerprint(path)})
+    except OSError as e:
+        # A read-only checkout shouldn't stop anyone from loading data, it just won't get faster
+        warnings.warn("Couldn't write CSV cache for {}: {}".format(path, e))
+    return df
+
+
+def clear_cache(path=None, cache_dir=None):
+    """Delete the cache folder next to a CSV (or the given cache_dir)."""
+    folder = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), cache_folder)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
@@ -0,0 +1,304 @@
+"""
+Live draft board and mock drafts for the projected fantasy points tables.
+
+projected_fanatasy_pts_with_positions_2018_19.csv has a value (fantasy_pts) and an ESPN position for every player, and
+ Fantasy Projections - 2018_19 - 2018_espn_draft.csv is the order the 2018 ESPN draft went in. During a draft the
+ question after every pick is the same: who's the best player left, relative to what the rest of the league still needs?
+
+Value over replacement (VOR) answers it: a player's value minus the value of the best player at his position who won't be
+ needed as a starter. If the league still has d starting slots to fill at a position, the replacement player is the
+ (d + 1)th best one left there. Both sides of that move with every pick, so DraftBoard keeps, for each position:
+
+- the players sorted from the most value to the least, plus a pointer to the first one still available (picked players
+  are only skipped when they reach the front, so removing one is O(1))
+- a Fenwick tree of which of those players are still available, so the (d + 1)th best remaining is an O(log n) search
+
+A pick updates those two structures for the player's positions and the demand for the slot he fills, so replacement
+ levels, VOR and the best available players come back in microseconds instead of a fresh sort of the pool.
+
+mock_drafts plays out thousands of snake drafts at once: every draft is a row of a (drafts x players) matrix of noisy
+ values, and each pick is one argmax over that matrix for the team on the clock.
+"""
+
+import numpy as np
+import pandas as pd
+
+from name_search import fold_name
+
+# Starting slots per team at each position. ESPN's standard lineup (PG, SG, SF, PF, C, G, F and three UTIL) works out to
+# about two per position. Positions not listed here (like the odd 'PC') have no starting demand.
+default_starters = {'PG': 2, 'SG': 2, 'SF': 2, 'PF': 2, 'C': 2}
+
+
+def load_draft_pool(path='nba-stats-csv/projected_fanatasy_pts_with_positions_2018_19.csv'):
+    """The projected points table with positions, with the merge's player_name_x / season_id_x columns renamed."""
+    df = pd.read_csv(path)
+    return df.rename(columns={'player_name_x': 'player_name', 'season_id_x': 'season_id'})
+
+
+def snake_order(teams, rounds):
+    """Team (0 based) making every pick of a snake draft: 0..teams-1, then back from teams-1 to 0, and so on."""
+    order = np.tile(np.arange(teams), (rounds, 1))
+    order[1::2] = order[1::2, ::-1]
+    return order.ravel()
+
+
+class DraftBoard:
+    """
+    State of one live draft over a player pool.
+
+    df: one row per player, with a value column, a position column ('PG', or 'PG/SG' for more than one) and optionally
+     names and ids to pick players by.
+    teams / rounds: league size, for the snake order.
+    starters: starting slots per team at each position, default_starters by default.
+    """
+
+    def __init__(self, df, teams=10, rounds=13, starters=None, value_col='fantasy_pts', position_col='espn_position',
+                 name_col='player_name', id_col='player_id'):
+        self.df = df.reset_index(drop=True)
+        self.teams = teams
+        self.rounds = rounds
+        self.starters = dict(starters or default_starters)
+        self.values = self.df[value_col].to_numpy(dtype=np.float64)
+        n = len(self.df)
+
+        eligible = [str(position).split('/') for position in self.df[position_col].fillna('').tolist()]
+        self.positions = sorted({position for positions in eligible for position in positions if position})
+        self.position_codes = {position: code for code, position in enumerate(self.positions)}
+        n_positions = len(self.positions)
+        self.eligible = [[self.position_codes[position] for position in positions if position] for positions in eligible]
+        # Eligible positions as a padded matrix, padding pointing at an extra always-infinite replacement level
+        width = max([len(codes) for codes in self.eligible] + [1])
+        self.eligible_matrix = np.full((n, width), n_positions, dtype=np.int64)
+        for row, codes in enumerate(self.eligible):
+            self.eligible_matrix[row, :len(codes)] = codes
+        self.slots = np.array([self.starters.get(position, 0) for position in self.positions], dtype=np.int64)
+
+        # Per position: rows from the most value to the least, each row's place in that order, and the Fenwick tree
+        self.orders = []
+        self.places = []
+        self.trees = []
+        for code in range(n_positions):
+            rows = np.array([row for row in range(n) if code in self.eligible[row]], dtype=np.int64)
+            rows = rows[np.argsort(-self.values[rows], kind='stable')]
+            self.orders.append(rows)
+            self.places.append({row: place for place, row in enumerate(rows.tolist())})
+            self.trees.append(self._fenwick(len(rows)))
+        self.heads = [0] * n_positions
+
+        self.row_by_id = {}
+        if id_col in self.df.columns:
+            self.row_by_id = {int(player_id): row for row, player_id in enumerate(self.df[id_col].tolist())}
+        self.row_by_name = {}
+        if name_col in self.df.columns:
+            for row, name in enumerate(self.df[name_col].tolist()):
+                self.row_by_name.setdefault(fold_name(name), row)
+        self.names = self.df[name_col].tolist() if name_col in self.df.columns else list(range(n))
+
+        self.available = np.ones(n, dtype=bool)
+        self.filled = np.zeros((teams, n_positions), dtype=np.int64)
+        self.order = snake_order(teams, rounds)
+        self.history = []
+
+    @staticmethod
+    def _fenwick(size):
+        # Every player starts out available: node i covers the (i & -i) places ending at place i (1 based)
+        tree = [0] * (size + 1)
+        for i in range(1, size + 1):
+            tree[i] = i & -i
+        return tree
+
+    def _fenwick_add(self, code, place, delta):
+        tree = self.trees[code]
+        i = place + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _kth_available(self, code, k):
+        """Place (in the position's order) of the kth best available player there, or None if fewer than k are left."""
+        tree = self.trees[code]
+        place, step = 0, 1 << (len(tree).bit_length())
+        while step:
+            nxt = place + step
+            if nxt < len(tree) and tree[nxt] < k:
+                place = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return place if place < len(tree) - 1 else None
+
+    def __len__(self):
+        return int(self.available.sum())
+
+    @property
+    def pick_number(self):
+        return len(self.history)
+
+    def team_on_clock(self):
+        return int(self.order[self.pick_number]) if self.pick_number < len(self.order) else None
+
+    def row_of(self, player):
+        """Row for a row number (int under the pool size), a player_id, or a name (accents and case don't matter)."""
+        if isinstance(player, (int, np.integer)):
+            if int(player) in self.row_by_id:
+                return self.row_by_id[int(player)]
+            if 0 <= player < len(self.df):
+                return int(player)
+        elif fold_name(player) in self.row_by_name:
+            return self.row_by_name[fold_name(player)]
+        raise ValueError('Unknown player {}'.format(player))
+
+    def demand(self):
+        """Starting slots still open across the league at every position."""
+        return np.maximum(self.slots - self.filled, 0).sum(axis=0)
+
+    def replacement_levels(self):
+        """
+        Replacement value at every position: the value of the first available player there past the open starting
+         slots, or 0 when the position will run out before its slots are filled.
+        """
+        levels = np.zeros(len(self.positions))
+        for code, demand in enumerate(self.demand().tolist()):
+            place = self._kth_available(code, demand + 1)
+            if place is not None:
+                levels[code] = self.values[self.orders[code][place]]
+        return levels
+
+    def vor(self, rows=None, levels=None):
+        """Value over replacement for rows (default every player), using each player's most favorable position."""
+        levels = self.replacement_levels() if levels is None else levels
+        padded = np.append(levels, np.inf)
+        rows = np.arange(len(self.df)) if rows is None else np.asarray(rows, dtype=np.int64)
+        return self.values[rows] - padded[self.eligible_matrix[rows]].min(axis=1)
+
+    def _available_at(self, code, n):
+        """The best n available rows at a position, moving the head pointer past players picked off the front."""
+        order = self.orders[code]
+        head = self.heads[code]
+        while head < len(order) and not self.available[order[head]]:
+            head += 1
+        self.heads[code] = head
+        rows = []
+        for row in order[head:].tolist():
+            if self.available[row]:
+                rows.append(row)
+                if len(rows) == n:
+                    break
+        return rows
+
+    def best_available(self, n=10, position=None, by='vor'):
+        """
+        The best n available players, overall or at one position, ranked by VOR (or by='value'), as a list of dicts with
+         row, name, positions, value and vor.
+        """
+        codes = range(len(self.positions)) if position is None else [self.position_codes[position]]
+        # Within a position VOR and value have the same order, so the best n overall are among each position's best n
+        rows = list({row for code in codes for row in self._available_at(code, n)})
+        if not rows:
+            return []
+        vor = self.vor(rows)
+        key = vor if by == 'vor' else self.values[rows]
+        best = np.argsort(-key, kind='stable')[:n]
+        return [
+            {
+                'row': rows[i],
+                'name': self.names[rows[i]],
+                'positions': '/'.join(self.positions[code] for code in self.eligible[rows[i]]),
+                'value': float(self.values[rows[i]]),
+                'vor': float(vor[i]),
+            }
+            for i in best.tolist()
+        ]
+
+    def pick(self, player, team=None, skip_unknown=False):
+        """
+        Take a player off the board for team (by default the team on the clock). The pick fills the team's first open
+         starting slot among the player's positions, if it has one.
+
+        skip_unknown: for players who aren't in the pool (rookies, injured players without a projection), still use up
+         the team's turn instead of raising, so the draft order stays right. Returns the row, or None for those picks.
+        """
+        team = self.team_on_clock() if team is None else team
+        try:
+            row = self.row_of(player)
+        except ValueError:
+            if not skip_unknown:
+                raise
+            self.history.append((None, team, None))
+            return None
+        if not self.available[row]:
+            raise ValueError('{} has already been picked'.format(self.names[row]))
+        self.available[row] = False
+        for code in self.eligible[row]:
+            self._fenwick_add(code, self.places[code][row], -1)
+        slot = None
+        for code in self.eligible[row]:
+            if self.filled[team, code] < self.slots[code]:
+                slot = code
+                self.filled[team, code] += 1
+                break
+        self.history.append((row, team, slot))
+        return row
+
+    def undo(self):
+        """Put the last pick back on the board."""
+        row, team, slot = self.history.pop()
+        if row is None:
+            return None
+        self.available[row] = True
+        for code in self.eligible[row]:
+            self._fenwick_add(code, self.places[code][row], 1)
+            self.heads[code] = min(self.heads[code], self.places[code][row])
+        if slot is not None:
+            self.filled[team, slot] -= 1
+        return row
+
+    def roster(self, team):
+        return [self.names[row] for row, pick_team, _ in self.history if pick_team == team and row is not None]
+
+
+def mock_drafts(board, n_drafts=1000, noise=2.0, seed=None):
+    """
+    Play out n_drafts snake drafts from the board's current state, all at once.
+
+    Every team takes the available player with the highest value plus Normal(0, noise) drafter disagreement, passing on
+     positions where it has already filled its starting slots while any position it still needs has players left.
+    Returns a dataframe with one row per player: how often he was drafted, his average draft position (over the drafts
+     he went in) and how often each team got him.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(board.df)
+    noisy = board.values[None, :] + rng.normal(0.0, noise, size=(n_drafts, n))
+    noisy[:, ~board.available] = -np.inf
+    # Players are treated as their first listed position for the starting slots
+    primary = board.eligible_matrix[:, 0]
+    has_position = primary < len(board.positions)
+    primary = np.where(has_position, primary, 0)
+    filled = np.repeat(board.filled[None, :, :], n_drafts, axis=0)
+    drafts = np.arange(n_drafts)
+
+    picked_at = np.full((n_drafts, n), -1, dtype=np.int64)
+    picked_by = np.full((n_drafts, n), -1, dtype=np.int64)
+    for pick in range(board.pick_number, len(board.order)):
+        team = board.order[pick]
+        # Positions this team still has open slots at, in every draft
+        open_slots = filled[:, team, :] < board.slots[None, :]
+        needed = open_slots[:, primary] & has_position[None, :]
+        scores = np.where(needed, noisy, noisy - 1e6)
+        rows = scores.argmax(axis=1)
+        valid = np.isfinite(noisy[drafts, rows])
+        rows, in_draft = rows[valid], drafts[valid]
+        picked_at[in_draft, rows] = pick + 1
+        picked_by[in_draft, rows] = team
+        noisy[in_draft, rows] = -np.inf
+        codes = primary[rows]
+        filled[in_draft, team, codes] += has_position[rows] & (filled[in_draft, team, codes] < board.slots[codes])
+
+    drafted = picked_at > 0
+    times = drafted.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        adp = np.where(drafted, picked_at, 0).sum(axis=0) / times
+    summary = pd.DataFrame({'name': board.names, 'value': board.values, 'drafted': times / n_drafts, 'adp': adp})
+    for team in range(board.teams):
+        summary['team_{}'.format(team)] = (picked_by == team).mean(axis=0)
+    return summary.sort_values('adp', kind='stable')
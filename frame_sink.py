@@ -0,0 +1,110 @@
+"""
+Bounded memory sink for scraped dataframes.
+
+The scrapers used to collect thousands of small per-player dataframes in a list and pd.concat them at the end, so peak
+ memory was every fragment plus the concatenated copy. A ShardedFrameSink takes each result as it arrives, holds at most
+ rows_per_shard rows in memory, and writes them out as a columnar shard in the same format csv_cache.py uses. Afterwards
+ ShardedDataset reads the shards back as one dataset, either all at once or one shard at a time (e.g. to stream out a
+ CSV without ever holding the whole table).
+"""
+
+import glob
+import os
+import shutil
+
+import pandas as pd
+
+from csv_cache import read_frame, read_meta, write_frame
+
+
+class ShardedFrameSink:
+
+    def __init__(self, directory, rows_per_shard=50000, overwrite=False):
+        if overwrite and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows_per_shard = rows_per_shard
+        self.buffer = []
+        self.buffered_rows = 0
+        # Keep numbering after any shards already in the folder, so a resumed scrape appends instead of overwriting
+        self.next_shard = len(shard_paths(directory))
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, df):
+        if df is None or df.empty:
+            return
+        self.buffer.append(df)
+        self.buffered_rows += len(df)
+        if self.buffered_rows >= self.rows_per_shard:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        shard = pd.concat(self.buffer, ignore_index=True)
+        self.buffer = []
+        self.buffered_rows = 0
+        write_frame(shard, os.path.join(self.directory, 'shard-{:05d}'.format(self.next_shard)))
+        self.next_shard += 1
+        self.rows_written += len(shard)
+
+    def close(self):
+        self.flush()
+
+    def dataset(self):
+        self.flush()
+        return ShardedDataset(self.directory)
+
+
+def shard_paths(directory):
+    return sorted(path for path in glob.glob(os.path.join(directory, 'shard-*')) if os.path.isdir(path))
+
+
+class ShardedDataset:
+    """All the shards in a sink folder, read as one dataset."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.shards = shard_paths(directory)
+        self.metas = [read_meta(path) for path in self.shards]
+
+    def __len__(self):
+        return sum(meta['n_rows'] for meta in self.metas)
+
+    @property
+    def columns(self):
+        # Union of every shard's columns, in the order they first show up
+        columns = []
+        for meta in self.metas:
+            columns.extend(col['name'] for col in meta['columns'] if col['name'] not in columns)
+        return columns
+
+    def iter_frames(self, columns=None):
+        """Yield one dataframe per shard. Only one shard is in memory at a time."""
+        for path, meta in zip(self.shards, self.metas):
+            df = read_frame(path, meta=meta, columns=columns)
+            yield df.reindex(columns=columns or self.columns)
+
+    def read(self, columns=None):
+        """Load every shard into one dataframe."""
+        frames = list(self.iter_frames(columns))
+        if not frames:
+            return pd.DataFrame(columns=columns or self.columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def to_csv(self, path, index=False, **to_csv_kwargs):
+        """Write the dataset to one CSV a shard at a time."""
+        header = True
+        with open(path, 'w', newline='') as f:
+            for df in self.iter_frames():
+                df.to_csv(f, index=index, header=header, **to_csv_kwargs)
+                header = False
+            if header:
+                pd.DataFrame(columns=self.columns).to_csv(f, index=index, **to_csv_kwargs)
@@ -0,0 +1,441 @@
+"""
+Game log ingestion with incremental rolling and season to date aggregates.
+
+Everything else in the repo works from season totals, and season_ranking.ipynb gets per game values by dividing by gp.
+ In season decisions need the box scores themselves: how a player did over their last 5, 10 and 20 games, and their season
+ so far. A GameLogAggregator keeps exactly the state needed for that and nothing else:
+
+- the last max(windows) games of every player's current season (a few MB for every player in the league's history)
+- running season totals and games played for every player season
+- the date and game id of every player's last ingested game, so a game that arrives twice is only counted once
+
+Game logs are fed in as chunks (ingest_csv reads CSVs with pd.read_csv(chunksize=...), fetch_league_game_log pulls a
+ date range from nba_api's LeagueGameLog). Each chunk is sorted, and every rolling window is worked out for all of its
+ games at once with grouped cumulative sums that start from the saved history, so ingesting a multi decade history holds
+ one chunk plus the state in memory, and a daily update costs that day's games.
+
+frame() gives the current aggregates in the per game schema of player_general_traditional_per_game_data.csv (player_id,
+ season_id, gp, min, fgm, ...), so normalization.normalize and the ranking code take them as they are. Passing a sink
+ (a ShardedFrameSink from frame_sink.py) also writes one row per game and window as games arrive, in the same schema
+ plus game_id, game_date and window: the rolling window vectors for the similarity model.
+
+    aggregator = GameLogAggregator.open('gamelog_state')
+    aggregator.ingest_csv(sorted(glob.glob('game_logs/*.csv')))
+    aggregator.save()
+    df_last_10 = aggregator.frame('last_10')
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+
+# Counting stats we keep totals of, named like player_general_traditional_per_game_data.csv
+gamelog_stats = ['min', 'fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'tov',
+                 'pf', 'pts']
+
+# Columns of the per game schema, in the order player_general_traditional_per_game_data.csv has them
+per_game_columns = ['gp', 'min', 'fgm', 'fga', 'fg_pct', 'fg3m', 'fg3a', 'fg3_pct', 'ftm', 'fta', 'ft_pct', 'oreb', 'dreb',
+                    'reb', 'ast', 'tov', 'stl', 'blk', 'pf', 'pts']
+
+# Percentages worked out from the window's totals rather than averaged game by game
+pct_columns = {'fg_pct': ('fgm', 'fga'), 'fg3_pct': ('fg3m', 'fg3a'), 'ft_pct': ('ftm', 'fta')}
+
+default_windows = (5, 10, 20)
+
+
+def season_id_from_game_log(season_ids):
+    """
+    nba_api game log SEASON_ID ('22017', regular season 2017-18) -> '2017-18'. Ids already like '2017-18' are kept.
+
+    The first digit is the season type (1 preseason, 2 regular season, 3 all star, 4 playoffs, 5 play in). Only regular
+     season games belong in the per game schema, so the other types come back as None for standardize_game_log to drop.
+    """
+    season_ids = pd.Series(season_ids).astype(str)
+    # A chunk only holds a few distinct seasons, so convert those and map them back
+    converted = {}
+    for season in season_ids.unique():
+        if len(season) == 5 and season.isdigit():
+            year = int(season[1:])
+            converted[season] = '{}-{:02d}'.format(year, (year + 1) % 100) if season[0] == '2' else None
+        else:
+            converted[season] = season
+    return season_ids.map(converted).to_numpy()
+
+
+def minutes(values):
+    """Minutes as floats, from numbers or 'MM:SS' strings."""
+    values = pd.Series(values)
+    if values.dtype != object:
+        return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+    parts = values.astype(str).str.split(':', n=1, expand=True)
+    result = pd.to_numeric(parts[0], errors='coerce')
+    if parts.shape[1] > 1:
+        result = result + pd.to_numeric(parts[1], errors='coerce').fillna(0) / 60
+    return result.to_numpy(dtype=np.float64)
+
+
+def standardize_game_log(df):
+    """
+    Lowercase a game log chunk and type it: season_id like '2017-18', game_date as a yyyymmdd integer, game_id as an
+     integer and the counting stats as floats (missing stats count as 0). reb is filled in from oreb + dreb if missing.
+     Preseason, all star, playoff and play in games are dropped, so they never merge into the regular season's numbers.
+    """
+    df = df.rename(columns=str.lower).reset_index(drop=True)
+    missing = [col for col in ['player_id', 'season_id', 'game_id', 'game_date'] if col not in df.columns]
+    if missing:
+        raise ValueError('Game log is missing columns {}'.format(missing))
+    game_dates = pd.to_datetime(df['game_date'], errors='coerce')
+    out = pd.DataFrame({
+        'player_id': pd.to_numeric(df['player_id'], errors='coerce').to_numpy(),
+        'season_id': season_id_from_game_log(df['season_id']),
+        'game_id': pd.to_numeric(df['game_id'], errors='coerce').to_numpy(),
+        'game_date': game_dates.dt.year * 10000 + game_dates.dt.month * 100 + game_dates.dt.day,
+        'player_name': df['player_name'].to_numpy() if 'player_name' in df.columns else None,
+        'team_abbreviation': df['team_abbreviation'].to_numpy() if 'team_abbreviation' in df.columns else None,
+    })
+    out = out[out['player_id'].notna() & out['season_id'].notna() & out['game_id'].notna() & out['game_date'].notna()]
+    df = df.loc[out.index]
+    out['player_id'] = out['player_id'].astype(np.int64)
+    out['game_id'] = out['game_id'].astype(np.int64)
+    out['game_date'] = out['game_date'].astype(np.int64)
+    for col in gamelog_stats:
+        if col == 'min' and col in df.columns:
+            out[col] = np.nan_to_num(minutes(df[col]))
+        elif col in df.columns:
+            out[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        else:
+            out[col] = 0.0
+    if 'reb' not in df.columns:
+        out['reb'] = out['oreb'] + out['dreb']
+    return out.reset_index(drop=True)
+
+
+def per_game_frame(totals, gp):
+    """Per game averages and window percentages from (rows x gamelog_stats) totals, in per_game_columns order."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = totals / gp[:, None]
+        df = pd.DataFrame(averages, columns=gamelog_stats)
+        for col, (made, attempted) in pct_columns.items():
+            df[col] = totals[:, gamelog_stats.index(made)] / totals[:, gamelog_stats.index(attempted)]
+    df['gp'] = gp
+    return df[per_game_columns]
+
+
+def _lookup(keys, values):
+    # Position of every value in keys, -1 where it isn't there
+    return pd.Index(keys).get_indexer(values)
+
+
+def _grow(array, size):
+    # Double the first dimension until size fits, keeping the contents. New slots of an object array (names, teams)
+    # start out as None rather than 0, so a player without a name yet reads as missing
+    if size <= array.shape[0]:
+        return array
+    shape = (max(size, 2 * array.shape[0]),) + array.shape[1:]
+    grown = np.full(shape, None, dtype=object) if array.dtype == object else np.zeros(shape, dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+class GameLogAggregator:
+    """
+    Rolling window and season to date aggregates over game logs, updated one chunk of games at a time.
+
+    Rolling windows stay inside a season: the first game of a new season starts every window from scratch.
+
+    state_dir: folder save() writes the state to. open() picks up from what's there.
+    windows: rolling window lengths in games
+    sink: optional ShardedFrameSink (or anything with an append(df) method) getting one row per game and window
+    """
+
+    def __init__(self, state_dir=None, windows=default_windows, sink=None):
+        self.state_dir = state_dir
+        self.windows = tuple(sorted(windows))
+        self.depth = self.windows[-1]
+        self.sink = sink
+        n_stats = len(gamelog_stats)
+
+        # Per player state, one slot per player in the order they first showed up
+        self.player_ids = np.empty(0, dtype=np.int64)
+        self.player_names = np.empty(0, dtype=object)
+        self.teams = np.empty(0, dtype=object)
+        self.last_date = np.empty(0, dtype=np.int64)
+        self.last_game = np.empty(0, dtype=np.int64)
+        # The last depth games of each player's current season, oldest first and right aligned, so the most recent game
+        # is always recent[slot, -1] and recent_count[slot] of them are filled in
+        self.recent = np.zeros((0, self.depth, n_stats), dtype=np.float32)
+        self.recent_count = np.empty(0, dtype=np.int64)
+        self.recent_season = np.empty(0, dtype=np.int64)
+        self.n_players = 0
+
+        # Per player season state. A player season's key is player_id * 1000 + its season code.
+        self.seasons = []
+        self.season_keys = np.empty(0, dtype=np.int64)
+        self.season_totals = np.zeros((0, n_stats), dtype=np.float64)
+        self.season_gp = np.empty(0, dtype=np.int64)
+        self.n_player_seasons = 0
+
+        self.games_ingested = 0
+        self.games_skipped = 0
+
+    # Persistence
+
+    @classmethod
+    def open(cls, state_dir, windows=default_windows, sink=None):
+        """The aggregator saved in state_dir, or a new one that will save there."""
+        path = os.path.join(state_dir, 'state.npz')
+        if not os.path.exists(path):
+            return cls(state_dir, windows, sink)
+        data = np.load(path, allow_pickle=True)
+        aggregator = cls(state_dir, tuple(data['windows'].tolist()), sink)
+        if windows is not None and tuple(sorted(windows)) != aggregator.windows:
+            print(f"Using the saved windows {aggregator.windows} instead of {tuple(sorted(windows))}")
+        for name in ['player_ids', 'player_names', 'teams', 'last_date', 'last_game', 'recent', 'recent_count',
+                     'recent_season', 'season_keys', 'season_totals', 'season_gp']:
+            setattr(aggregator, name, data[name])
+        aggregator.seasons = data['seasons'].tolist()
+        aggregator.n_players = len(aggregator.player_ids)
+        aggregator.n_player_seasons = len(aggregator.season_keys)
+        aggregator.games_ingested, aggregator.games_skipped = data['counts'].tolist()
+        return aggregator
+
+    def save(self, state_dir=None):
+        """Write the state to state_dir/state.npz, through a temporary file so a cut off save keeps the old state."""
+        state_dir = state_dir or self.state_dir
+        if state_dir is None:
+            raise ValueError('No state_dir to save to')
+        os.makedirs(state_dir, exist_ok=True)
+        path = os.path.join(state_dir, 'state.npz')
+        n, m = self.n_players, self.n_player_seasons
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                windows=np.array(self.windows),
+                seasons=np.array(self.seasons, dtype=object),
+                player_ids=self.player_ids[:n],
+                player_names=self.player_names[:n],
+                teams=self.teams[:n],
+                last_date=self.last_date[:n],
+                last_game=self.last_game[:n],
+                recent=self.recent[:n],
+                recent_count=self.recent_count[:n],
+                recent_season=self.recent_season[:n],
+                season_keys=self.season_keys[:m],
+                season_totals=self.season_totals[:m],
+                season_gp=self.season_gp[:m],
+                counts=np.array([self.games_ingested, self.games_skipped]),
+            )
+        os.replace(path + '.tmp', path)
+
+    # Slots
+
+    def _player_slots(self, player_ids):
+        slots = _lookup(self.player_ids[:self.n_players], player_ids)
+        new_ids = np.unique(player_ids[slots < 0])
+        if len(new_ids):
+            start, stop = self.n_players, self.n_players + len(new_ids)
+            self.player_ids = _grow(self.player_ids, stop)
+            self.player_names = _grow(self.player_names, stop)
+            self.teams = _grow(self.teams, stop)
+            self.last_date = _grow(self.last_date, stop)
+            self.last_game = _grow(self.last_game, stop)
+            self.recent = _grow(self.recent, stop)
+            self.recent_count = _grow(self.recent_count, stop)
+            self.recent_season = _grow(self.recent_season, stop)
+            self.player_ids[start:stop] = new_ids
+            self.last_date[start:stop] = -1
+            self.last_game[start:stop] = -1
+            self.recent_count[start:stop] = 0
+            self.recent_season[start:stop] = -1
+            self.n_players = stop
+            slots = _lookup(self.player_ids[:self.n_players], player_ids)
+        return slots
+
+    def _season_codes(self, season_ids):
+        for season in pd.unique(season_ids):
+            if season not in self.seasons:
+                self.seasons.append(season)
+        return _lookup(self.seasons, season_ids)
+
+    def _season_slots(self, keys):
+        slots = _lookup(self.season_keys[:self.n_player_seasons], keys)
+        new_keys = np.unique(keys[slots < 0])
+        if len(new_keys):
+            start, stop = self.n_player_seasons, self.n_player_seasons + len(new_keys)
+            self.season_keys = _grow(self.season_keys, stop)
+            self.season_totals = _grow(self.season_totals, stop)
+            self.season_gp = _grow(self.season_gp, stop)
+            self.season_keys[start:stop] = new_keys
+            self.season_gp[start:stop] = 0
+            self.n_player_seasons = stop
+            slots = _lookup(self.season_keys[:self.n_player_seasons], keys)
+        return slots
+
+    # Ingestion
+
+    @instrumented(rows=int)
+    def ingest(self, df):
+        """
+        Add a chunk of game log rows (nba_api LeagueGameLog / PlayerGameLog columns, any case). Games at or before a
+         player's last ingested game are skipped, so overlapping chunks are fine, but each player's games have to
+         arrive in date order across chunks. Returns the number of new games.
+        """
+        games = standardize_game_log(df)
+        games = games.sort_values(['player_id', 'game_date', 'game_id'], kind='stable')
+        games = games.drop_duplicates(subset=['player_id', 'game_id']).reset_index(drop=True)
+        player_slots = self._player_slots(games['player_id'].to_numpy())
+        dates, game_ids = games['game_date'].to_numpy(), games['game_id'].to_numpy()
+        new = (dates > self.last_date[player_slots]) | (
+            (dates == self.last_date[player_slots]) & (game_ids > self.last_game[player_slots])
+        )
+        self.games_skipped += int((~new).sum())
+        games, player_slots = games[new].reset_index(drop=True), player_slots[new]
+        n = len(games)
+        if not n:
+            return 0
+
+        season_codes = self._season_codes(games['season_id'].to_numpy())
+        season_slots = self._season_slots(games['player_id'].to_numpy() * 1000 + season_codes)
+        values = games[gamelog_stats].to_numpy(dtype=np.float64)
+
+        # Runs of games of the same player season. Rows are sorted by player and date, so every run is contiguous.
+        run_start = np.ones(n, dtype=bool)
+        run_start[1:] = season_slots[1:] != season_slots[:-1]
+        starts = np.flatnonzero(run_start)
+        lengths = np.diff(np.append(starts, n))
+        run_of = np.repeat(np.arange(len(starts)), lengths)
+
+        # Season to date totals after every game: what the season had before this chunk plus the running sum in it
+        before = self.season_totals[season_slots[starts]]
+        running = np.cumsum(values, axis=0)
+        running -= np.repeat(running[starts] - values[starts], lengths, axis=0)
+        season_to_date = before[run_of] + running
+        season_gp = self.season_gp[season_slots[starts]][run_of] + (np.arange(n) - np.repeat(starts, lengths) + 1)
+
+        # Rolling windows: put each run behind the games already saved for it (only a player's first run in the chunk
+        # can continue a saved season), then every window sum is a difference of one cumulative sum
+        first_of_player = run_start.copy()
+        first_of_player[1:] = player_slots[1:] != player_slots[:-1]
+        run_slots = player_slots[starts]
+        continues = first_of_player[starts] & (self.recent_season[run_slots] == season_codes[starts])
+        history = np.where(continues, self.recent_count[run_slots], 0)
+        combined_lengths = history + lengths
+        combined_starts = np.concatenate([[0], np.cumsum(combined_lengths)[:-1]])
+        combined = np.zeros((combined_lengths.sum(), len(gamelog_stats)), dtype=np.float64)
+        history_run = np.repeat(np.arange(len(starts)), history)
+        history_offset = np.arange(len(history_run)) - np.repeat(np.cumsum(history) - history, history)
+        combined[np.repeat(combined_starts, history) + history_offset] = self.recent[
+            run_slots[history_run], self.depth - np.repeat(history, history) + history_offset
+        ]
+        new_positions = np.repeat(combined_starts + history, lengths) + (np.arange(n) - np.repeat(starts, lengths))
+        combined[new_positions] = values
+        cumulative = np.vstack([np.zeros((1, combined.shape[1])), np.cumsum(combined, axis=0)])
+        first_position = np.repeat(combined_starts, lengths)
+        rolling = {}
+        for window in self.windows:
+            window_start = np.maximum(new_positions + 1 - window, first_position)
+            rolling[window] = (cumulative[new_positions + 1] - cumulative[window_start], new_positions + 1 - window_start)
+
+        # Save the state: season totals, the last depth games of every player's last run, and the watermarks
+        np.add.at(self.season_totals, season_slots, values)
+        np.add.at(self.season_gp, season_slots, 1)
+        last_runs = np.flatnonzero(np.append(first_of_player[starts][1:], True))
+        for run in last_runs:
+            slot = run_slots[run]
+            keep = min(self.depth, combined_lengths[run])
+            stop = combined_starts[run] + combined_lengths[run]
+            self.recent[slot] = 0
+            self.recent[slot, self.depth - keep:] = combined[stop - keep:stop]
+            self.recent_count[slot] = keep
+            self.recent_season[slot] = season_codes[starts[run]]
+        last_rows = starts[last_runs] + lengths[last_runs] - 1
+        self.last_date[player_slots[last_rows]] = games['game_date'].to_numpy()[last_rows]
+        self.last_game[player_slots[last_rows]] = games['game_id'].to_numpy()[last_rows]
+        # Names and teams come from each player's last game in the chunk that has one, so a game missing them never
+        # wipes out what an earlier chunk told us
+        for col, known_values in [('player_name', self.player_names), ('team_abbreviation', self.teams)]:
+            rows = np.flatnonzero(games[col].notna().to_numpy())
+            if len(rows):
+                rows = rows[np.append(player_slots[rows][1:] != player_slots[rows][:-1], True)]
+                known_values[player_slots[rows]] = games[col].to_numpy()[rows]
+        self.games_ingested += n
+
+        if self.sink is not None:
+            key_cols = games[['player_id', 'player_name', 'team_abbreviation', 'season_id', 'game_id', 'game_date']]
+            frames = [pd.concat([key_cols, per_game_frame(season_to_date, season_gp)], axis=1).assign(window='season')]
+            for window, (totals, gp) in rolling.items():
+                frame = pd.concat([key_cols, per_game_frame(totals, gp)], axis=1)
+                frames.append(frame.assign(window='last_{}'.format(window)))
+            self.sink.append(pd.concat(frames, ignore_index=True))
+        return n
+
+    def ingest_csv(self, paths, chunksize=200000, **read_csv_kwargs):
+        """Ingest one or more game log CSVs in chunks of chunksize rows. Returns the number of new games."""
+        if isinstance(paths, str):
+            paths = [paths]
+        total = 0
+        for path in paths:
+            for chunk in pd.read_csv(path, chunksize=chunksize, **read_csv_kwargs):
+                total += self.ingest(chunk)
+        return total
+
+    def update(self, df):
+        """Ingest a day's (or any range's) games and save the state. Returns the number of new games."""
+        n = self.ingest(df)
+        if self.state_dir is not None:
+            self.save()
+        return n
+
+    # Output
+
+    def frame(self, window='season'):
+        """
+        Current aggregates in the per game schema.
+
+        window: 'season' for one row per player season (season to date), or 'last_5' / 5 etc. for one row per player
+         over the last games of their latest season
+        """
+        if window == 'season':
+            n = self.n_player_seasons
+            keys = self.season_keys[:n]
+            player_ids, season_codes = keys // 1000, keys % 1000
+            slots = _lookup(self.player_ids[:self.n_players], player_ids)
+            df = per_game_frame(self.season_totals[:n], self.season_gp[:n])
+        else:
+            window = int(str(window).replace('last_', ''))
+            if window not in self.windows:
+                raise ValueError('Unknown window {}. Choose one of {}'.format(window, ['season'] + list(self.windows)))
+            slots = np.flatnonzero(self.recent_count[:self.n_players] > 0)
+            counts = np.minimum(self.recent_count[slots], window)
+            totals = self.recent[slots, self.depth - window:].astype(np.float64).sum(axis=1)
+            player_ids, season_codes = self.player_ids[slots], self.recent_season[slots]
+            df = per_game_frame(totals, counts)
+        seasons = np.array(self.seasons + [None], dtype=object)
+        df.insert(0, 'season_id', seasons[season_codes])
+        df.insert(0, 'player_id', player_ids)
+        df.insert(1, 'player_name', self.player_names[slots])
+        df.insert(3, 'team_abbreviation', self.teams[slots])
+        return df.sort_values(['season_id', 'player_id'], kind='stable').reset_index(drop=True)
+
+
+def fetch_league_game_log(season, date_from=None, date_to=None, headers=None, timeout=100):
+    """
+    Every player's box scores for a season from nba_api's LeagueGameLog, optionally only between two dates
+     ('MM/DD/YYYY'), oldest first. Passing yesterday as both dates gives the daily update.
+    """
+    # Imported here so reading game log CSVs doesn't need nba_api
+    from nba_api.stats.endpoints import leaguegamelog
+    from scraper import headers as default_headers
+
+    response = leaguegamelog.LeagueGameLog(
+        player_or_team_abbreviation='P',
+        season=season,
+        date_from_nullable=date_from or '',
+        date_to_nullable=date_to or '',
+        headers=headers or default_headers,
+        timeout=timeout,
+    )
+    return response.get_data_frames()[0]
@@ -0,0 +1,226 @@
+"""
+Stage timing, memory and error counters for the scraper, loaders and models.
+
+When a run is slow there's nothing to say whether the time went to nba_api retries, loading CSVs, normalizing, the
+ distance search or the projections. The functions on those paths are wrapped with instrumented (or a block with stage),
+ and every call adds to a per stage record:
+
+- calls, total / max wall time and errors (calls that raised)
+- rows processed, when the stage says how to count them
+- peak traced memory above what was allocated when the stage started, when memory tracking is on
+
+plus named counters (count('scraper.retries')) for retries and failures. report() returns everything as one JSON-ready
+ dict and write_report() saves it, so every run can leave a file to compare against the last one.
+
+Instrumentation is off unless it's turned on, either with enable() or by setting NBADATA_INSTRUMENT before starting
+ python (NBADATA_INSTRUMENT=run.json also writes the report there when the process exits, and
+ NBADATA_INSTRUMENT_MEMORY=1 adds memory tracking). Turned off, a wrapped function costs one flag check per call.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Recorder:
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self._lock = threading.Lock()
+        # Stages running right now, in any thread or asyncio task. Resetting tracemalloc's peak would lose the peak
+        # every one of them has seen so far, so whoever resets it first hands the peak to all of them
+        self._open = set()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.started = time.time()
+            self._started_clock = time.perf_counter()
+
+    def add(self, name, seconds, rows=None, peak_bytes=None, error=False):
+        with self._lock:
+            record = self.stages.get(name)
+            if record is None:
+                record = self.stages[name] = {
+                    'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'errors': 0, 'peak_mb': None
+                }
+            record['calls'] += 1
+            record['seconds'] += seconds
+            record['max_seconds'] = max(record['max_seconds'], seconds)
+            if rows is not None:
+                record['rows'] += int(rows)
+            if error:
+                record['errors'] += 1
+            if peak_bytes is not None:
+                peak_mb = peak_bytes / 1024 ** 2
+                record['peak_mb'] = peak_mb if record['peak_mb'] is None else max(record['peak_mb'], peak_mb)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        with self._lock:
+            stages = {name: dict(record) for name, record in self.stages.items()}
+            for record in stages.values():
+                rate = record['rows'] / record['seconds'] if record['seconds'] and record['rows'] else None
+                record['rows_per_second'] = rate
+            return {
+                'started': self.started,
+                'wall_seconds': time.perf_counter() - self._started_clock,
+                'pid': os.getpid(),
+                'argv': sys.argv,
+                'memory_tracked': self.memory,
+                'stages': stages,
+                'counters': dict(self.counters),
+            }
+
+
+recorder = Recorder()
+
+
+def enable(memory=False):
+    """Start recording. memory turns on tracemalloc, which slows allocations down noticeably while it's on."""
+    recorder.enabled = True
+    recorder.memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    recorder.enabled = False
+    if recorder.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    recorder.memory = False
+
+
+def reset():
+    recorder.reset()
+
+
+def report():
+    return recorder.report()
+
+
+def write_report(path):
+    """Write the report as JSON. Returns the report."""
+    data = recorder.report()
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=1, default=str)
+    return data
+
+
+def count(name, n=1):
+    """Add n to a named counter, e.g. retries or failed requests."""
+    if recorder.enabled:
+        recorder.count(name, n)
+
+
+class stage:
+    """
+    Context manager recording one block as a stage. Set .rows inside the block to count rows processed.
+
+        with stage('season_ranking.merge') as s:
+            df = pd.merge(...)
+            s.rows = len(df)
+
+    Stages can nest and can overlap in other threads or asyncio tasks. tracemalloc only has one peak for the whole
+     process though, so with memory tracking on, a stage's peak_mb also counts what overlapping stages allocated.
+    """
+
+    __slots__ = ('name', 'rows', '_start', '_start_bytes', '_peak')
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self._start = None
+
+    def __enter__(self):
+        if not recorder.enabled:
+            return self
+        if recorder.memory and tracemalloc.is_tracing():
+            with recorder._lock:
+                current, peak = tracemalloc.get_traced_memory()
+                for running in recorder._open:
+                    running._peak = max(running._peak, peak)
+                recorder._open.add(self)
+                self._peak = 0
+                tracemalloc.reset_peak()
+            self._start_bytes = current
+        else:
+            self._start_bytes = None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._start is None:
+            return False
+        seconds = time.perf_counter() - self._start
+        peak_bytes = None
+        if self._start_bytes is not None:
+            with recorder._lock:
+                recorder._open.discard(self)
+                if tracemalloc.is_tracing():
+                    peak_bytes = max(max(self._peak, tracemalloc.get_traced_memory()[1]) - self._start_bytes, 0)
+        recorder.add(self.name, seconds, self.rows, peak_bytes, error=exc_type is not None)
+        self._start = None
+        return False
+
+
+def instrumented(name=None, rows=None):
+    """
+    Decorator recording every call of a function (or coroutine function) as a stage.
+
+    name: stage name, module.function by default
+    rows: optional function of the return value giving the rows processed, e.g. len
+    """
+    def decorate(func):
+        stage_name = name or '{}.{}'.format(func.__module__, func.__qualname__)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not recorder.enabled:
+                    return await func(*args, **kwargs)
+                with stage(stage_name) as s:
+                    result = await func(*args, **kwargs)
+                    if rows is not None:
+                        s.rows = rows(result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return func(*args, **kwargs)
+            with stage(stage_name) as s:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    s.rows = rows(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def first_len(result):
+    """rows for functions returning a tuple whose first item is the frame or array processed."""
+    return len(result[0])
+
+
+# Turn on from the environment, so a run of any script or notebook can be instrumented without editing it
+_setting = os.environ.get('NBADATA_INSTRUMENT')
+if _setting and _setting != '0':
+    enable(memory=os.environ.get('NBADATA_INSTRUMENT_MEMORY', '0') not in ('', '0'))
+    # Pool workers inherit the setting too, but only the process that started the run writes the file
+    if _setting.endswith('.json') and multiprocessing.parent_process() is None:
+        atexit.register(write_report, _setting)
@@ -0,0 +1,147 @@
+"""
+Typed, memory-compact loaders for the scraped CSVs.
+
+pd.read_csv gives every string column (SEASON_ID, TEAM_ABBREVIATION, POSITION, ...) as python objects and every number
+ as int64 / float64, even though a season, a team or a league is one of a few dozen values and no counting stat gets
+ anywhere near 32,767. The loaders here read each file with a schema instead:
+
+- repeated labels become categoricals (small integer codes plus one table of the distinct values)
+- ids become int32, counting stats int16 when they're all whole numbers (float32 when some are missing or fractional),
+  rates float32
+- a season_start column (1996 for '1996-97') is worked out once per distinct season and spread to the rows through the
+  categorical codes, so filtering on the season never parses strings row by row
+
+Everything goes through read_csv_cached, so after the first run the typed frame comes straight from the binary cache.
+"""
+
+import numpy as np
+import pandas as pd
+
+from csv_cache import read_csv_cached
+from instrumentation import instrumented
+
+# Column -> dtype. 'category' columns are read as categoricals. Integer columns fall back to float32 if they have
+# missing values, since numpy integers can't hold NaN, or fractional ones (per game averages), and to int64 if a value
+# doesn't fit.
+career_stats_schema = {
+    'PLAYER_ID': 'int32',
+    'SEASON_ID': 'category',
+    'LEAGUE_ID': 'category',
+    'TEAM_ID': 'int32',
+    'TEAM_ABBREVIATION': 'category',
+    'PLAYER_AGE': 'float32',
+    'GP': 'int16',
+    'GS': 'int16',
+    'MIN': 'float32',
+    'FGM': 'int16',
+    'FGA': 'int16',
+    'FG_PCT': 'float32',
+    'FG3M': 'int16',
+    'FG3A': 'int16',
+    'FG3_PCT': 'float32',
+    'FTM': 'int16',
+    'FTA': 'int16',
+    'FT_PCT': 'float32',
+    'OREB': 'int16',
+    'DREB': 'int16',
+    'REB': 'int16',
+    'AST': 'int16',
+    'STL': 'int16',
+    'BLK': 'int16',
+    'TOV': 'int16',
+    'PF': 'int16',
+    'PTS': 'int16',
+}
+
+player_info_schema = {
+    'PERSON_ID': 'int32',
+    'COUNTRY': 'category',
+    'SEASON_EXP': 'int16',
+    'POSITION': 'category',
+    'ROSTERSTATUS': 'category',
+    'GAMES_PLAYED_CURRENT_SEASON_FLAG': 'category',
+    'TEAM_ID': 'int32',
+    'TEAM_NAME': 'category',
+    'TEAM_ABBREVIATION': 'category',
+    'TEAM_CODE': 'category',
+    'TEAM_CITY': 'category',
+    'FROM_YEAR': 'float32',
+    'TO_YEAR': 'float32',
+    'DLEAGUE_FLAG': 'category',
+    'NBA_FLAG': 'category',
+    'GAMES_PLAYED_FLAG': 'category',
+    'DRAFT_YEAR': 'category',
+    'DRAFT_ROUND': 'category',
+    'DRAFT_NUMBER': 'category',
+    'GREATEST_75_FLAG': 'category',
+}
+
+
+def season_start_year(seasons):
+    """
+    Start year of every season id ('1996-97' -> 1996) as int16, or -1 where the season is missing.
+
+    Categoricals are parsed once per category rather than once per row.
+    """
+    seasons = seasons if isinstance(seasons.dtype, pd.CategoricalDtype) else seasons.astype('category')
+    codes = seasons.cat.codes.to_numpy()
+    years = pd.to_numeric(seasons.cat.categories.astype(str).str[:4], errors='coerce')
+    years = np.append(np.nan_to_num(years.to_numpy(dtype=np.float64), nan=-1).astype(np.int16), np.int16(-1))
+    return years[codes]
+
+
+def apply_schema(df, schema):
+    """Cast df's columns to the schema in place of whatever read_csv guessed."""
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                df[col] = values.astype(str).astype('category')
+        elif np.dtype(dtype).kind == 'i' and (
+            values.isna().any() or (pd.api.types.is_float_dtype(values.dtype) and not (values % 1 == 0).all())
+        ):
+            # Casting 12.5 points to int16 would quietly make it 12
+            df[col] = values.astype(np.float32)
+        elif np.dtype(dtype).kind == 'i' and len(values) and not (
+            np.iinfo(dtype).min <= values.min() and values.max() <= np.iinfo(dtype).max
+        ):
+            # Wider than the schema expected, so keep the values intact rather than letting them wrap around
+            df[col] = values.astype(np.int64)
+        else:
+            df[col] = values.astype(dtype)
+    return df
+
+
+@instrumented(rows=len)
+def load_typed(path, schema, season_col=None, **read_csv_kwargs):
+    """
+    Read a CSV through the binary cache and cast it to schema.
+
+    season_col: name of a season id column to derive a season_start column from (named to match the column's case)
+    """
+    # Labels are parsed straight into categoricals of strings, so LEAGUE_ID stays '00' instead of becoming the number 0,
+    # and the cache stores them as codes
+    labels = {col: 'category' for col, dtype in schema.items() if dtype == 'category'}
+    df = read_csv_cached(path, dtype=labels, **read_csv_kwargs)
+    df = apply_schema(df, schema)
+    if season_col is not None and season_col in df.columns:
+        name = 'SEASON_START' if season_col.isupper() else 'season_start'
+        df[name] = season_start_year(df[season_col])
+    return df
+
+
+def load_career_stats(path='df_player_career_stats.csv'):
+    """df_player_career_stats.csv with categorical seasons / teams / leagues, narrow stats and SEASON_START."""
+    return load_typed(path, career_stats_schema, season_col='SEASON_ID')
+
+
+def load_player_info(path='df_player_info.csv'):
+    """df_player_info.csv with categorical positions, teams and flags."""
+    return load_typed(path, player_info_schema)
+
+
+def memory_mb(df):
+    """Deep memory use of a dataframe in MB."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
@@ -0,0 +1,279 @@
+"""
+Player name search across every name source in the repo.
+
+The same player is spelled a few different ways depending on the file: player_name in player_info.csv and
+ player_id_player_name.csv, DISPLAY_FIRST_LAST in df_player_info.csv, full_name in df_players.csv, and Player in
+ nba_season_stats.csv and the FantasyPros projection sheets (which have no ids at all). Matching them with == misses
+ accents (Nikola Jokić / Nikola Jokic), punctuation (J.J. Redick / JJ Redick), suffixes (Larry Nance Jr.) and typos.
+
+NameIndex folds every name to a plain lower case form (accents and punctuation removed, "Last, First" flipped), also
+ files it without any Jr. / III suffix, and indexes those forms three ways:
+
+- a dict from folded name to player ids, for exact matches
+- sorted lists of folded names and of their individual words, so a prefix ("gian", "antetok") is two binary searches
+- a trigram inverted index, so a misspelled name only gets compared (with a bounded Levenshtein distance) against the
+  handful of names that share the most trigrams with it
+"""
+
+import bisect
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from csv_cache import read_csv_cached
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+
+# (csv, name column, id column) for every file that pairs a name with a player id
+name_sources = [
+    ('df_player_info.csv', 'DISPLAY_FIRST_LAST', 'PERSON_ID'),
+    ('df_players.csv', 'full_name', 'id'),
+    ('nba-stats-csv/player_id_player_name.csv', 'player_name', 'player_id'),
+    ('nba-stats-csv/player_info.csv', 'player_name', 'player_id'),
+    ('nba-stats-csv/player_info_df.csv', 'player_name', 'player_id'),
+    ('nba-stats-csv/player_stats_total.csv', 'player_name', 'player_id'),
+]
+
+name_suffixes = {'jr', 'sr', 'ii', 'iii', 'iv', 'v'}
+
+
+def fold_name(name):
+    """
+    Lower case, accent free, punctuation free form of a name, e.g. 'Jokić, Nikola' -> 'nikola jokic' and
+     'J.J. Redick' -> 'jj redick'.
+    """
+    name = str(name)
+    if ',' in name:
+        last, _, first = name.partition(',')
+        name = '{} {}'.format(first, last)
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char)).lower()
+    name = re.sub(r"[.'`’]", '', name)
+    return ' '.join(word for word in re.split(r'[^a-z0-9]+', name) if word)
+
+
+def without_suffix(folded):
+    """A folded name without its Jr. / Sr. / III suffix, or None when it doesn't have one."""
+    words = folded.split(' ')
+    if len(words) > 2 and words[-1] in name_suffixes:
+        return ' '.join(words[:-1])
+    return None
+
+
+def trigrams(folded):
+    padded = '  {} '.format(folded)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a, b, max_distance=None):
+    """
+    Edit distance between two strings, with Myers' bit-parallel algorithm: each column of the edit table is a pair of
+     bit masks, so comparing two names is one short loop of integer operations per character of b.
+
+    With max_distance, anything further apart comes back as max_distance + 1, and we stop as soon as that's certain.
+    """
+    too_far = None if max_distance is None else max_distance + 1
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return too_far
+    if not a or not b:
+        return len(a) + len(b) if too_far is None else min(len(a) + len(b), too_far)
+
+    masks = {}
+    for i, char in enumerate(a):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    plus, minus, score = full, 0, len(a)
+    for j, char in enumerate(b):
+        eq = masks.get(char, 0)
+        xv = eq | minus
+        xh = ((((eq & plus) + plus) & full) ^ plus) | eq
+        h_plus = (minus | ~(xh | plus)) & full
+        h_minus = plus & xh
+        if h_plus & last:
+            score += 1
+        elif h_minus & last:
+            score -= 1
+        # The score can drop by at most one per remaining character of b
+        if too_far is not None and score - (len(b) - j - 1) > max_distance:
+            return too_far
+        h_plus = ((h_plus << 1) | 1) & full
+        h_minus = (h_minus << 1) & full
+        plus = (h_minus | ~(xv | h_plus)) & full
+        minus = h_plus & xv
+    return score if too_far is None else min(score, too_far)
+
+
+class NameIndex:
+
+    def __init__(self):
+        self.keys = []
+        self.key_codes = {}
+        self.key_ids = []
+        # The first spelling we saw for each player, used to display results
+        self.names = {}
+        self._trigram_lists = {}
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, name, player_id):
+        if not isinstance(name, str) or not name.strip():
+            return
+        player_id = int(player_id)
+        self.names.setdefault(player_id, name)
+        folded = fold_name(name)
+        self._add_key(folded, player_id)
+        # 'Larry Nance' should still find Larry Nance Jr., even though it's ambiguous with his father
+        if without_suffix(folded):
+            self._add_key(without_suffix(folded), player_id)
+
+    def _add_key(self, folded, player_id):
+        code = self.key_codes.get(folded)
+        if code is None:
+            code = len(self.keys)
+            self.key_codes[folded] = code
+            self.keys.append(folded)
+            self.key_ids.append([])
+            for gram in trigrams(folded):
+                self._trigram_lists.setdefault(gram, []).append(code)
+            self._sorted = None
+        if player_id not in self.key_ids[code]:
+            self.key_ids[code].append(player_id)
+
+    def add_frame(self, df, name_col, id_col):
+        pairs = df[[name_col, id_col]].dropna().drop_duplicates()
+        for name, player_id in zip(pairs[name_col].tolist(), pairs[id_col].tolist()):
+            self.add(name, player_id)
+
+    def _prepare(self):
+        """Build the sorted name / word lists and freeze the trigram lists into arrays, after a batch of adds."""
+        if self._sorted is not None:
+            return
+        self._sorted = sorted((key, code) for code, key in enumerate(self.keys))
+        self._sorted_keys = [key for key, _ in self._sorted]
+        words = sorted((word, code) for code, key in enumerate(self.keys) for word in key.split(' ')[1:])
+        self._sorted_words = words
+        self._sorted_word_keys = [word for word, _ in words]
+        self._trigrams = {gram: np.array(codes, dtype=np.int64) for gram, codes in self._trigram_lists.items()}
+        self._gram_counts = np.array([len(trigrams(key)) for key in self.keys])
+        self._key_lengths = np.array([len(key) for key in self.keys])
+
+    def _prefix_codes(self, folded):
+        codes = []
+        for sorted_keys, entries in [(self._sorted_keys, self._sorted), (self._sorted_word_keys, self._sorted_words)]:
+            start = bisect.bisect_left(sorted_keys, folded)
+            stop = bisect.bisect_left(sorted_keys, folded + '\uffff')
+            codes.extend(code for _, code in entries[start:stop])
+        return codes
+
+    def _fuzzy_codes(self, folded, max_distance, limit=20):
+        """(distance, code) for up to limit names within max_distance edits of folded, closest first."""
+        grams = trigrams(folded)
+        lists = [self._trigrams[gram] for gram in grams if gram in self._trigrams]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.keys))
+        # Cheap lower bounds on the distance: every edit changes at most three trigrams, and the lengths have to be
+        # evened out. Only names whose bound is within max_distance get the real (slow) comparison, nearest bound first.
+        bound = np.maximum(
+            np.ceil((np.maximum(self._gram_counts, len(grams)) - shared) / 3),
+            np.abs(self._key_lengths - len(folded)),
+        )
+        codes = np.flatnonzero((bound <= max_distance) & (shared > 0))
+        codes = codes[np.lexsort((-shared[codes], bound[codes]))]
+        matches = []
+        for code in codes.tolist():
+            if len(matches) >= limit and bound[code] > matches[limit - 1][0]:
+                break
+            distance = levenshtein(folded, self.keys[code], max_distance)
+            if distance <= max_distance:
+                matches.append((distance, code))
+                matches.sort()
+        return matches[:limit]
+
+    def search(self, query, limit=10, max_distance=None):
+        """
+        Players matching query, best first, as a list of dicts with player_id, name, match and distance.
+
+        match is 'exact', 'prefix' (the query starts the name or one of its words) or 'fuzzy' (within max_distance
+         edits, which defaults to about one edit per four letters).
+        """
+        self._prepare()
+        folded = fold_name(query)
+        if not folded:
+            return []
+        if max_distance is None:
+            max_distance = max(1, len(folded) // 4)
+
+        found = {}
+
+        def keep(code, match, distance):
+            for player_id in self.key_ids[code]:
+                rank = (distance, ['exact', 'prefix', 'fuzzy'].index(match), len(self.keys[code]))
+                if player_id not in found or rank < found[player_id][0]:
+                    found[player_id] = (rank, match, distance)
+
+        code = self.key_codes.get(folded)
+        if code is not None:
+            keep(code, 'exact', 0)
+        for code in self._prefix_codes(folded):
+            keep(code, 'prefix', 0)
+        if len(found) < limit:
+            for distance, code in self._fuzzy_codes(folded, max_distance, limit):
+                keep(code, 'fuzzy', distance)
+
+        ordered = sorted(found.items(), key=lambda item: item[1][0])[:limit]
+        return [
+            {'player_id': player_id, 'name': self.names[player_id], 'match': match, 'distance': distance}
+            for player_id, (_, match, distance) in ordered
+        ]
+
+    def resolve(self, name, max_distance=None):
+        """
+        The player_id a name refers to, or None when there's no match or the best match is a tie between players.
+
+        An exact match wins outright. Otherwise the closest fuzzy match is used (prefixes don't count, since 'Anthony'
+         would match every Anthony).
+        """
+        self._prepare()
+        folded = fold_name(name)
+        code = self.key_codes.get(folded)
+        if code is not None:
+            ids = self.key_ids[code]
+            return ids[0] if len(ids) == 1 else None
+        if max_distance is None:
+            max_distance = max(1, len(folded) // 4)
+        matches = sorted(self._fuzzy_codes(folded, max_distance))
+        if not matches:
+            return None
+        best = [code for distance, code in matches if distance == matches[0][0]]
+        ids = {player_id for code in best for player_id in self.key_ids[code]}
+        return ids.pop() if len(ids) == 1 else None
+
+    def resolve_many(self, names, max_distance=None):
+        """resolve for a list of names (each distinct name is only looked up once), as a float array with NaN misses."""
+        resolved = {}
+        ids = np.full(len(names), np.nan)
+        for i, name in enumerate(names):
+            if name not in resolved:
+                resolved[name] = self.resolve(name, max_distance)
+            if resolved[name] is not None:
+                ids[i] = resolved[name]
+        return ids
+
+
+def build_name_index(sources=None, folder=repo_folder):
+    """NameIndex over every (csv, name column, id column) source, by default all of name_sources."""
+    index = NameIndex()
+    for path, name_col, id_col in sources or name_sources:
+        path = os.path.join(folder, path)
+        if not os.path.exists(path):
+            print(f"Skipping missing name source {path}")
+            continue
+        index.add_frame(read_csv_cached(path, usecols=[name_col, id_col]), name_col, id_col)
+    index._prepare()
+    return index
@@ -0,0 +1,303 @@
+"""
+Season / position normalization shared by the model script and the notebooks.
+
+Normalization used to be written three different ways: fantasy_model.py ran groupby('season_id').apply(normalize_df),
+ which calls a Python function for every season and loops over the columns, nba_api_scraper.ipynb min-max scaled the
+ whole frame at once, and season_ranking.ipynb built df_bias_factors with agg(['mean', 'std']), merged it back, computed
+ z-scores column by column and then dropped the helper columns.
+
+normalize does all of these in one place. The statistics for every group (season, position, both, or the whole frame)
+ come from a single grouped aggregation, and each row picks up its group's statistics by integer group code, so there is
+ no merge and no drop. The fitted GroupStats are returned too, so the same scaling can be applied to new rows later.
+
+Adding a season used to mean redoing all of that over every historical row. RunningGroupStats keeps count / mean / M2 /
+ min / max for every group as accumulators that can be saved to disk, and merges new rows in with the parallel form of
+ Welford's update (Chan et al.), so an update only costs as much as the new rows. normalize_appended then rescales just
+ the rows in the groups the new rows touched.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import first_len, instrumented
+
+methods = {'minmax': '_norm', 'zscore': '_zscore'}
+
+
+class GroupStats:
+    """
+    Per-group statistics for a set of columns.
+
+    keys is a dataframe with one row per group (empty column list when normalizing the whole frame), and count / min /
+     max / mean / std are arrays of shape (n_groups, n_cols) in the same order.
+    """
+
+    def __init__(self, by, cols, keys, count, minimum, maximum, mean, std):
+        self.by = list(by)
+        self.cols = list(cols)
+        self.keys = keys.reset_index(drop=True)
+        self.count = count
+        self.min = minimum
+        self.max = maximum
+        self.mean = mean
+        self.std = std
+
+    def __len__(self):
+        return len(self.keys)
+
+    def group_codes(self, df):
+        """Which group every row of df belongs to. Rows from groups we haven't seen get -1."""
+        if not self.by:
+            return np.zeros(len(df), dtype=np.int64)
+        index = pd.MultiIndex.from_frame(self.keys[self.by])
+        return index.get_indexer(pd.MultiIndex.from_frame(df[self.by]))
+
+    def transform(self, df, method='minmax', suffix=None, codes=None):
+        """Normalized values for df's columns as a new dataframe, using these statistics."""
+        if method not in methods:
+            raise ValueError('Unknown method {}. Choose one of {}'.format(method, list(methods)))
+        suffix = methods[method] if suffix is None else suffix
+        codes = self.group_codes(df) if codes is None else codes
+        values = df[self.cols].to_numpy(dtype=np.float64)
+        known = codes >= 0
+        safe_codes = np.where(known, codes, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'minmax':
+                low = self.min[safe_codes]
+                scaled = (values - low) / (self.max[safe_codes] - low)
+            else:
+                scaled = (values - self.mean[safe_codes]) / self.std[safe_codes]
+        scaled[~known] = np.nan
+        return pd.DataFrame(scaled, columns=[col + suffix for col in self.cols], index=df.index)
+
+    def to_frame(self):
+        """The statistics as one wide dataframe, like the old df_bias_factors (season_id, position, pts_mean, ...)."""
+        frame = self.keys.copy()
+        for name in ['count', 'min', 'max', 'mean', 'std']:
+            values = getattr(self, name)
+            for j, col in enumerate(self.cols):
+                frame['{}_{}'.format(col, name)] = values[:, j]
+        return frame
+
+
+@instrumented()
+def fit_group_stats(df, cols, by=None, ddof=1):
+    """
+    Compute count / min / max / mean / std for every group in one grouped aggregation.
+
+    Returns (GroupStats, codes), where codes[i] is the group of row i (-1 for rows with a missing key).
+    """
+    by = [by] if isinstance(by, str) else list(by or [])
+    cols = list(cols)
+    if not by:
+        values = df[cols]
+        agg = pd.DataFrame([values.count(), values.min(), values.max(), values.mean(), values.std(ddof=ddof)],
+                           index=['count', 'min', 'max', 'mean', 'std']).T
+        stats = GroupStats(
+            by, cols, pd.DataFrame(index=[0]),
+            *[agg[name].to_numpy(dtype=np.float64)[None, :] for name in ['count', 'min', 'max', 'mean', 'std']]
+        )
+        return stats, np.zeros(len(df), dtype=np.int64)
+
+    grouped = df.groupby(by, sort=True, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    codes = np.where(np.isnan(codes.astype(np.float64)), -1, codes).astype(np.int64)
+    agg = grouped[cols].agg(['count', 'min', 'max', 'mean', 'std'] if ddof == 1 else ['count', 'min', 'max', 'mean'])
+
+    def block(name):
+        return agg.xs(name, axis=1, level=1)[cols].to_numpy(dtype=np.float64)
+
+    std = block('std') if ddof == 1 else grouped[cols].std(ddof=ddof)[cols].to_numpy(dtype=np.float64)
+    keys = agg.index.to_frame(index=False)
+    return GroupStats(by, cols, keys, block('count'), block('min'), block('max'), block('mean'), std), codes
+
+
+@instrumented(rows=first_len)
+def normalize(df, cols, by=None, method='minmax', suffix=None, ddof=1):
+    """
+    Add normalized copies of cols to df, scaled within each group of the by columns.
+
+    method: 'minmax' gives (x - group min) / (group max - group min) in <col>_norm columns, 'zscore' gives
+     (x - group mean) / group std in <col>_zscore columns. suffix overrides the column suffix.
+    by: column name or list of column names to group on, e.g. 'season_id' or ['season_id', 'position']. None normalizes
+     against the whole frame.
+    Returns (new dataframe, GroupStats). The input dataframe isn't modified and the row order is kept.
+    """
+    stats, codes = fit_group_stats(df, cols, by=by, ddof=ddof)
+    scaled = stats.transform(df, method=method, suffix=suffix, codes=codes)
+    out = df.drop(columns=[col for col in scaled.columns if col in df.columns])
+    return pd.concat([out, scaled], axis=1), stats
+
+
+class RunningGroupStats:
+    """
+    Per-group count / mean / M2 / min / max that can be updated as new rows arrive.
+
+    M2 is the sum of squared differences from the group mean, so the variance is M2 / (count - ddof). Each column keeps
+     its own count because the stats can be missing (NaN) for some rows.
+    """
+
+    def __init__(self, cols, by=None):
+        self.by = [by] if isinstance(by, str) else list(by or [])
+        self.cols = list(cols)
+        self.keys = []
+        self.key_index = {}
+        shape = (0, len(self.cols))
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.nan)
+        self.max = np.full(shape, np.nan)
+
+    @classmethod
+    def fit(cls, df, cols, by=None):
+        running = cls(cols, by=by)
+        running.update(df)
+        return running
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _batch(self, df):
+        """Group keys and count / mean / M2 / min / max for just the rows in df."""
+        if not self.by:
+            values = df[self.cols]
+            agg = pd.DataFrame([values.count(), values.mean(), values.var(), values.min(), values.max()],
+                               index=['count', 'mean', 'var', 'min', 'max']).T
+
+            def block(name):
+                return agg[name].to_numpy(dtype=np.float64)[None, :]
+
+            keys = [()]
+        else:
+            agg = df.groupby(self.by, sort=False, observed=True)[self.cols].agg(['count', 'mean', 'var', 'min', 'max'])
+
+            def block(name):
+                return agg.xs(name, axis=1, level=1)[self.cols].to_numpy(dtype=np.float64)
+
+            keys = [key if isinstance(key, tuple) else (key,) for key in agg.index.tolist()]
+        count = block('count')
+        # pandas gives the sample variance, so scale it back up to a sum of squares (a single row has no spread)
+        m2 = np.nan_to_num(block('var') * (count - 1))
+        return keys, count, block('mean'), m2, block('min'), block('max')
+
+    def update(self, df):
+        """
+        Merge the rows of df into the accumulators.
+
+        Returns the codes of the groups that changed (new groups included), in the same order as self.keys.
+        """
+        if len(df) == 0:
+            return np.zeros(0, dtype=np.int64)
+        keys, count, mean, m2, low, high = self._batch(df)
+        codes = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            code = self.key_index.get(key)
+            if code is None:
+                code = len(self.keys)
+                self.key_index[key] = code
+                self.keys.append(key)
+            codes[i] = code
+        self._grow(len(self.keys))
+
+        # Chan et al.'s pairwise merge of two (count, mean, M2) summaries
+        n_a = self.count[codes]
+        n = n_a + count
+        delta = np.nan_to_num(mean - self.mean[codes])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(n > 0, count / n, 0.0)
+        self.mean[codes] = self.mean[codes] + delta * share
+        self.m2[codes] = self.m2[codes] + m2 + delta ** 2 * n_a * share
+        self.count[codes] = n
+        self.min[codes] = np.fmin(self.min[codes], low)
+        self.max[codes] = np.fmax(self.max[codes], high)
+        return np.unique(codes)
+
+    def _grow(self, n_groups):
+        extra = n_groups - len(self.count)
+        if extra <= 0:
+            return
+        pad = np.zeros((extra, len(self.cols)))
+        self.count = np.vstack([self.count, pad])
+        self.mean = np.vstack([self.mean, pad])
+        self.m2 = np.vstack([self.m2, pad])
+        self.min = np.vstack([self.min, pad + np.nan])
+        self.max = np.vstack([self.max, pad + np.nan])
+
+    def key_frame(self):
+        if not self.by:
+            return pd.DataFrame(index=[0])
+        return pd.DataFrame(self.keys, columns=self.by)
+
+    def group_stats(self, ddof=1):
+        """Freeze the accumulators into a GroupStats, which does the actual scaling."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan))
+            mean = np.where(self.count > 0, self.mean, np.nan)
+        return GroupStats(self.by, self.cols, self.key_frame(), self.count.copy(), self.min.copy(), self.max.copy(),
+                          mean, std)
+
+    def save(self, path):
+        """Write the accumulators to a single .npz file."""
+        np.savez(
+            path,
+            settings=np.array(json.dumps({'by': self.by, 'cols': self.cols, 'keys': self.keys}, default=_plain)),
+            count=self.count,
+            mean=self.mean,
+            m2=self.m2,
+            min=self.min,
+            max=self.max,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read accumulators written by save."""
+        data = np.load(path)
+        settings = json.loads(str(data['settings']))
+        running = cls(settings['cols'], by=settings['by'])
+        running.keys = [tuple(key) for key in settings['keys']]
+        running.key_index = {key: code for code, key in enumerate(running.keys)}
+        for name in ['count', 'mean', 'm2', 'min', 'max']:
+            setattr(running, name, data[name])
+        return running
+
+
+def _plain(value):
+    # numpy scalars in the group keys, e.g. an int64 season start year
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot save group key {!r}'.format(value))
+
+
+@instrumented(rows=first_len)
+def normalize_appended(df, new_rows, running, method='minmax', suffix=None, ddof=1):
+    """
+    Normalize new_rows against the groups of an already normalized df, updating running (a RunningGroupStats) with them.
+
+    Group codes and statistics are only worked out for new_rows, so adding a new season costs as much as that season.
+     When new rows join a group df already has rows in (more games for the current season), those rows of df need new
+     values too, and finding them takes one pass over df's group columns. df itself isn't modified.
+    Returns (normalized new_rows, rescaled rows of df with df's index, GroupStats, keys of the affected groups). The
+     rescaled rows only hold the normalized columns, so df.update(rescaled) brings df up to date before the new rows
+     are appended to it, or to a sink, however the caller keeps them.
+    """
+    n_groups = len(running)
+    affected = running.update(new_rows)
+    stats = running.group_stats(ddof=ddof)
+    scaled = stats.transform(new_rows, method=method, suffix=suffix, codes=stats.group_codes(new_rows))
+    out = pd.concat([new_rows.drop(columns=[col for col in scaled.columns if col in new_rows.columns]), scaled], axis=1)
+
+    # Groups that only just appeared have no rows in df, so df only needs rescaling for groups it already had
+    rescaled = scaled.iloc[:0]
+    extended = affected[affected < n_groups]
+    if len(extended) and len(df):
+        missing = [col for col in scaled.columns if col not in df.columns]
+        if missing:
+            raise ValueError('df is missing the normalized columns {}. Normalize it with the same method first'.format(
+                missing))
+        codes = stats.group_codes(df)
+        rows = np.flatnonzero(np.isin(codes, extended))
+        rescaled = stats.transform(df.iloc[rows], method=method, suffix=suffix, codes=codes[rows])
+    return out, rescaled, stats, stats.keys.iloc[affected].reset_index(drop=True)
@@ -0,0 +1,280 @@
+"""
+Cached pipeline stages for season_ranking.ipynb.
+
+The notebook is a chain of cells: load the CSVs, lowercase and rename, map positions, filter, convert to per game,
+ merge in names and positions, z-score by season and position, combine with stats_weights. Changing only the weights
+ meant running every earlier cell again.
+
+A Pipeline is a set of named stages, each a function with declared inputs (other stages and files) and parameters.
+ Every stage output is cached on disk in csv_cache.py's columnar format, under a key that hashes
+
+- the stage's name, code, parameters and version
+- the contents of its input files
+- the source of the helper modules it declares (a stage's own code doesn't show edits to the functions it calls)
+- the keys of its input stages
+
+so a key changes exactly when something upstream of the stage changed. Bumping a stage's version forces a rerun for
+ anything else the key can't see. Running a stage loads it from the cache when the
+ key is there and only recomputes the stages whose keys moved, so changing the weights reruns the last two stages and
+ reads the z-scores from disk.
+
+Stage functions get their inputs as dataframes and must not modify them in place: cached inputs are memory mapped and
+ shared with every other stage that uses them.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import time
+
+import pandas as pd
+
+from csv_cache import file_checksum, read_frame, write_frame
+from instrumentation import stage as instrumented_stage
+
+cache_folder = '.pipeline_cache'
+
+
+class Stage:
+
+    def __init__(self, name, func, inputs=(), files=(), params=None, modules=(), version=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.params = dict(params or {})
+        self.version = version
+        try:
+            self.code = inspect.getsource(func)
+        except (OSError, TypeError):
+            self.code = func.__qualname__
+        # Source files of the helper modules the stage calls into, checksummed like input files
+        self.module_files = [inspect.getsourcefile(module) for module in modules]
+
+
+class Pipeline:
+    """
+    Named, dependency tracked stages with an on-disk cache.
+
+    cache_dir: where stage outputs go, one folder per stage with one entry per key
+    keep: how many cached outputs to keep for each stage, so switching back to recent parameters is still free
+    """
+
+    def __init__(self, cache_dir=cache_folder, keep=3):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        self.stages = {}
+        self._memory = {}
+        self._checksums = {}
+        # (stage, how it was produced: 'memory', 'disk' or 'computed', seconds) for every stage the last run touched
+        self.last_run = []
+
+    def stage(self, name=None, inputs=(), files=(), params=None, modules=(), version=None):
+        """
+        Decorator registering func(*input frames, **params) as a stage, named after the function by default.
+
+        modules: helper modules the stage calls into. Editing any of them invalidates the stage's cached output.
+        version: any value to bump by hand when the output changes for a reason nothing else in the key sees
+        """
+        def register(func):
+            self.add(name or func.__name__, func, inputs, files, params, modules, version)
+            return func
+        return register
+
+    def add(self, name, func, inputs=(), files=(), params=None, modules=(), version=None):
+        for dependency in inputs:
+            if dependency not in self.stages:
+                raise ValueError('Stage {} depends on unknown stage {}'.format(name, dependency))
+        self.stages[name] = Stage(name, func, inputs, files, params, modules, version)
+
+    def set_params(self, name, **params):
+        """Change a stage's parameters. Only that stage and the ones downstream of it will rerun."""
+        if name not in self.stages:
+            raise ValueError('Unknown stage {}. Choose one of {}'.format(name, list(self.stages)))
+        self.stages[name].params.update(params)
+
+    def _file_key(self, path):
+        # Checksums are remembered per size / modified time, so unchanged files are only hashed once per session
+        stat = os.stat(path)
+        marker = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if marker not in self._checksums:
+            self._checksums[marker] = file_checksum(path)
+        return self._checksums[marker]
+
+    def key(self, name):
+        """Hash of everything a stage's output depends on."""
+        stage = self.stages[name]
+        description = {
+            'name': name,
+            'code': stage.code,
+            'params': stage.params,
+            'version': stage.version,
+            'files': [self._file_key(path) for path in stage.files],
+            'modules': [self._file_key(path) for path in stage.module_files],
+            'inputs': [self.key(dependency) for dependency in stage.inputs],
+        }
+        text = json.dumps(description, sort_keys=True, default=repr)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def _path(self, name, key):
+        return os.path.join(self.cache_dir, name, key)
+
+    def _load(self, path):
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return read_frame(path)
+        with open(os.path.join(path, 'output.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, name, key, output):
+        path = self._path(name, key)
+        try:
+            if isinstance(output, pd.DataFrame):
+                write_frame(output, path)
+            else:
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, 'output.pkl'), 'wb') as f:
+                    pickle.dump(output, f)
+        except OSError as e:
+            print(f"Couldn't cache stage {name}: {e}")
+            return
+        # Drop the oldest outputs past keep
+        folder = os.path.join(self.cache_dir, name)
+        entries = sorted(
+            (entry for entry in os.listdir(folder) if not entry.startswith('.')),
+            key=lambda entry: os.path.getmtime(os.path.join(folder, entry)),
+        )
+        for entry in entries[:-self.keep]:
+            shutil.rmtree(os.path.join(folder, entry), ignore_errors=True)
+
+    def run(self, name, refresh=False):
+        """Output of a stage, recomputing it (and its inputs) only where their keys changed."""
+        self.last_run = []
+        return self._run(name, refresh)
+
+    def _run(self, name, refresh):
+        stage = self.stages[name]
+        key = self.key(name)
+        started = time.perf_counter()
+        if not refresh and self._memory.get(name, (None,))[0] == key:
+            self.last_run.append((name, 'memory', time.perf_counter() - started))
+            return self._memory[name][1]
+        path = self._path(name, key)
+        if not refresh and os.path.exists(path):
+            output = self._load(path)
+            how = 'disk'
+        else:
+            inputs = [self._run(dependency, refresh) for dependency in stage.inputs]
+            started = time.perf_counter()
+            with instrumented_stage('pipeline.{}'.format(name)) as record:
+                output = stage.func(*inputs, **stage.params)
+                record.rows = len(output) if hasattr(output, '__len__') else None
+            self._save(name, key, output)
+            how = 'computed'
+        self._memory[name] = (key, output)
+        self.last_run.append((name, how, time.perf_counter() - started))
+        return output
+
+    def report(self):
+        """The last run as a dataframe: one row per stage it touched, in the order they finished."""
+        return pd.DataFrame(self.last_run, columns=['stage', 'source', 'seconds'])
+
+    def clear(self, name=None):
+        """Delete the cached outputs of one stage, or of every stage."""
+        folder = self.cache_dir if name is None else os.path.join(self.cache_dir, name)
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        if name is None:
+            self._memory = {}
+        else:
+            self._memory.pop(name, None)
+
+
+# season_ranking.ipynb as stages
+
+ranking_stats = ['min', 'fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'ast', 'stl', 'tov', 'blk', 'pts']
+
+position_mapping = {
+    'Guard': 'Guard',
+    'Forward': 'Forward',
+    'Center': 'Center',
+    'Guard-Forward': 'Guard',
+    'Forward-Guard': 'Forward',
+    'Forward-Center': 'Forward',
+    'Center-Forward': 'Center',
+}
+
+
+def season_ranking_pipeline(stats_csv='df_player_career_stats.csv', player_info_csv='df_player_info.csv',
+                            cache_dir=cache_folder):
+    """
+    The season_ranking.ipynb cells as stages:
+
+    career_stats, player_info -> filtered -> per_game -> merged -> zscores -> combined -> ranked
+
+    Parameters: player_info (positions), filtered (min_gp, first_season_start), per_game (stats), zscores (stats,
+     bias_factors), combined (weights). ranked is the notebook's final table, with combined_score and rank and without
+     the z-score columns.
+    """
+    # Imported here so pipeline.py itself doesn't pull in the ranking code
+    import loaders
+    import normalization
+    import ranking
+    from loaders import load_career_stats, load_player_info
+    from normalization import normalize
+    from ranking import RankingIndex, combined_score, stats_weights
+
+    pipeline = Pipeline(cache_dir)
+
+    @pipeline.stage(files=[stats_csv], modules=[loaders])
+    def career_stats():
+        df = load_career_stats(stats_csv)
+        df.columns = df.columns.str.lower()
+        return df
+
+    @pipeline.stage(files=[player_info_csv], params={'positions': position_mapping}, modules=[loaders])
+    def player_info(positions):
+        df = load_player_info(player_info_csv)
+        df.columns = df.columns.str.lower()
+        df = df.rename(columns={'person_id': 'player_id'})
+        df['position'] = df['position'].map(positions)
+        return df
+
+    @pipeline.stage(inputs=['career_stats'], params={'min_gp': 10, 'first_season_start': 1979})
+    def filtered(df, min_gp, first_season_start):
+        df = df.dropna(how='all')
+        return df[(df['gp'] >= min_gp) & (df['season_start'] >= first_season_start)]
+
+    @pipeline.stage(inputs=['filtered'], params={'stats': ranking_stats})
+    def per_game(df, stats):
+        cols = [stat for stat in stats if stat in df.columns]
+        return df.assign(**{stat: df[stat] / df['gp'] for stat in cols})
+
+    @pipeline.stage(inputs=['per_game', 'player_info'])
+    def merged(df_stats, df_player_info):
+        df = pd.merge(
+            df_player_info[['player_id', 'display_first_last', 'position']], df_stats, on=['player_id'], how='outer'
+        ).drop_duplicates()
+        df = df.reset_index(drop=True).dropna(how='all')
+        return df.dropna(subset=['season_id'])
+
+    @pipeline.stage(inputs=['merged'], params={'stats': ranking_stats, 'bias_factors': ['season_id', 'position']},
+                    modules=[normalization])
+    def zscores(df, stats, bias_factors):
+        df, _ = normalize(df, stats, by=bias_factors, method='zscore')
+        return df
+
+    @pipeline.stage(inputs=['zscores'], params={'weights': dict(stats_weights)}, modules=[ranking])
+    def combined(df, weights):
+        scores = combined_score(df, weights)
+        df = df.drop(columns=[col for col in df.columns if 'zscore' in col])
+        df = df.drop(columns=['league_id', 'team_id', 'min', 'reb', 'pf'], errors='ignore')
+        return df.assign(combined_score=scores)
+
+    @pipeline.stage(inputs=['combined'], modules=[ranking])
+    def ranked(df):
+        return df.assign(rank=RankingIndex(df).ranks())
+
+    return pipeline
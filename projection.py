@@ -0,0 +1,194 @@
+"""
+Next season projections for the player comparison model.
+
+For a player season we find the k most similar seasons, look up each of those players' following season and take a
+ weighted average of their stats, weighting each neighbor by 1 / distance so the closest seasons count the most. This is
+ the same projection fantasy_model.py describes, written so a whole batch of players is projected with array gathers
+ from a SeasonStore instead of find_player scans.
+
+project_season runs the projection for every player in a season at once and produces the projected fantasy points
+ table (projected_fantasy_pts_final_2018_19.csv). The neighbor search is spread over a process pool. The feature matrix is
+ written to one .npy file that every worker memory maps read-only, so each task only sends a list of row numbers and gets
+ back the neighbor rows and distances.
+"""
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrumented
+from scoring import fantasy_points
+from similarity import SimilarityEngine, stats
+
+weightings = ['inverse', 'inverse_square', 'rank', 'uniform']
+
+
+# Smallest distance we divide by. Only exact matches (distance 0) get closer, and those are handled separately.
+min_distance = 1e-9
+
+
+def neighbor_weights(neighbor_distances, weighting='inverse', usable=None):
+    """
+    Weight for every neighbor (along the last axis), before leaving out the ones without a usable next season.
+
+    'inverse' is 1 / distance (the model's default), 'inverse_square' is 1 / distance^2, 'rank' is 1 / rank (1 for the
+     closest neighbor, 1/2 for the next, ...) and 'uniform' is a plain average.
+    usable: optional boolean mask of the neighbors that will actually be used. For the inverse weightings, a query with
+     a usable neighbor at distance 0 (the same season twice, or two identical seasons) gives its usable exact matches
+     equal weight and every other neighbor none, instead of dividing by zero.
+    """
+    distances = np.asarray(neighbor_distances, dtype=np.float64)
+    if weighting in ('inverse', 'inverse_square'):
+        power = 1 if weighting == 'inverse' else 2
+        weights = 1 / np.maximum(distances, min_distance) ** power
+        exact = distances == 0
+        if usable is not None:
+            exact &= usable
+        has_exact = exact.any(axis=-1, keepdims=True)
+        return np.where(has_exact, exact.astype(np.float64), weights)
+    if weighting == 'rank':
+        return np.broadcast_to(1 / np.arange(1, distances.shape[-1] + 1), distances.shape)
+    if weighting == 'uniform':
+        return np.ones(distances.shape)
+    raise ValueError('Unknown weighting {}. Choose one of {}'.format(weighting, weightings))
+
+
+@instrumented(rows=len)
+def weighted_projection(store, neighbor_rows, neighbor_distances, cols=None, max_season=None, weighting='inverse'):
+    """
+    Project stats from neighbor seasons.
+
+    neighbor_rows / neighbor_distances: arrays of shape (n_players, k), as returned by SimilarityEngine.top_k
+    cols: raw stat columns to project, defaults to the 14 model stats
+    max_season: optional last season we trust as a "next season" (e.g. '2017-18' while 2018-19 is still being played).
+     Neighbors whose next season is later than this are skipped. A season the store doesn't have raises ValueError.
+    weighting: how neighbors are weighted, see neighbor_weights
+    Returns a float array of shape (n_players, len(cols)). Players without a usable neighbor get NaN.
+    """
+    cols = cols or stats
+    neighbor_rows = np.atleast_2d(neighbor_rows)
+    neighbor_distances = np.atleast_2d(neighbor_distances)
+
+    next_rows = np.where(neighbor_rows >= 0, store.next_rows[np.maximum(neighbor_rows, 0)], -1)
+    if max_season is not None:
+        if str(max_season) not in store.season_codes:
+            raise ValueError('Unknown max_season {}. The store has {} to {}'.format(
+                max_season, store.seasons[0], store.seasons[-1]))
+        max_code = store.season_codes[str(max_season)]
+        late = store.season_index[np.maximum(next_rows, 0)] > max_code
+        next_rows = np.where(late, -1, next_rows)
+
+    # Neighbors without a next season, or with a missing stat in it, get no weight for that stat
+    next_values = store.gather(next_rows, cols)
+    weights = np.where(next_rows >= 0, neighbor_weights(neighbor_distances, weighting, usable=next_rows >= 0), 0)
+    weights = np.where(np.isnan(next_values), 0, weights[:, :, None])
+    weighted_sum = np.nansum(next_values * weights, axis=1)
+    total_weight = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_weight > 0, weighted_sum / total_weight, np.nan)
+
+
+def project_player(store, engine, player_id, season_id, k=10, max_season=None):
+    """
+    Project one player's next season from their k most similar seasons.
+
+    Returns a dict shaped like fantasy_model.py's projected_stats_dict ({'proj_season_id': ..., 'proj_pts': ...}), or
+     None when the season isn't in the store.
+    """
+    row = store.row(player_id, season_id)
+    if row < 0:
+        return None
+    neighbor_rows, neighbor_distances = engine.top_k_rows([row], k=k)
+    projected = weighted_projection(store, neighbor_rows, neighbor_distances, max_season=max_season)[0]
+
+    projected_stats_dict = {'proj_season_id': store.next_season_id(season_id)}
+    for col, value in zip(stats, projected):
+        projected_stats_dict['proj_' + col] = float(value)
+    return projected_stats_dict
+
+
+# Each worker process keeps its own engine over the memory mapped matrix, built once by the pool initializer
+_worker_engine = None
+
+
+def _init_worker(matrix_path, metric):
+    global _worker_engine
+    _worker_engine = SimilarityEngine(matrix=np.load(matrix_path, mmap_mode='r'), metric=metric)
+
+
+def _worker_neighbors(rows, k, candidates):
+    return _worker_engine.top_k_rows(rows, k=k, candidates=candidates)
+
+
+@instrumented(rows=len)
+def parallel_top_k(engine, tasks, k=10, workers=None):
+    """
+    Run top_k_rows for a list of (rows, candidates) tasks across a process pool and return their results in order.
+
+    candidates can be None or a boolean mask over the engine rows, see SimilarityEngine.top_k.
+    workers: number of processes, defaults to the number of CPUs. 1 runs everything in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Workers rebuild a SimilarityEngine from the matrix, so other engines (like ann.IVFPQIndex) run in this process
+    if workers == 1 or len(tasks) == 1 or not isinstance(engine, SimilarityEngine):
+        return [engine.top_k_rows(rows, k=k, candidates=candidates) for rows, candidates in tasks]
+
+    folder = tempfile.mkdtemp(prefix='neighbors-')
+    try:
+        matrix_path = os.path.join(folder, 'matrix.npy')
+        np.save(matrix_path, engine.matrix)
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(matrix_path, engine.metric)) as executor:
+            futures = [executor.submit(_worker_neighbors, rows, k, candidates) for rows, candidates in tasks]
+            return [future.result() for future in futures]
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def season_neighbors(engine, rows, k=10, workers=None, chunk_size=64):
+    """top_k_rows for a batch of rows, split into chunks of chunk_size rows across a process pool (see parallel_top_k)."""
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+    chunks = [(rows[start:start + chunk_size], None) for start in range(0, len(rows), chunk_size)] or [(rows, None)]
+    results = parallel_top_k(engine, chunks, k=k, workers=workers)
+    return np.concatenate([idx for idx, _ in results]), np.concatenate([dist for _, dist in results])
+
+
+@instrumented(rows=len)
+def project_season(store, engine, season_id, k=10, max_season=None, workers=None, chunk_size=64, output=None,
+                   scoring=None):
+    """
+    Project every player who has a season right before season_id, and score the projections in fantasy points.
+
+    season_id: the season to project, e.g. '2018-19'. Players are projected from the latest season before it.
+    max_season: last season trusted as a neighbor's "next season". Defaults to the season we project from, so nothing
+     from season_id itself leaks into its own projections.
+    output: optional CSV path to write the table to, rounded to two decimals like projected_fantasy_pts_final_2018_19.csv
+    Returns a dataframe with player_name (when the store has names), player_id, season_id, the 14 stats and fantasy_pts,
+     sorted from the most fantasy points to the least. Players without a usable neighbor are left out.
+    """
+    earlier = [season for season in store.seasons if season < str(season_id)]
+    if not earlier:
+        raise ValueError('No season before {} to project from'.format(season_id))
+    base_season = earlier[-1]
+    max_season = max_season or base_season
+
+    rows = np.flatnonzero(store.season_index == store.season_codes[base_season])
+    neighbor_rows, neighbor_distances = season_neighbors(engine, rows, k=k, workers=workers, chunk_size=chunk_size)
+    projected = weighted_projection(store, neighbor_rows, neighbor_distances, max_season=max_season)
+
+    df_projected = pd.DataFrame(projected, columns=stats)
+    if 'player_name' in store.df.columns:
+        df_projected.insert(0, 'player_name', store.df['player_name'].to_numpy()[rows])
+    df_projected.insert(1 if 'player_name' in df_projected.columns else 0, 'player_id', store.player_ids[rows])
+    df_projected.insert(df_projected.columns.get_loc('player_id') + 1, 'season_id', str(season_id))
+    df_projected['fantasy_pts'] = fantasy_points(df_projected, scoring)
+    df_projected = df_projected.dropna(subset=['fantasy_pts'])
+    df_projected = df_projected.sort_values('fantasy_pts', ascending=False, kind='stable').reset_index(drop=True)
+
+    if output is not None:
+        df_projected.round(2).to_csv(output, index=False)
+    return df_projected
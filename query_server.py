@@ -0,0 +1,329 @@
+"""
+Local query server for similar seasons, projections and season rankings.
+
+Every question ("who are Jrue Holiday 2016-17's 10 nearest seasons?", "project this player's next season", "where does
+ this season rank?") used to mean rerunning fantasy_model.py or season_ranking.ipynb, which reloads and renormalizes
+ everything. The server loads it all once and keeps it in memory:
+
+- the per game seasons, normalized by season like fantasy_model.py, in a SeasonStore and a SimilarityEngine
+- the season ranking index saved by season_ranking.ipynb (or built from the cached pipeline when it isn't there)
+- a NameIndex, so players can be asked for by name as well as by id
+
+and answers JSON requests over HTTP, one thread per request, with an LRU cache of recent answers in front.
+
+    python query_server.py --port 8765
+
+    GET /similar?player=Jrue Holiday&season_id=2016-17&k=10
+    GET /project?player=201950&season_id=2016-17&k=10&max_season=2017-18
+    GET /rank?player=201950&season_id=2016-17
+    GET /top?n=25&season_id=2015-16&position=Guard
+    GET /search?q=giannis
+    GET /stats
+
+QueryClient wraps the same endpoints with urllib for scripts and notebooks.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from csv_cache import read_csv_cached
+from name_search import build_name_index
+from normalization import normalize
+from projection import weighted_projection
+from ranking import RankingIndex
+from season_store import SeasonStore
+from similarity import SimilarityEngine, stats
+
+repo_folder = os.path.dirname(os.path.abspath(__file__))
+
+
+class LRUCache:
+    """Thread safe least recently used cache on an OrderedDict."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+def _plain(value):
+    """numpy scalars, NaN and inf -> plain JSON values. json.dumps would write NaN / Infinity, which isn't JSON."""
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating, float)):
+        return float(value) if np.isfinite(value) else None
+    return value
+
+
+def _k(k):
+    k = int(k)
+    if k < 1:
+        raise ValueError('k must be at least 1, got {}'.format(k))
+    return k
+
+
+def records(df):
+    return [{col: _plain(value) for col, value in row.items()} for row in df.to_dict(orient='records')]
+
+
+class QueryService:
+    """
+    Everything the server answers from, loaded once.
+
+    folder: repo folder holding nba-stats-csv/
+    min_gp: games played cutoff for the model seasons, like fantasy_model.py
+    ranking_dir: a RankingIndex saved by season_ranking.ipynb. Built with pipeline.season_ranking_pipeline when missing.
+    """
+
+    def __init__(self, folder=repo_folder, min_gp=10, ranking_dir='season_ranking_index', cache_size=1024):
+        self.folder = folder
+        started = time.perf_counter()
+        df = read_csv_cached(os.path.join(folder, 'nba-stats-csv/player_general_traditional_per_game_data.csv'))
+        df = df.dropna(how='all')
+        df = df[df['gp'] > min_gp]
+        df_normalized, _ = normalize(df, stats, by='season_id', method='minmax')
+        names = read_csv_cached(os.path.join(folder, 'nba-stats-csv/player_info.csv'))
+        df_normalized = pd.merge(
+            df_normalized.reset_index(drop=True), names, on=['player_id', 'season_id'], how='left'
+        ).drop_duplicates(subset=['player_id', 'season_id'])
+        self.store = SeasonStore(df_normalized)
+        self.engine = SimilarityEngine(self.store.df)
+        self.names = build_name_index(folder=folder)
+        self.ranking = self._load_ranking(os.path.join(folder, ranking_dir))
+        self.cache = LRUCache(cache_size)
+        self.requests = 0
+        self.load_seconds = time.perf_counter() - started
+
+    def _load_ranking(self, directory):
+        if os.path.exists(os.path.join(directory, 'index.npz')):
+            return RankingIndex.load(directory)
+        from pipeline import season_ranking_pipeline
+        pipeline = season_ranking_pipeline(
+            stats_csv=os.path.join(self.folder, 'df_player_career_stats.csv'),
+            player_info_csv=os.path.join(self.folder, 'df_player_info.csv'),
+            cache_dir=os.path.join(self.folder, '.pipeline_cache'),
+        )
+        return RankingIndex(pipeline.run('combined'))
+
+    def player_id(self, player):
+        """A player id from an id or a name."""
+        if player is None or str(player).strip() == '':
+            raise ValueError('Missing player')
+        if str(player).strip().isdigit():
+            return int(player)
+        player_id = self.names.resolve(player)
+        if player_id is None:
+            raise ValueError('Unknown or ambiguous player {}'.format(player))
+        return player_id
+
+    def _row(self, player, season_id):
+        player_id = self.player_id(player)
+        row = self.store.row(player_id, season_id)
+        if row < 0:
+            raise ValueError('No season {} for player {}'.format(season_id, player_id))
+        return row
+
+    def similar(self, player, season_id, k=10):
+        """The k most similar seasons to a player season, closest first."""
+        row = self._row(player, season_id)
+        neighbor_rows, neighbor_distances = self.engine.top_k_rows([row], k=_k(k))
+        found = neighbor_rows[0] >= 0
+        df = self.store.df.iloc[neighbor_rows[0][found]]
+        cols = [col for col in ['player_id', 'player_name', 'season_id'] + stats if col in df.columns]
+        df = df[cols].assign(distance=neighbor_distances[0][found])
+        return {'player_id': int(self.store.player_ids[row]), 'season_id': season_id, 'neighbors': records(df)}
+
+    def project(self, player, season_id, k=10, max_season=None):
+        """Next season projection from the k most similar seasons."""
+        row = self._row(player, season_id)
+        neighbor_rows, neighbor_distances = self.engine.top_k_rows([row], k=_k(k))
+        projected = weighted_projection(self.store, neighbor_rows, neighbor_distances, max_season=max_season)[0]
+        return {
+            'player_id': int(self.store.player_ids[row]),
+            'season_id': season_id,
+            'proj_season_id': self.store.next_season_id(season_id),
+            'projection': {col: _plain(value) for col, value in zip(stats, projected)},
+        }
+
+    def rank(self, player=None, season_id=None, score=None):
+        """Overall and in season rank of a player season, or where a combined score would rank."""
+        if season_id is not None and season_id not in self.ranking.season_codes:
+            raise ValueError('Unknown season {}'.format(season_id))
+        if score is not None:
+            score = float(score)
+            return {
+                'score': score,
+                'rank': self.ranking.rank_of(score),
+                'season_rank': self.ranking.rank_of(score, season_id) if season_id is not None else None,
+            }
+        player_id = self.player_id(player)
+        rank = self.ranking.rank(player_id, season_id)
+        if rank is None:
+            raise ValueError('No ranked season {} for player {}'.format(season_id, player_id))
+        return {
+            'player_id': player_id,
+            'season_id': season_id,
+            'rank': rank,
+            'season_rank': self.ranking.rank(player_id, season_id, within_season=True),
+        }
+
+    def top(self, n=25, season_id=None, position=None):
+        df = self.ranking.top(int(n), season_id=season_id, position=position)
+        return {'seasons': records(df)}
+
+    def search(self, q, limit=10):
+        return {'players': self.names.search(q, limit=int(limit))}
+
+    def stats(self):
+        return {
+            'seasons': len(self.store),
+            'ranked_seasons': len(self.ranking),
+            'load_seconds': self.load_seconds,
+            'requests': self.requests,
+            'cache_size': len(self.cache),
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+        }
+
+    endpoints = ['similar', 'project', 'rank', 'top', 'search', 'stats']
+
+    def query(self, endpoint, params):
+        """Answer one request, from the cache when the same request was answered before."""
+        if endpoint not in self.endpoints:
+            raise KeyError(endpoint)
+        self.requests += 1
+        if endpoint == 'stats':
+            return self.stats()
+        key = (endpoint, tuple(sorted(params.items())))
+        result = self.cache.get(key)
+        if result is None:
+            result = getattr(self, endpoint)(**params)
+            self.cache.put(key, result)
+        return result
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        endpoint = url.path.strip('/')
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        # Unknown endpoints are turned away before dispatch, so a KeyError from inside an endpoint can't pass for a 404
+        if endpoint not in QueryService.endpoints:
+            error = 'Unknown endpoint {}. Choose one of {}'.format(endpoint, QueryService.endpoints)
+            status, body = 404, {'error': error}
+        else:
+            try:
+                status, body = 200, self.service.query(endpoint, params)
+            except (TypeError, ValueError) as e:
+                status, body = 400, {'error': str(e)}
+            except Exception as e:
+                # Anything else is our bug, but the client still gets an answer instead of a dropped connection
+                status, body = 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # One line per request on stderr would cost more than answering it
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8765):
+    """A ThreadingHTTPServer answering from service. Call serve_forever() on it, or shutdown() to stop."""
+    handler = type('BoundQueryHandler', (QueryHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class QueryClient:
+    """urllib client for the query server."""
+
+    def __init__(self, base_url='http://127.0.0.1:8765', timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get(self, endpoint, **params):
+        params = {key: value for key, value in params.items() if value is not None}
+        url = '{}/{}?{}'.format(self.base_url, endpoint, urllib.parse.urlencode(params))
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise ValueError(json.loads(e.read()).get('error', str(e)))
+
+    def similar(self, player, season_id, k=10):
+        return self.get('similar', player=player, season_id=season_id, k=k)
+
+    def project(self, player, season_id, k=10, max_season=None):
+        return self.get('project', player=player, season_id=season_id, k=k, max_season=max_season)
+
+    def rank(self, player=None, season_id=None, score=None):
+        return self.get('rank', player=player, season_id=season_id, score=score)
+
+    def top(self, n=25, season_id=None, position=None):
+        return self.get('top', n=n, season_id=season_id, position=position)
+
+    def search(self, q, limit=10):
+        return self.get('search', q=q, limit=limit)
+
+    def stats(self):
+        return self.get('stats')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve similar seasons, projections and rankings over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    service = QueryService(cache_size=args.cache_size)
+    server = make_server(service, args.host, args.port)
+    print(f"Loaded {len(service.store)} seasons in {service.load_seconds:.1f}s, serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
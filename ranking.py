@@ -0,0 +1,235 @@
+"""
+Season ranking index for season_ranking.ipynb.
+
+The notebook used to rank() the combined score, sort the whole table to show head(25), and find a player's seasons with
+ a string comparison against every row of display_first_last. RankingIndex sorts the scores once and keeps the orders
+ it needs:
+
+- every season from best to worst, so the overall top N is the first N rows of that order
+- the same order inside every season and every position, so a per season / per position top N is a slice too
+- the sorted scores, so the rank of any score (or any player season) is a binary search
+- every player's rows in season order, so a player's seasons are a dictionary lookup and a slice
+
+The index can be saved to a folder (the frame in csv_cache.py's columnar format plus the orders in one .npz) and loaded
+ back memory-mapped, so later sessions don't pay for the sort again.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from csv_cache import read_frame, read_meta, write_frame
+from instrumentation import instrumented
+
+# Weights for each statistic's z-score in the combined score. Turnovers count against a season.
+stats_weights = {
+    'fgm_zscore': 0.1,
+    'fga_zscore': 0.05,
+    'fg3m_zscore': 0.1,
+    'fg3a_zscore': 0.05,
+    'ftm_zscore': 0.05,
+    'fta_zscore': 0.05,
+    'oreb_zscore': 0.05,
+    'dreb_zscore': 0.1,
+    'ast_zscore': 0.1,
+    'stl_zscore': 0.1,
+    'tov_zscore': -0.05,
+    'blk_zscore': 0.1,
+    'pts_zscore': 0.15
+}
+
+
+def combined_score(df, weights=None):
+    """Weighted sum of the z-score columns, as one float array."""
+    weights = weights or stats_weights
+    cols = list(weights)
+    return df[cols].to_numpy(dtype=np.float64) @ np.array([weights[col] for col in cols])
+
+
+def group_index(values, secondary):
+    """
+    Rows grouped by values, each group sorted by secondary (ascending, NaN last).
+
+    Returns (keys, order, starts): the rows of group keys[i] are order[starts[i]:starts[i + 1]]. Rows with a missing
+     value aren't in any group.
+    """
+    codes, keys = pd.factorize(np.asarray(values), sort=True)
+    order = np.lexsort((secondary, codes))
+    order = order[codes[order] >= 0]
+    starts = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+    return keys.tolist() if hasattr(keys, 'tolist') else list(keys), order, starts
+
+
+class RankingIndex:
+    """
+    Sorted, persisted index over a ranked season table.
+
+    Ranks are 1 for the best score and count ties the same way as rank(method='min'). Seasons without a score are
+     sorted after every scored season and have no rank (NaN, or None from rank).
+    """
+
+    def __init__(self, df, score_col='combined_score', id_col='player_id', season_col='season_id',
+                 position_col='position', name_col='display_first_last'):
+        self.df = df.reset_index(drop=True)
+        self.score_col = score_col
+        self.id_col = id_col
+        self.season_col = season_col
+        self.position_col = position_col
+        self.name_col = name_col
+        self._build()
+
+    @instrumented(name='ranking.RankingIndex.build')
+    def _build(self):
+        # Sorting the negated scores ascending puts the best season first, and NaN scores last
+        self.neg_scores = -self.df[self.score_col].to_numpy(dtype=np.float64)
+        self.order = np.argsort(self.neg_scores, kind='stable')
+        self.sorted_neg_scores = self.neg_scores[self.order]
+
+        self.seasons, self.season_order, self.season_starts = group_index(self.df[self.season_col], self.neg_scores)
+        self.positions, self.position_order, self.position_starts = group_index(
+            self.df[self.position_col], self.neg_scores
+        )
+        season_codes = pd.factorize(np.asarray(self.df[self.season_col]), sort=True)[0]
+        player_ids, self.player_order, self.player_starts = group_index(
+            self.df[self.id_col].to_numpy(dtype=np.int64), season_codes
+        )
+        self.player_ids = np.asarray(player_ids, dtype=np.int64)
+        self._index_keys()
+
+    def _index_keys(self):
+        self.season_codes = {season: code for code, season in enumerate(self.seasons)}
+        self.position_codes = {position: code for code, position in enumerate(self.positions)}
+        # Lower case name -> player ids. Some names belong to more than one player.
+        self.name_index = {}
+        if self.name_col in self.df.columns:
+            names = self.df[self.name_col].to_numpy()[self.player_order[self.player_starts[:-1]]]
+            for player_id, name in zip(self.player_ids.tolist(), names):
+                if isinstance(name, str):
+                    self.name_index.setdefault(name.lower(), []).append(player_id)
+
+    def __len__(self):
+        return len(self.df)
+
+    def _season_rows(self, season_id):
+        code = self.season_codes.get(season_id)
+        if code is None:
+            return self.season_order[:0]
+        return self.season_order[self.season_starts[code]:self.season_starts[code + 1]]
+
+    def _position_rows(self, position):
+        code = self.position_codes.get(position)
+        if code is None:
+            return self.position_order[:0]
+        return self.position_order[self.position_starts[code]:self.position_starts[code + 1]]
+
+    def player_rows(self, player_id):
+        """Rows for one player, in season order."""
+        i = np.searchsorted(self.player_ids, int(player_id))
+        if i == len(self.player_ids) or self.player_ids[i] != int(player_id):
+            return self.player_order[:0]
+        return self.player_order[self.player_starts[i]:self.player_starts[i + 1]]
+
+    def _ranks(self, neg_scores):
+        # Float so seasons without a score can stay NaN, the way pandas rank leaves them
+        ranks = (np.searchsorted(self.sorted_neg_scores, neg_scores, side='left') + 1).astype(np.float64)
+        ranks[np.isnan(neg_scores)] = np.nan
+        return ranks
+
+    def ranks(self):
+        """Overall rank of every row, in row order, like rank(ascending=False, method='min'). NaN for unscored rows."""
+        return self._ranks(self.neg_scores)
+
+    def rank_of(self, score, season_id=None):
+        """Where a score would rank overall, or within season_id: 1 + the number of seasons with a higher score."""
+        if season_id is None:
+            return int(np.searchsorted(self.sorted_neg_scores, -score, side='left')) + 1
+        season_neg_scores = self.neg_scores[self._season_rows(season_id)]
+        return int(np.searchsorted(season_neg_scores, -score, side='left')) + 1
+
+    def rank(self, player_id, season_id, within_season=False):
+        """Rank of one player season, overall or within its season. None when the season is unscored or not indexed."""
+        rows = self.player_rows(player_id)
+        rows = rows[self.df[self.season_col].to_numpy()[rows] == season_id]
+        if not len(rows) or np.isnan(self.neg_scores[rows[0]]):
+            return None
+        return self.rank_of(-self.neg_scores[rows[0]], season_id if within_season else None)
+
+    def top(self, n=25, season_id=None, position=None):
+        """
+        Best n seasons overall, in one season, at one position, or both, as a dataframe with a rank column.
+
+        Every one of these is a slice of a precomputed order, so nothing gets sorted at query time.
+        """
+        if season_id is not None:
+            rows = self._season_rows(season_id)
+            if position is not None:
+                rows = rows[self.df[self.position_col].to_numpy()[rows] == position]
+        elif position is not None:
+            rows = self._position_rows(position)
+        else:
+            rows = self.order
+        return self._frame(rows[:n])
+
+    def top_where(self, mask, n=25):
+        """Best n seasons among the rows where mask is True, for filters the index doesn't keep an order for."""
+        rows = np.flatnonzero(mask)
+        if len(rows) > n:
+            rows = rows[np.argpartition(self.neg_scores[rows], n - 1)[:n]]
+        rows = rows[np.argsort(self.neg_scores[rows], kind='stable')]
+        return self._frame(rows)
+
+    def player_seasons(self, player_id=None, name=None):
+        """Every season for a player id, or for every player with an exact (case insensitive) name, with ranks."""
+        if player_id is None:
+            player_ids = self.name_index.get(str(name).lower(), [])
+        else:
+            player_ids = [player_id]
+        rows = [self.player_rows(player_id) for player_id in player_ids]
+        return self._frame(np.concatenate(rows) if rows else self.order[:0])
+
+    def _frame(self, rows):
+        df = self.df.iloc[rows].copy()
+        df['rank'] = self._ranks(self.neg_scores[rows])
+        return df
+
+    def save(self, directory):
+        """Write the frame and every order to a folder."""
+        settings = {
+            'score_col': self.score_col,
+            'id_col': self.id_col,
+            'season_col': self.season_col,
+            'position_col': self.position_col,
+            'name_col': self.name_col,
+            'seasons': self.seasons,
+            'positions': self.positions,
+        }
+        write_frame(self.df, os.path.join(directory, 'frame'), extra_meta={'ranking': settings})
+        np.savez(
+            os.path.join(directory, 'index.npz'),
+            order=self.order,
+            season_order=self.season_order,
+            season_starts=self.season_starts,
+            position_order=self.position_order,
+            position_starts=self.position_starts,
+            player_ids=self.player_ids,
+            player_order=self.player_order,
+            player_starts=self.player_starts,
+        )
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Read an index written by save. With mmap the frame's columns are only read from disk as they're used."""
+        meta = read_meta(os.path.join(directory, 'frame'))
+        settings = meta['ranking']
+        index = cls.__new__(cls)
+        index.df = read_frame(os.path.join(directory, 'frame'), mmap=mmap, meta=meta)
+        for name in ['score_col', 'id_col', 'season_col', 'position_col', 'name_col', 'seasons', 'positions']:
+            setattr(index, name, settings[name])
+        data = np.load(os.path.join(directory, 'index.npz'))
+        for name in data.files:
+            setattr(index, name, data[name])
+        index.neg_scores = -index.df[index.score_col].to_numpy(dtype=np.float64)
+        index.sorted_neg_scores = index.neg_scores[index.order]
+        index._index_keys()
+        return index
@@ -0,0 +1,183 @@
+"""
+On-disk cache for stats.nba.com endpoint payloads.
+
+Re-running nba_api_scraper.ipynb used to refetch every commonplayerinfo and playercareerstats payload, even for retired
+ players whose numbers can never change again, and that's most of the ~5,000 player ids. ResponseCache sits in front of
+ the endpoint calls and stores each raw JSON payload, keyed by endpoint and request parameters.
+
+- Every entry gets its own time to live. PlayerTTLPolicy keeps retired players forever and expires active players after
+  a short TTL, based on TO_YEAR / ROSTERSTATUS in df_player_info.
+- The cache is bounded in size. When it grows past max_bytes the least recently used entries are evicted.
+- offline=True never touches the network, so a full rebuild of the local dataset can run from the cache alone.
+
+Payloads are gzipped JSON files under payloads/, and a small sqlite index tracks expiry, size and last access.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# Marker for put() meaning "ask the TTL policy", since None already means "never expires"
+use_policy = object()
+
+
+class CacheMiss(KeyError):
+    """Raised in offline mode when a payload isn't in the cache."""
+
+
+def cache_key(endpoint, params):
+    params = json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True)
+    return hashlib.sha1('{}?{}'.format(endpoint.lower(), params).encode()).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, default_ttl=None, ttl_policy=None):
+        """
+        max_bytes: evict least recently used payloads once the cache is bigger than this
+        default_ttl: seconds an entry stays fresh when ttl_policy doesn't say otherwise. None means it never expires.
+        ttl_policy: optional callable (endpoint, params) -> ttl in seconds, or None for never
+        """
+        self.directory = directory
+        self.payload_dir = os.path.join(directory, 'payloads')
+        os.makedirs(self.payload_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttl_policy = ttl_policy
+        self.hits = 0
+        self.misses = 0
+        # The scrapers call us from a thread pool, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' key TEXT PRIMARY KEY, endpoint TEXT, params TEXT, size INTEGER,'
+            ' created REAL, expires REAL, last_access REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        self._db.commit()
+
+    def _path(self, key):
+        return os.path.join(self.payload_dir, key[:2], key + '.json.gz')
+
+    def ttl_for(self, endpoint, params):
+        if self.ttl_policy is not None:
+            return self.ttl_policy(endpoint, params)
+        return self.default_ttl
+
+    def get(self, endpoint, params, allow_stale=False):
+        """Cached payload for a request, or None if it's missing or expired."""
+        key = cache_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (not allow_stale and row[0] is not None and row[0] < now):
+                self.misses += 1
+                return None
+            try:
+                with gzip.open(self._path(key), 'rt') as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                # The file went missing or got cut short, so forget the entry and fetch it again
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self.hits += 1
+            return payload
+
+    def put(self, endpoint, params, payload, ttl=use_policy):
+        key = cache_key(endpoint, params)
+        if ttl is use_policy:
+            ttl = self.ttl_for(endpoint, params)
+        now = time.time()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, endpoint, json.dumps(params, sort_keys=True, default=str), os.path.getsize(path), now,
+                 None if ttl is None else now + ttl, now)
+            )
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+        self._db.commit()
+
+    def fetch(self, endpoint, params, request, offline=False):
+        """
+        Return the cached payload, or call request() to get it and store the result.
+
+        offline: never call request(). Expired entries are still served, and a missing entry raises CacheMiss.
+        """
+        payload = self.get(endpoint, params, allow_stale=offline)
+        if payload is not None:
+            return payload
+        if offline:
+            raise CacheMiss('{} {} is not in the cache'.format(endpoint, params))
+        payload = request()
+        self.put(endpoint, params, payload)
+        return payload
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'entries': entries, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self._db.close()
+
+
+class PlayerTTLPolicy:
+    """
+    TTLs based on whether a player is still active.
+
+    A player counts as retired when their ROSTERSTATUS is Inactive and their TO_YEAR is before the current season, so a
+     player who was only briefly off a roster keeps refreshing. Retired players' payloads never expire. Everyone else,
+     including players we don't know about yet, expires after active_ttl seconds.
+    """
+
+    def __init__(self, df_player_info, active_ttl=24 * 60 * 60, retired_ttl=None, current_year=None):
+        self.active_ttl = active_ttl
+        self.retired_ttl = retired_ttl
+        df = df_player_info.rename(columns=str.upper)
+        if current_year is None:
+            today = datetime.date.today()
+            # Seasons start in October, so before then the current season started last year
+            current_year = today.year if today.month >= 10 else today.year - 1
+        retired = df['ROSTERSTATUS'].astype(str).str.lower().eq('inactive')
+        if 'TO_YEAR' in df.columns:
+            retired &= df['TO_YEAR'].fillna(current_year) < current_year
+        id_col = 'PERSON_ID' if 'PERSON_ID' in df.columns else 'PLAYER_ID'
+        self.retired_ids = set(df.loc[retired, id_col].astype(int).tolist())
+
+    def __call__(self, endpoint, params):
+        player_id = params.get('PlayerID')
+        if player_id is not None and int(player_id) in self.retired_ids:
+            return self.retired_ttl
+        return self.active_ttl
@@ -0,0 +1,137 @@
+"""
+Fantasy scoring for projection tables, for any number of league setups at once.
+
+fantasy_pts in projected_fantasy_pts_final_2018_19.csv comes from one fixed points scheme, but leagues score things
+ differently, and category leagues don't use points at all. Every setup here is one row of a scoring matrix over the
+ stat columns, so scoring a projection table under every setup is a single matrix product:
+
+    values (players x leagues) = stats (players x stats) @ scoring matrix.T (stats x leagues)
+
+Points leagues multiply the raw per game stats. Category leagues multiply z-scores instead: each category is scored by
+ how many standard deviations a player is above the player pool, with turnovers counting against them and the
+ percentage categories measured by their impact (makes above what the pool's percentage would give on the same
+ attempts), the usual way to turn category leagues into one number.
+"""
+
+import numpy as np
+import pandas as pd
+
+from similarity import stats
+
+# Points league scoring used for the fantasy_pts column: one point per point, field goal / free throw made, rebound,
+# assist, steal and block, minus one per field goal / free throw attempted and turnover
+fantasy_scoring = {
+    'pts': 1, 'fgm': 1, 'fga': -1, 'ftm': 1, 'fta': -1, 'oreb': 1, 'dreb': 1, 'ast': 1, 'stl': 1, 'blk': 1, 'tov': -1,
+}
+
+# A few common points setups. 'reb' is shorthand for the same value on oreb and dreb.
+points_leagues = {
+    'standard': fantasy_scoring,
+    'espn_points': {'pts': 1, 'fg3m': 1, 'fga': -1, 'fgm': 2, 'fta': -1, 'ftm': 1, 'reb': 1, 'ast': 2, 'stl': 4,
+                    'blk': 4, 'tov': -2},
+    'yahoo_points': {'pts': 1, 'reb': 1.2, 'ast': 1.5, 'stl': 3, 'blk': 3, 'tov': -1},
+    'draftkings': {'pts': 1, 'fg3m': 0.5, 'reb': 1.25, 'ast': 1.5, 'stl': 2, 'blk': 2, 'tov': -0.5},
+}
+
+# Category leagues, as weights on the category z-scores below. tov is negated when the z-scores are built.
+category_leagues = {
+    '9cat': {'pts': 1, 'fg3m': 1, 'reb': 1, 'ast': 1, 'stl': 1, 'blk': 1, 'tov': 1, 'fg_pct': 1, 'ft_pct': 1},
+    '8cat': {'pts': 1, 'fg3m': 1, 'reb': 1, 'ast': 1, 'stl': 1, 'blk': 1, 'fg_pct': 1, 'ft_pct': 1},
+}
+
+# The columns category z-scores are available for: the 14 model stats plus total rebounds and the two percentages
+categories = stats + ['reb', 'fg_pct', 'ft_pct']
+
+stat_aliases = {'reb': ['oreb', 'dreb']}
+
+
+def scoring_matrix(configs, cols=None, aliases=None):
+    """
+    Turn scoring setups into a (n_configs, len(cols)) weight matrix.
+
+    configs: {name: {stat: weight}} or a dataframe with one row per setup and one column per stat. Stats a setup
+     doesn't mention get weight 0, and aliases (like reb -> oreb + dreb) are spread over the stats they stand for.
+    Returns (names, matrix).
+    """
+    cols = list(cols or stats)
+    aliases = stat_aliases if aliases is None else aliases
+    if isinstance(configs, pd.DataFrame):
+        if set(configs.columns) <= set(cols):
+            # Already one column per stat, so the matrix is the frame itself
+            return configs.index.tolist(), configs.reindex(columns=cols).fillna(0).to_numpy(dtype=np.float64)
+        configs = {name: row.dropna().to_dict() for name, row in configs.iterrows()}
+    positions = {col: j for j, col in enumerate(cols)}
+    names = list(configs)
+    matrix = np.zeros((len(names), len(cols)))
+    for i, name in enumerate(names):
+        for stat, weight in configs[name].items():
+            targets = [stat] if stat in positions else aliases.get(stat, [stat])
+            for target in targets:
+                if target not in positions:
+                    raise ValueError('Unknown stat {} in scoring setup {}. Choose from {}'.format(stat, name, cols))
+                matrix[i, positions[target]] += weight
+    return names, matrix
+
+
+def fantasy_points(df, scoring=None, prefix=''):
+    """Fantasy points for every row of df under one setup. prefix picks the columns, e.g. 'proj_' for proj_pts, ..."""
+    _, matrix = scoring_matrix({'scoring': scoring or fantasy_scoring})
+    # Only the scored columns, so a missing value in a stat the setup ignores doesn't make the total NaN
+    scored = np.flatnonzero(matrix[0])
+    return df[[prefix + stats[j] for j in scored]].to_numpy(dtype=np.float64) @ matrix[0, scored]
+
+
+def points_values(df, configs=None, prefix=''):
+    """Value of every row under every points setup, as a dataframe with one column per setup."""
+    names, matrix = scoring_matrix(points_leagues if configs is None else configs)
+    values = df[[prefix + col for col in stats]].to_numpy(dtype=np.float64) @ matrix.T
+    return pd.DataFrame(values, columns=names, index=df.index)
+
+
+def category_zscores(df, prefix='', pool=None):
+    """
+    z-score of every category for every row, as a (n_rows, len(categories)) array.
+
+    pool: optional boolean mask (or number of rows from the top of df) for the players the means and standard
+     deviations come from, e.g. the players who'd actually be drafted. Defaults to every row.
+    fg_pct / ft_pct are scored by impact: makes minus attempts times the pool's percentage, so a great percentage on
+     few attempts counts for less than a good one on many. Turnovers are negated so higher is always better.
+    """
+    values = df[[prefix + col for col in stats]].to_numpy(dtype=np.float64)
+    col = {name: j for j, name in enumerate(stats)}
+    if pool is None:
+        pool = np.ones(len(df), dtype=bool)
+    elif np.isscalar(pool):
+        pool = np.arange(len(df)) < pool
+    pooled = values[pool]
+
+    def impact(made, attempted):
+        rate = np.nansum(pooled[:, col[made]]) / np.nansum(pooled[:, col[attempted]])
+        return values[:, col[made]] - values[:, col[attempted]] * rate
+
+    features = np.column_stack([
+        values,
+        values[:, col['oreb']] + values[:, col['dreb']],
+        impact('fgm', 'fga'),
+        impact('ftm', 'fta'),
+    ])
+    features[:, col['tov']] *= -1
+    mean = np.nanmean(features[pool], axis=0)
+    std = np.nanstd(features[pool], axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(std > 0, (features - mean) / std, 0.0)
+
+
+def category_values(df, configs=None, prefix='', pool=None):
+    """Summed category z-scores for every row under every category setup, one column per setup."""
+    names, matrix = scoring_matrix(category_leagues if configs is None else configs, cols=categories, aliases={})
+    values = category_zscores(df, prefix=prefix, pool=pool) @ matrix.T
+    return pd.DataFrame(values, columns=names, index=df.index)
+
+
+def score_leagues(df, points_configs=None, category_configs=None, prefix='', pool=None):
+    """Points values and category values side by side, one column per league setup."""
+    return pd.concat([
+        points_values(df, points_configs, prefix=prefix),
+        category_values(df, category_configs, prefix=prefix, pool=pool),
+    ], axis=1)
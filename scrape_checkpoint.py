@@ -0,0 +1,110 @@
+"""
+Checkpoints for long running scrapes.
+
+Scraping career stats for every player in players.get_players() takes hours, and the notebook used to keep every result in
+ memory until the very end. A ScrapeCheckpoint saves each player's result to disk the moment it arrives and appends a line
+ to a manifest saying whether that player finished or failed. When a scrape is restarted, the players already marked
+ done are skipped, so a rerun only pays for the work that's missing.
+
+Layout of a checkpoint directory:
+    manifest.jsonl      one {"player_id": ..., "status": "done" | "failed", ...} line per attempt, newest line wins
+    results/<id>.pkl    the dataframe returned for each finished player, pickled so dtypes survive the round trip
+"""
+
+import json
+import os
+import time
+
+import pandas as pd
+
+
+class ScrapeCheckpoint:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.results_dir = os.path.join(directory, 'results')
+        self.manifest_path = os.path.join(directory, 'manifest.jsonl')
+        os.makedirs(self.results_dir, exist_ok=True)
+        self.status = {}
+        self.errors = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line can be cut short if the kernel died mid-write, so just ignore it
+                    continue
+                player_id = entry['player_id']
+                self.status[player_id] = entry['status']
+                if entry['status'] == 'failed':
+                    self.errors[player_id] = entry.get('error')
+                else:
+                    self.errors.pop(player_id, None)
+
+    def _append(self, entry):
+        entry['time'] = time.time()
+        with open(self.manifest_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def result_path(self, player_id):
+        return os.path.join(self.results_dir, '{}.pkl'.format(player_id))
+
+    @property
+    def done_ids(self):
+        return [player_id for player_id, status in self.status.items() if status == 'done']
+
+    @property
+    def failed_ids(self):
+        return [player_id for player_id, status in self.status.items() if status == 'failed']
+
+    def pending(self, player_ids, retry_failed=True):
+        """The player ids that still need to be scraped."""
+        skip = {'done'} if retry_failed else {'done', 'failed'}
+        return [player_id for player_id in player_ids if self.status.get(int(player_id)) not in skip]
+
+    def record_done(self, player_id, df):
+        """Save one player's result, then mark them done. The result is written before the manifest line so a crash in
+        between only means the player gets scraped again."""
+        player_id = int(player_id)
+        path = self.result_path(player_id)
+        tmp = path + '.tmp'
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+        self._append({'player_id': player_id, 'status': 'done', 'rows': len(df)})
+        self.status[player_id] = 'done'
+        self.errors.pop(player_id, None)
+
+    def record_failed(self, player_id, error):
+        player_id = int(player_id)
+        self._append({'player_id': player_id, 'status': 'failed', 'error': str(error)})
+        self.status[player_id] = 'failed'
+        self.errors[player_id] = str(error)
+
+    def _finished(self, player_ids):
+        if player_ids is None:
+            return self.done_ids
+        return [player_id for player_id in player_ids if self.status.get(int(player_id)) == 'done']
+
+    def load_results(self, player_ids=None):
+        """Combine every finished player's result into one dataframe."""
+        frames = [pd.read_pickle(self.result_path(player_id)) for player_id in self._finished(player_ids)]
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def write_results(self, sink, player_ids=None):
+        """Stream every finished player's result into a ShardedFrameSink without loading them all at once."""
+        for player_id in self._finished(player_ids):
+            sink.append(pd.read_pickle(self.result_path(player_id)))
+        sink.flush()
+
+    def summary(self):
+        return {'done': len(self.done_ids), 'failed': len(self.failed_ids)}
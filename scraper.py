@@ -0,0 +1,198 @@
+"""
+nba_api scraping functions used by nba_api_scraper.ipynb.
+
+get_player_info pulls CommonPlayerInfo for a list of players and get_player_career_stats pulls PlayerCareerStats. Both fan
+ the requests out over a thread pool. Passing a checkpoint_dir to get_player_career_stats turns on the resumable mode: every
+ player's result is written to disk as it arrives, and a rerun with the same folder skips the players that already
+ finished (see scrape_checkpoint.py).
+
+Both functions also take a sink (a ShardedFrameSink from frame_sink.py). With a sink, results are written to sharded
+ columnar files as they complete instead of being collected in a list, so memory stays flat no matter how many players
+ we scrape, and the function returns a ShardedDataset rather than one big dataframe.
+
+Passing a cache (a ResponseCache from response_cache.py) keeps every raw payload on disk, so a rerun only calls the API for
+ payloads that are missing or expired, and offline=True rebuilds everything from the cache without any network calls.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from nba_api.stats.endpoints import commonplayerinfo
+from nba_api.stats.endpoints import playercareerstats
+
+from instrumentation import count, instrumented
+from scrape_checkpoint import ScrapeCheckpoint
+
+# Load in header parameters to keep dataframe running
+headers = {
+    'Connection': 'keep-alive',
+    'Accept': 'application/json, text/plain, */*',
+    'x-nba-stats-token': 'true',
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/79.0.3945.130 Safari/537.36',
+    'x-nba-stats-origin': 'stats',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-Mode': 'cors',
+    'Referer': 'https://stats.nba.com/',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+
+# The nba_api endpoint classes we scrape, and the default request parameters they send
+endpoint_classes = {
+    'commonplayerinfo': commonplayerinfo.CommonPlayerInfo,
+    'playercareerstats': playercareerstats.PlayerCareerStats,
+}
+endpoint_params = {
+    'commonplayerinfo': {'LeagueID': ''},
+    'playercareerstats': {'PerMode': 'Totals', 'LeagueID': ''},
+}
+
+# Which result set each endpoint's dataframe comes from
+endpoint_result_sets = {
+    'commonplayerinfo': 'CommonPlayerInfo',
+    'playercareerstats': 'SeasonTotalsRegularSeason',
+}
+
+
+def player_params(endpoint, player_id):
+    return dict(endpoint_params.get(endpoint, {}), PlayerID=player_id)
+
+
+def frames_from_payload(payload):
+    """Turn a stats.nba.com JSON payload into {result set name: dataframe}."""
+    result_sets = payload.get('resultSets', payload.get('resultSet', []))
+    if isinstance(result_sets, dict):
+        result_sets = [result_sets]
+    return {
+        result_set['name']: pd.DataFrame(result_set['rowSet'], columns=result_set['headers'])
+        for result_set in result_sets
+    }
+
+
+@instrumented(rows=len)
+def fetch_player_frame(endpoint, nba_player_id, headers, timeout=100, cache=None, offline=False):
+    """
+    Fetch one player's dataframe from an endpoint.
+
+    cache: optional ResponseCache (response_cache.py). Cached payloads are used instead of calling the API, and new ones
+     are stored. With offline=True a payload missing from the cache raises CacheMiss instead of calling the API.
+    """
+    def request():
+        return endpoint_classes[endpoint](player_id=nba_player_id, headers=headers, timeout=timeout).get_dict()
+
+    if cache is not None:
+        payload = cache.fetch(endpoint, player_params(endpoint, nba_player_id), request, offline=offline)
+    else:
+        payload = request()
+    return frames_from_payload(payload)[endpoint_result_sets[endpoint]]
+
+
+def fetch_player_info(nba_player_id, headers, timeout=100, cache=None, offline=False):
+    return fetch_player_frame('commonplayerinfo', nba_player_id, headers, timeout, cache, offline)
+
+
+def fetch_career_stats(nba_player_id, headers, timeout=100, cache=None, offline=False):
+    return fetch_player_frame('playercareerstats', nba_player_id, headers, timeout, cache, offline)
+
+
+# Create function that gets player info data for a list of player IDs
+def get_player_info(player_ids, headers, max_workers=10, sink=None, cache=None, offline=False):
+    def fetch_data(nba_player_id):
+        try:
+            return fetch_player_info(nba_player_id, headers, cache=cache, offline=offline)
+        except Exception as e:
+            print(f"Error fetching data for player ID {nba_player_id}: {e}")
+            count('scraper.failed_players')
+            return None
+
+    player_info = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_data, nba_player_id) for nba_player_id in player_ids]
+        for future in as_completed(futures):
+            player = future.result()
+            if player is not None and sink is not None:
+                sink.append(player)
+            elif player is not None:
+                player_info.append(player)
+
+    if sink is not None:
+        return sink.dataset()
+    df_player_info = pd.concat(player_info, ignore_index=True)
+    return df_player_info
+
+
+# Create a function to get player career stats with headers
+def get_player_career_stats(player_ids, headers, max_workers=5, retries=3, delay=10, checkpoint_dir=None,
+                            retry_failed=True, fetch=fetch_career_stats, sink=None, cache=None, offline=False):
+    """
+    Pull career stats for every player id.
+
+    checkpoint_dir: folder for the resumable mode. Each player's result is saved there as soon as it arrives, and players
+     that already finished in an earlier run are skipped. Players that failed before are tried again unless
+     retry_failed is False.
+    sink: ShardedFrameSink to stream results into. In checkpoint mode the finished players are copied from the checkpoint
+     into the sink one at a time at the end.
+    cache / offline: passed through to fetch, see fetch_player_frame
+    """
+    def fetch_data(nba_player_id):
+        attempt = 0
+        last_error = None
+        while attempt < retries:
+            try:
+                return fetch(nba_player_id, headers, cache=cache, offline=offline), None
+            except Exception as e:
+                print(f"Error fetching career stats for player ID {nba_player_id} on attempt {attempt + 1}: {e}")
+                last_error = e
+                attempt += 1
+                count('scraper.failed_attempts')
+                time.sleep(delay)
+        count('scraper.failed_players')
+        return None, last_error
+
+    checkpoint = None
+    all_player_ids = list(player_ids)
+    if checkpoint_dir is not None:
+        checkpoint = ScrapeCheckpoint(checkpoint_dir)
+        remaining = checkpoint.pending(all_player_ids, retry_failed=retry_failed)
+        print(f"{len(all_player_ids) - len(remaining)} players already scraped, {len(remaining)} to go")
+        player_ids = remaining
+
+    player_career_stats = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_data, nba_player_id): nba_player_id for nba_player_id in player_ids}
+        for future in as_completed(futures):
+            nba_player_id = futures[future]
+            player, error = future.result()
+            if checkpoint is not None:
+                # Results go straight to disk instead of piling up in memory
+                if player is not None:
+                    checkpoint.record_done(nba_player_id, player)
+                else:
+                    checkpoint.record_failed(nba_player_id, error)
+                continue
+            if player is None:
+                print(f"No data returned for player ID {nba_player_id}")
+            elif sink is not None:
+                sink.append(player)
+            else:
+                player_career_stats.append(player)
+
+    if checkpoint is not None:
+        summary = checkpoint.summary()
+        print(f"Checkpoint has {summary['done']} players done and {summary['failed']} failed")
+        if sink is not None:
+            checkpoint.write_results(sink, all_player_ids)
+            return sink.dataset()
+        return checkpoint.load_results(all_player_ids)
+
+    if sink is not None:
+        return sink.dataset()
+
+    if player_career_stats:
+        df_player_career_stats = pd.concat(player_career_stats, ignore_index=True)
+        return df_player_career_stats
+    else:
+        print("No data to concatenate")
+        return pd.DataFrame()  # Return an empty DataFrame if no data is available
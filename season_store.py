@@ -0,0 +1,107 @@
+"""
+Keyed store of player seasons for the player comparison model.
+
+fantasy_model.py used to find a season by scanning the whole dataframe with itertuples (find_player), and built each
+ player's stat vector by evaluating the same two column boolean mask once per stat. The store below gives every
+ (player_id, season_id) pair an integer key, so finding a season is a dictionary lookup, and precomputes a link from
+ every row to the same player's next season, so projecting from a batch of neighbors is just an array gather.
+"""
+
+import numpy as np
+
+from similarity import norm_cols
+
+
+class SeasonStore:
+    """
+    Compact (player_id, season_id) -> row store over a normalized season dataframe.
+
+    Seasons are numbered in sorted order ('1996-97' < '1997-98' < ...), and a season's "next season" is the next one in
+     that list, the same way fantasy_model.py walked seasons_list. next_rows[row] is the row holding the same player's
+     next season, or -1 when there is no row for the player in that next season.
+    """
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.seasons = sorted(self.df['season_id'].astype(str).unique().tolist())
+        self.season_codes = {season: code for code, season in enumerate(self.seasons)}
+        self.n_seasons = len(self.seasons)
+
+        self.player_ids = self.df['player_id'].to_numpy(dtype=np.int64)
+        self.season_index = np.searchsorted(self.seasons, self.df['season_id'].astype(str).to_numpy())
+        self.keys = self.player_ids * self.n_seasons + self.season_index
+
+        # Build the lookup backwards so the first row wins if a season shows up more than once
+        self.rows_by_key = dict(zip(self.keys[::-1].tolist(), range(len(self.keys) - 1, -1, -1)))
+        self._order = np.argsort(self.keys, kind='stable')
+        self._sorted_keys = self.keys[self._order]
+
+        # The next season key is key + 1, unless the season is already the last one we have
+        next_keys = np.where(self.season_index + 1 < self.n_seasons, self.keys + 1, -1)
+        self.next_rows = self.lookup_keys(next_keys)
+
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def key(self, player_id, season_id):
+        code = self.season_codes.get(str(season_id))
+        if code is None:
+            return -1
+        return int(player_id) * self.n_seasons + code
+
+    def lookup_keys(self, keys):
+        """Vectorized key -> row lookup. Unknown keys give -1."""
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self._sorted_keys):
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+        found = (self._sorted_keys[pos] == keys) & (keys >= 0)
+        return np.where(found, self._order[pos], -1)
+
+    def row(self, player_id, season_id):
+        """Row number of one season, or -1 when it isn't in the store."""
+        return self.rows_by_key.get(self.key(player_id, season_id), -1)
+
+    def rows(self, player_ids, season_ids):
+        """Row numbers for arrays of player ids and season ids."""
+        codes = np.array([self.season_codes.get(str(season), -1) for season in season_ids])
+        keys = np.where(codes >= 0, np.asarray(player_ids, dtype=np.int64) * self.n_seasons + codes, -1)
+        return self.lookup_keys(keys)
+
+    def next_season_id(self, season_id):
+        code = self.season_codes.get(str(season_id))
+        if code is None or code + 1 >= self.n_seasons:
+            return None
+        return self.seasons[code + 1]
+
+    def values(self, cols):
+        """The given columns as a float matrix, cached so repeated gathers don't copy the dataframe again."""
+        cols = list(cols)
+        key = tuple(cols)
+        if key not in self._columns:
+            self._columns[key] = np.ascontiguousarray(self.df[cols].to_numpy(dtype=np.float64))
+        return self._columns[key]
+
+    def gather(self, rows, cols):
+        """Stat values for an array of rows (any shape). Rows of -1 come back as NaN."""
+        rows = np.asarray(rows)
+        values = self.values(cols)
+        out = values[np.where(rows >= 0, rows, 0)]
+        out[rows < 0] = np.nan
+        return out
+
+    def vector(self, player_id, season_id, cols=None):
+        """The normalized stat vector for one season, or None when the season isn't in the store."""
+        row = self.row(player_id, season_id)
+        if row < 0:
+            return None
+        return self.values(cols or norm_cols)[row]
+
+    def season(self, player_id, season_id):
+        """The full row for one season as a pandas Series, or None."""
+        row = self.row(player_id, season_id)
+        if row < 0:
+            return None
+        return self.df.iloc[row]
@@ -0,0 +1,35 @@
+"""Small player season frames shared by the test modules."""
+
+import numpy as np
+import pandas as pd
+
+from similarity import norm_cols, stats
+
+
+def repeated_seasons():
+    """Eight players whose stats are the same every season, so every season has an exact match a season earlier."""
+    rng = np.random.default_rng(1)
+    values = rng.uniform(1, 20, (8, len(stats)))
+    frames = []
+    for season_id in ['2014-15', '2015-16', '2016-17', '2017-18']:
+        df = pd.DataFrame(values, columns=stats)
+        df.insert(0, 'season_id', season_id)
+        df.insert(0, 'player_id', np.arange(1, 9))
+        df['gp'] = 60.0
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def season_frame():
+    """Four players over two seasons, with player 1's first season listed twice like the player_info merge leaves it."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for player_id in range(1, 5):
+        for season_id in ['2016-17', '2017-18']:
+            values = rng.uniform(1, 20, len(stats))
+            rows.append(dict(player_id=player_id, season_id=season_id, **dict(zip(stats, values))))
+    df = pd.DataFrame(rows)
+    df = pd.concat([df, df.iloc[[0]]], ignore_index=True)
+    for col, norm_col in zip(stats, norm_cols):
+        df[norm_col] = df[col] / df[col].max()
+    return df
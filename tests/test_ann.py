@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from ann import IVFPQIndex, recall_at_k
+from similarity import SimilarityEngine
+
+
+def clustered(n, seed=0):
+    # Seasons gathered around a few dozen centers, which is what the cells are meant to find
+    rng = np.random.default_rng(seed)
+    centers = np.random.default_rng(99).normal(size=(40, 14))
+    return centers[rng.integers(0, 40, n)] + rng.normal(scale=0.1, size=(n, 14))
+
+
+def test_rerank_finds_most_of_the_exact_neighbors():
+    matrix = clustered(3000)
+    index = IVFPQIndex(matrix, keep_vectors=True, nprobe=8, rerank=10)
+    rows = np.arange(0, 3000, 50)
+    exact, _ = SimilarityEngine(matrix=matrix).top_k_rows(rows, k=10)
+    approx, _ = index.top_k_rows(rows, k=10)
+    assert recall_at_k(exact, approx) > 0.9
+
+
+def test_added_rows_can_be_reranked_and_saved(tmp_path):
+    matrix = clustered(3000)
+    new = clustered(200, seed=1)
+    index = IVFPQIndex(matrix, keep_vectors=True, nprobe=8, rerank=10)
+    index.add(new)
+    assert len(index) == len(index.vectors) == 3200
+
+    everything = np.vstack([matrix, new])
+    engine = SimilarityEngine(matrix=everything)
+    rows = np.arange(3000, 3200, 10)
+    exact, _ = engine.top_k_rows(rows, k=10)
+    approx, approx_dist = index.top_k_rows(rows, k=10)
+    assert recall_at_k(exact, approx) > 0.9
+    # Reranked distances are exact ones, read from the vectors add appended
+    np.testing.assert_allclose(approx_dist[:, 0], np.abs(everything[rows] - everything[approx[:, 0]]).mean(axis=1))
+    idx_direct, _ = index.top_k(new[:5], k=10)
+    assert (idx_direct[:, 0] == np.arange(3000, 3005)).all()
+
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+    loaded = IVFPQIndex.load(path, vectors=index.vectors)
+    for got, expected in zip(loaded.top_k_rows(rows, k=10), (approx, approx_dist)):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_memory_mapped_vectors_need_replacing_on_add(tmp_path):
+    matrix = clustered(2000)
+    path = str(tmp_path / 'vectors.npy')
+    np.save(path, matrix)
+    index = IVFPQIndex(matrix, vectors=np.load(path, mmap_mode='r'), rerank=10)
+    new = clustered(100, seed=2)
+    with pytest.raises(ValueError):
+        index.add(new)
+    np.save(path, np.vstack([matrix, new]))
+    index.add(new, vectors=np.load(path, mmap_mode='r'))
+    rows, _ = index.top_k_rows([2050], k=5)
+    assert rows[0, 0] >= 0
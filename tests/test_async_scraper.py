@@ -0,0 +1,195 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+import async_scraper
+from async_scraper import AdaptiveLimiter, AsyncScraper, TokenBucket, TransientError, backoff_delay
+
+payload = {'resultSets': [{'name': 'SeasonTotalsRegularSeason', 'headers': ['PLAYER_ID'], 'rowSet': [[1]]}]}
+
+
+class StandIn:
+    """
+    Local stand-in for stats.nba.com. replies is a list of (status, delay) played back in order, one per request, and
+     the last one repeats. It records when every request arrived and the most requests it had in flight at once.
+    status can also be 'cut', a 200 whose body stops short of its Content-Length, or 'garbled', a 200 with half a JSON
+     document for a body.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.arrivals = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        status, delay = self.replies[min(len(self.arrivals), len(self.replies) - 1)]
+        self.arrivals.append(time.monotonic())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        if status == 'cut':
+            body = json.dumps(payload).encode()
+            response = web.StreamResponse()
+            response.content_length = len(body)
+            await response.prepare(request)
+            await response.write(body[:len(body) // 2])
+            # Drop the connection with the rest of the body still owed
+            request.transport.close()
+            return response
+        if status == 'garbled':
+            return web.Response(text=json.dumps(payload)[:20], content_type='application/json')
+        if status != 200:
+            return web.Response(status=status)
+        return web.json_response(payload)
+
+
+async def with_server(stand_in, test, **scraper_kwargs):
+    app = web.Application()
+    app.router.add_get('/{endpoint}', stand_in.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        kwargs = dict(base_url='http://127.0.0.1:{}'.format(port), rate=1000.0, backoff_base=0.001, backoff_cap=0.01)
+        kwargs.update(scraper_kwargs)
+        async with AsyncScraper(**kwargs) as scraper:
+            return await test(scraper)
+    finally:
+        await runner.cleanup()
+
+
+def test_retries_throttles_and_server_errors():
+    stand_in = StandIn([(429, 0), (503, 0), (500, 0), (200, 0)])
+
+    async def test(scraper):
+        return await scraper.fetch('playercareerstats', {'PlayerID': 1})
+
+    assert asyncio.run(with_server(stand_in, test, retries=5)) == payload
+    assert len(stand_in.arrivals) == 4
+
+
+def test_gives_up_after_retries():
+    stand_in = StandIn([(503, 0)])
+
+    async def test(scraper):
+        with pytest.raises(TransientError):
+            await scraper.fetch('playercareerstats', {'PlayerID': 1})
+
+    asyncio.run(with_server(stand_in, test, retries=3))
+    assert len(stand_in.arrivals) == 3
+
+
+@pytest.mark.parametrize('status', ['cut', 'garbled'])
+def test_cut_off_bodies_are_retried(status):
+    stand_in = StandIn([(status, 0), (200, 0)])
+
+    async def test(scraper):
+        failures = []
+        record = scraper.limiter.record
+        scraper.limiter.record = lambda latency, ok: failures.append(not ok) or record(latency, ok)
+        return await scraper.fetch('playercareerstats', {'PlayerID': 1}), failures
+
+    result, failures = asyncio.run(with_server(stand_in, test, retries=3))
+    assert result == payload
+    assert failures == [True, False]
+    assert len(stand_in.arrivals) == 2
+
+
+def test_backoff_is_full_jitter_and_capped():
+    for attempt in range(12):
+        bound = min(8.0, 0.5 * 2 ** attempt)
+        delays = [backoff_delay(attempt, base=0.5, cap=8.0) for _ in range(200)]
+        assert all(0 <= delay <= bound for delay in delays)
+        # Full jitter spreads the waits over the whole range rather than clustering at the bound
+        assert min(delays) < bound / 4 and max(delays) > 3 * bound / 4
+
+
+def test_retry_waits_stay_under_the_cap(monkeypatch):
+    waits = []
+
+    def recording_delay(attempt, base, cap):
+        waits.append((attempt, backoff_delay(attempt, base, cap)))
+        return waits[-1][1]
+
+    monkeypatch.setattr(async_scraper, 'backoff_delay', recording_delay)
+    stand_in = StandIn([(503, 0)] * 6 + [(200, 0)])
+
+    async def test(scraper):
+        return await scraper.fetch('playercareerstats', {'PlayerID': 1})
+
+    asyncio.run(with_server(stand_in, test, retries=8, backoff_base=0.01, backoff_cap=0.04))
+    assert [attempt for attempt, _ in waits] == list(range(6))
+    assert all(0 <= wait <= min(0.04, 0.01 * 2 ** attempt) for attempt, wait in waits)
+
+
+def test_concurrency_limit_backs_off_and_recovers():
+    stand_in = StandIn([(503, 0)] * 3 + [(200, 0.01)])
+
+    async def test(scraper):
+        limiter = scraper.limiter
+        start = limiter.limit
+        for player_id in range(3):
+            with pytest.raises(TransientError):
+                await scraper._request('playercareerstats', {'PlayerID': player_id})
+        lowest = limiter.limit
+        await asyncio.gather(*(scraper.fetch('playercareerstats', {'PlayerID': i}) for i in range(60)))
+        return start, lowest, limiter.limit
+
+    start, lowest, recovered = asyncio.run(with_server(stand_in, test, initial_concurrency=8, cooldown=0))
+    assert lowest == 1
+    assert lowest < start
+    assert recovered > 4
+    assert stand_in.max_in_flight <= int(recovered)
+
+
+def test_slow_replies_cut_the_limit():
+    stand_in = StandIn([(200, 0.2)])
+
+    async def test(scraper):
+        await asyncio.gather(*(scraper.fetch('playercareerstats', {'PlayerID': i}) for i in range(4)))
+        return scraper.limiter.limit
+
+    assert asyncio.run(with_server(stand_in, test, initial_concurrency=8, slow_latency=0.05, cooldown=0)) < 8
+
+
+def test_in_flight_requests_never_exceed_the_limit():
+    stand_in = StandIn([(200, 0.05)])
+
+    async def test(scraper):
+        await asyncio.gather(*(scraper.fetch('playercareerstats', {'PlayerID': i}) for i in range(12)))
+
+    asyncio.run(with_server(stand_in, test, initial_concurrency=3, max_concurrency=3))
+    assert stand_in.max_in_flight == 3
+
+
+def test_token_bucket_caps_the_rate():
+    stand_in = StandIn([(200, 0)])
+
+    async def test(scraper):
+        await asyncio.gather(*(scraper.fetch('playercareerstats', {'PlayerID': i}) for i in range(30)))
+        return scraper.bucket.rate
+
+    rate = asyncio.run(with_server(stand_in, test, rate=20.0))
+    # The bucket starts full with 20 tokens, so the other 10 requests have to wait for refills at 20 per second
+    assert stand_in.arrivals[-1] - stand_in.arrivals[0] >= 10 / 20 * 0.9
+    # Successes never push the rate past the starting rate when max_rate isn't given
+    assert rate == 20.0
+
+
+def test_max_rate_lets_the_rate_rise():
+    async def test():
+        limiter = AdaptiveLimiter(TokenBucket(10.0), max_rate=20.0)
+        for _ in range(100):
+            limiter.record(0.01, ok=True)
+        return limiter.bucket.rate
+
+    assert asyncio.run(test()) == 20.0
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from backtest import Backtest
+from frames import repeated_seasons
+
+
+@pytest.mark.parametrize('weighting', ['inverse', 'inverse_square'])
+def test_exact_matches_score_finite(weighting):
+    backtest = Backtest(repeated_seasons(), k_max=3, workers=1)
+    summary, _ = backtest.run(k=3, weighting=weighting)
+    errors = summary[['mae', 'rmse', 'bias']].to_numpy()
+    assert np.isfinite(errors).all()
+    # Each player's exact match is their own earlier season, whose next season is the one we score against
+    np.testing.assert_allclose(errors, 0, atol=1e-9)
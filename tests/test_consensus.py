@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from consensus import Consensus, PlayerKeys, fantasypros_columns, model_columns
+from name_search import NameIndex
+
+
+@pytest.fixture
+def keys():
+    index = NameIndex()
+    for name, player_id in [('Nikola Jokić', 203999), ('J.J. Redick', 200755), ('Tony Mitchell', 203183),
+                            ('Tony Mitchell', 203502)]:
+        index.add(name, player_id)
+    return PlayerKeys(index)
+
+
+def model_source():
+    return pd.DataFrame({
+        'player_id': [203999, 200755, 203999],
+        'player_name': ['Nikola Jokić', None, 'Nikola Jokić'],
+        'proj_pts': [20.0, 16.0, 99.0],
+        'proj_oreb': [3.0, 0.0, 0.0],
+        'proj_dreb': [8.0, 2.0, 0.0],
+        'proj_fgm': [8.0, 6.0, 0.0],
+        'proj_fga': [16.0, 13.0, 1.0],
+    })
+
+
+def fantasypros_source():
+    return pd.DataFrame({
+        'Player': ['Nikola Jokic', 'JJ Redick', 'Tony Mitchell', 'Tony Mitchell', 'Some Rookie', None],
+        'Team': ['DEN', 'PHI', 'DET', 'MIL', 'NYK', None],
+        'PTS': [18.0, 17.0, 5.0, 3.0, 9.0, 1234.0],
+        'REB': [10.0, 3.0, 4.0, 2.0, 2.0, 1234.0],
+        'FG%': [0.5, 0.45, 0.4, 0.35, 0.3, 1.0],
+    })
+
+
+def test_name_only_rows_merge_onto_id_keys(keys):
+    consensus = Consensus(keys)
+    consensus.add_source('model', model_source(), id_col='player_id', name_col='player_name', columns=model_columns)
+    consensus.add_source('fantasypros', fantasypros_source(), name_col='Player', team_col='Team',
+                         columns=fantasypros_columns, weight=3.0)
+
+    frame = keys.frame()
+    # Jokić and Redick resolve onto the model's id keys, with the accent and the dots folded away. Redick's model row
+    # had no name, so it comes from the sheet
+    assert frame.loc[keys.by_id[203999], 'player_name'] == 'Nikola Jokić'
+    assert frame.loc[keys.by_id[200755], ['player_name', 'team']].tolist() == ['JJ Redick', 'PHI']
+    # Two different Tony Mitchells can't be told apart by name, so each gets a key of their own by team, without an id
+    mitchells = frame[frame['player_name'] == 'Tony Mitchell']
+    assert sorted(mitchells['team']) == ['DET', 'MIL'] and (mitchells['player_id'] == -1).all()
+    assert (frame['player_name'] == 'Some Rookie').sum() == 1 and len(frame) == 5
+
+    df = consensus.consensus().set_index('player_name')
+    # The model's duplicate Jokić row is ignored, and the sheet counts three times as much
+    assert df.loc['Nikola Jokić', 'pts'] == pytest.approx((20 + 3 * 18) / 4)
+    assert df.loc['Nikola Jokić', 'reb'] == pytest.approx((11 + 3 * 10) / 4)
+    assert df.loc['Nikola Jokić', 'fg_pct'] == pytest.approx((0.5 + 3 * 0.5) / 4)
+    assert df.loc['Nikola Jokić', 'sources'] == 2 and df.loc['Some Rookie', 'sources'] == 1
+    assert np.isnan(df.loc['Some Rookie', 'stl'])
+
+    both = consensus.consensus(weights={'fantasypros': 1.0}, min_sources=2).set_index('player_name')
+    assert sorted(both.index) == ['JJ Redick', 'Nikola Jokić']
+    assert both.loc['JJ Redick', 'pts'] == pytest.approx(16.5)
+
+
+def test_source_needs_a_key_column(keys):
+    with pytest.raises(ValueError):
+        Consensus(keys).add_source('bad', pd.DataFrame({'PTS': [1.0]}))
@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+import csv_cache
+from csv_cache import cache_path, read_csv_cached
+
+
+@pytest.mark.parametrize('index_col', [None, 0, 'season_id', ['player_id', 'season_id']])
+def test_cached_reads_match_the_first_read(tmp_path, index_col):
+    path = tmp_path / 'seasons.csv'
+    pd.DataFrame({
+        'player_id': [1, 1, 2],
+        'season_id': ['2016-17', '2017-18', '2017-18'],
+        'pts': [10.5, 12.0, 8.25],
+    }).to_csv(path, index=False)
+
+    expected = pd.read_csv(path, index_col=index_col)
+    first = read_csv_cached(str(path), index_col=index_col)
+    cached = read_csv_cached(str(path), index_col=index_col)
+    pd.testing.assert_frame_equal(first, expected)
+    pd.testing.assert_frame_equal(cached, expected)
+
+
+def test_functions_and_readers_skip_the_cache(tmp_path):
+    path = tmp_path / 'seasons.csv'
+    pd.DataFrame({'player_id': [1, 2], 'pts': [10.5, 8.25]}).to_csv(path, index=False)
+
+    # A function's repr holds its address, so a cache keyed on it would never be hit again
+    with pytest.warns(UserWarning):
+        df = read_csv_cached(str(path), converters={'pts': lambda value: float(value) * 2})
+    assert df['pts'].tolist() == [21.0, 16.5]
+    with pytest.warns(UserWarning):
+        chunks = list(read_csv_cached(str(path), chunksize=1))
+    assert [len(chunk) for chunk in chunks] == [1, 1]
+    assert not (tmp_path / '.csv_cache').exists()
+
+    with pytest.raises(ValueError):
+        cache_path(str(path), {'iterator': True})
+    assert cache_path(str(path), {'chunksize': None}) == cache_path(str(path), {'chunksize': None})
+
+
+def test_unwritable_cache_warns(tmp_path, monkeypatch):
+    path = tmp_path / 'seasons.csv'
+    pd.DataFrame({'player_id': [1, 2]}).to_csv(path, index=False)
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('read-only checkout')
+
+    monkeypatch.setattr(csv_cache, 'write_frame', read_only)
+    with pytest.warns(UserWarning, match='read-only checkout'):
+        df = read_csv_cached(str(path))
+    assert df['player_id'].tolist() == [1, 2]
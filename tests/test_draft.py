@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from draft import DraftBoard, mock_drafts, snake_order
+
+
+def draft_pool(n=80, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = rng.choice(['PG', 'SG', 'SF', 'PF', 'C', 'PG/SG', 'SF/PF', 'PF/C'], size=n)
+    return pd.DataFrame({
+        'player_name': ['Player {}'.format(i) for i in range(n)],
+        'player_id': np.arange(1000, 1000 + n),
+        'fantasy_pts': rng.uniform(10, 50, n).round(1),
+        'espn_position': positions,
+    })
+
+
+def replacement_by_sorting(board):
+    """Replacement levels worked out from scratch: the (open slots + 1)th best available player at each position."""
+    levels = []
+    for code, demand in enumerate(board.demand().tolist()):
+        values = sorted((board.values[row] for row in range(len(board.df))
+                         if board.available[row] and code in board.eligible[row]), reverse=True)
+        levels.append(values[demand] if demand < len(values) else 0.0)
+    return np.array(levels)
+
+
+def test_snake_order():
+    assert snake_order(3, 3).tolist() == [0, 1, 2, 2, 1, 0, 0, 1, 2]
+
+
+def test_vor_stays_right_after_every_pick_and_undo():
+    board = DraftBoard(draft_pool(), teams=4, rounds=6)
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        # Mostly the best available player, sometimes a reach further down the board
+        best = board.best_available(n=8)
+        board.pick(best[0]['row'] if rng.random() < 0.6 else best[-1]['row'])
+        levels = board.replacement_levels()
+        np.testing.assert_allclose(levels, replacement_by_sorting(board))
+        rows = np.flatnonzero(board.available)
+        padded = np.append(levels, np.inf)
+        expected = [board.values[row] - min(padded[code] for code in board.eligible[row]) for row in rows]
+        np.testing.assert_allclose(board.vor(rows), expected)
+        top = board.best_available(n=5)
+        assert [entry['vor'] for entry in top] == pytest.approx(sorted(expected, reverse=True)[:5])
+
+    for _ in range(7):
+        board.undo()
+    assert board.pick_number == 13 and len(board) == 80 - 13
+    np.testing.assert_allclose(board.replacement_levels(), replacement_by_sorting(board))
+    assert board.best_available(n=1)[0]['row'] in np.flatnonzero(board.available)
+
+
+def test_picks_by_name_and_id():
+    df = draft_pool(10)
+    df.loc[3, 'player_name'] = 'Nikola Jokić'
+    board = DraftBoard(df, teams=2, rounds=2)
+    assert board.pick('nikola jokic') == 3
+    assert board.pick(1005) == 5
+    with pytest.raises(ValueError):
+        board.pick('Nikola Jokic')
+    assert board.pick('Some Rookie', skip_unknown=True) is None
+    assert board.team_on_clock() == 0
+    assert board.roster(0) == ['Nikola Jokić'] and board.roster(1) == ['Player 5']
+
+
+def test_mock_drafts_fill_every_roster():
+    board = DraftBoard(draft_pool(), teams=4, rounds=6)
+    board.pick(board.best_available(n=1)[0]['row'])
+    result = mock_drafts(board, n_drafts=200, noise=1.0, seed=0)
+    assert len(result) == 80
+    # Every remaining pick of every draft takes someone, and nobody already picked comes up again
+    np.testing.assert_allclose(result['drafted'].sum(), 4 * 6 - 1)
+    assert result['drafted'].max() <= 1
+    picked = board.history[0][0]
+    assert result.loc[picked, 'drafted'] == 0 and np.isnan(result.loc[picked, 'adp'])
+    teams = result[['team_{}'.format(team) for team in range(4)]].sum(axis=0)
+    # Team 0 already made its first pick on the real board
+    np.testing.assert_allclose(teams, [5, 6, 6, 6])
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from frame_sink import ShardedDataset, ShardedFrameSink
+
+
+def player_frame(player_id, n=4, extra=False):
+    df = pd.DataFrame({'PLAYER_ID': [player_id] * n, 'SEASON_ID': ['2016-17'] * n, 'PTS': range(n)})
+    if extra:
+        df['AST'] = 1.5
+    return df
+
+
+def test_shards_roll_over_at_the_row_limit(tmp_path):
+    frames = [player_frame(player_id) for player_id in range(1, 8)]
+    sink = ShardedFrameSink(str(tmp_path / 'sink'), rows_per_shard=10)
+    for df in frames:
+        sink.append(df)
+        # The buffer goes to disk as soon as it holds a shard's worth of rows
+        assert sink.buffered_rows < 10
+    sink.append(pd.DataFrame())
+    dataset = sink.dataset()
+
+    # 28 rows: two full shards of 12 (rolled over on the append that reached 10) and the 4 left at the end
+    assert [meta['n_rows'] for meta in dataset.metas] == [12, 12, 4]
+    assert len(dataset) == sink.rows_written == 28
+    pd.testing.assert_frame_equal(dataset.read(), pd.concat(frames, ignore_index=True))
+    assert [len(df) for df in dataset.iter_frames(columns=['PTS'])] == [12, 12, 4]
+
+
+def test_resumed_sink_appends_after_existing_shards(tmp_path):
+    directory = str(tmp_path / 'sink')
+    with ShardedFrameSink(directory, rows_per_shard=4) as sink:
+        sink.append(player_frame(1))
+    # A later run adds a column the first shards don't have
+    with ShardedFrameSink(directory, rows_per_shard=4) as sink:
+        sink.append(player_frame(2, extra=True))
+
+    dataset = ShardedDataset(directory)
+    assert len(dataset.shards) == 2 and dataset.columns == ['PLAYER_ID', 'SEASON_ID', 'PTS', 'AST']
+    df = dataset.read()
+    assert df['PLAYER_ID'].tolist() == [1] * 4 + [2] * 4
+    assert df['AST'].isna().sum() == 4
+
+    path = tmp_path / 'all.csv'
+    dataset.to_csv(path)
+    pd.testing.assert_frame_equal(pd.read_csv(path), df)
+
+    # overwrite starts the folder from scratch
+    with ShardedFrameSink(directory, overwrite=True) as sink:
+        pass
+    assert len(ShardedDataset(directory)) == 0 and ShardedDataset(directory).read().empty
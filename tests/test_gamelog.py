@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from gamelog import GameLogAggregator, season_id_from_game_log
+
+
+def test_only_regular_season_ids_convert():
+    converted = season_id_from_game_log(['22017', '42017', '12017', '52020', '2016-17'])
+    assert converted.tolist() == ['2017-18', None, None, None, '2016-17']
+
+
+def test_playoff_games_stay_out_of_the_regular_season():
+    games = pd.DataFrame({
+        'PLAYER_ID': [1, 1, 1],
+        'SEASON_ID': ['22017', '22017', '42017'],
+        'GAME_ID': [21700001, 21700002, 41700001],
+        'GAME_DATE': ['2017-10-20', '2017-10-22', '2018-04-15'],
+        'PTS': [10, 20, 40],
+    })
+    aggregator = GameLogAggregator()
+    assert aggregator.ingest(games) == 2
+    df = aggregator.frame('season')
+    assert df['season_id'].tolist() == ['2017-18']
+    assert df['gp'].tolist() == [2]
+    np.testing.assert_allclose(df['pts'], [15])
+
+
+class ListSink:
+    def __init__(self):
+        self.frames = []
+
+    def append(self, df):
+        self.frames.append(df)
+
+
+def game_logs(n_players=4, games_per_season=30, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for season in ['22016', '22017']:
+        dates = pd.date_range('{}-10-20'.format(season[1:]), periods=games_per_season, freq='2D')
+        for game, date in enumerate(dates):
+            for player_id in range(1, n_players + 1):
+                rows.append({
+                    'PLAYER_ID': player_id, 'PLAYER_NAME': 'Player {}'.format(player_id), 'SEASON_ID': season,
+                    'GAME_ID': int(season) * 1000 + game, 'GAME_DATE': date.strftime('%Y-%m-%d'),
+                    'PTS': rng.integers(0, 40), 'AST': rng.integers(0, 12), 'MIN': rng.uniform(10, 40),
+                })
+    return pd.DataFrame(rows)
+
+
+def test_rolling_windows_match_pandas_across_chunks_and_restarts(tmp_path):
+    games = game_logs()
+    sink = ListSink()
+    aggregator = GameLogAggregator(tmp_path / 'state', windows=(3, 5), sink=sink)
+    # Chunks split mid season, overlap each other by 20 rows, and the state goes through save/open halfway
+    bounds = [(0, 70), (50, 130), (110, 200), (180, len(games))]
+    for i, (start, stop) in enumerate(bounds):
+        aggregator.ingest(games.iloc[start:stop])
+        if i == 1:
+            aggregator.save()
+            aggregator = GameLogAggregator.open(tmp_path / 'state', windows=(3, 5), sink=sink)
+    assert aggregator.games_ingested == len(games)
+
+    got = pd.concat(sink.frames, ignore_index=True)
+    assert not got.duplicated(['player_id', 'game_id', 'window']).any()
+    expected = games.sort_values(['PLAYER_ID', 'GAME_ID']).reset_index(drop=True)
+    by_season = expected.groupby(['PLAYER_ID', 'SEASON_ID'])
+    for window in [3, 5]:
+        rows = got[got['window'] == 'last_{}'.format(window)].sort_values(['player_id', 'game_id'])
+        for col in ['PTS', 'AST', 'MIN']:
+            rolling = by_season[col].rolling(window, min_periods=1).mean().reset_index(drop=True)
+            # The saved history is float32, hence the rtol
+            np.testing.assert_allclose(rows[col.lower()].to_numpy(), rolling.to_numpy(), rtol=1e-5)
+
+    # frame() gives the same numbers for every player's latest games
+    last = aggregator.frame('last_5').set_index('player_id')
+    tail = expected[expected['SEASON_ID'] == '22017'].groupby('PLAYER_ID')['PTS'].apply(lambda pts: pts.tail(5).mean())
+    np.testing.assert_allclose(last.loc[tail.index, 'pts'], tail, rtol=1e-5)
+    season = aggregator.frame('season').set_index(['player_id', 'season_id'])['pts']
+    means = by_season['PTS'].mean().rename(index={'22016': '2016-17', '22017': '2017-18'})
+    np.testing.assert_allclose(season.loc[means.index], means)
+
+
+def test_missing_names_never_replace_known_ones():
+    games = game_logs(n_players=2, games_per_season=4)
+    aggregator = GameLogAggregator()
+    aggregator.ingest(games.iloc[:4])
+
+    # A later chunk with some names missing, and a player who never had one
+    later = games.iloc[4:8].copy()
+    later['PLAYER_NAME'] = [None, 'Player 2', None, None]
+    later = pd.concat([later, later.iloc[[0]].assign(PLAYER_ID=3, PLAYER_NAME=None)], ignore_index=True)
+    aggregator.ingest(later)
+    names = aggregator.frame('last_5').set_index('player_id')['player_name']
+    assert names.loc[1] == 'Player 1' and names.loc[2] == 'Player 2'
+    assert names.loc[3] is None
+
+    # Without the column at all
+    aggregator.ingest(games.iloc[8:].drop(columns='PLAYER_NAME'))
+    names = aggregator.frame('season').set_index('player_id')['player_name']
+    assert (names.loc[1] == 'Player 1').all() and (names.loc[2] == 'Player 2').all()
+    assert names.loc[3] is None
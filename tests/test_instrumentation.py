@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+import instrumentation
+from instrumentation import count, instrumented, recorder, stage
+
+
+@pytest.fixture
+def recording():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield recorder
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_disabled_records_nothing():
+    instrumentation.reset()
+
+    @instrumented()
+    def work():
+        return [1, 2, 3]
+
+    assert work() == [1, 2, 3]
+    count('retries')
+    assert instrumentation.report()['stages'] == {} and instrumentation.report()['counters'] == {}
+
+
+def test_decorator_records_calls_rows_and_errors(recording):
+    @instrumented(name='load', rows=len)
+    def load(n):
+        if n < 0:
+            raise ValueError(n)
+        return list(range(n))
+
+    @instrumented(rows=len)
+    async def fetch(n):
+        await asyncio.sleep(0)
+        return list(range(n))
+
+    load(10)
+    load(5)
+    with pytest.raises(ValueError):
+        load(-1)
+    assert asyncio.run(fetch(4)) == [0, 1, 2, 3]
+    count('retries')
+    count('retries', 2)
+
+    stages = instrumentation.report()['stages']
+    assert stages['load']['calls'] == 3 and stages['load']['errors'] == 1 and stages['load']['rows'] == 15
+    assert stages['load']['max_seconds'] <= stages['load']['seconds']
+    # Stages are named module.function unless given a name
+    fetch_stage = stages['{}.{}'.format(__name__, 'test_decorator_records_calls_rows_and_errors.<locals>.fetch')]
+    assert fetch_stage['calls'] == 1 and fetch_stage['rows'] == 4
+    assert instrumentation.report()['counters'] == {'retries': 3}
+
+
+def test_report_format(recording, tmp_path):
+    with stage('merge') as s:
+        s.rows = 100
+    with stage('empty'):
+        pass
+    data = instrumentation.write_report(tmp_path / 'run.json')
+    with open(tmp_path / 'run.json') as f:
+        assert json.load(f) == json.loads(json.dumps(data))
+    assert set(data) == {'started', 'wall_seconds', 'pid', 'argv', 'memory_tracked', 'stages', 'counters'}
+    merge = data['stages']['merge']
+    assert set(merge) == {'calls', 'seconds', 'max_seconds', 'rows', 'errors', 'peak_mb', 'rows_per_second'}
+    assert merge['rows'] == 100 and merge['peak_mb'] is None and merge['rows_per_second'] > 0
+    assert data['stages']['empty']['rows_per_second'] is None
+
+
+def test_overlapping_async_stages_keep_their_own_peaks():
+    instrumentation.reset()
+    instrumentation.enable(memory=True)
+
+    async def run():
+        allocated, b_started, a_done = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+        async def a():
+            with stage('a'):
+                buffer = bytearray(20 * 1024 ** 2)
+                del buffer
+                allocated.set()
+                # b starts (resetting the peak) while a is still running, and a finishes first
+                await b_started.wait()
+            a_done.set()
+
+        async def b():
+            await allocated.wait()
+            with stage('b'):
+                b_started.set()
+                await a_done.wait()
+
+        await asyncio.gather(a(), b())
+
+    try:
+        asyncio.run(run())
+        stages = instrumentation.report()['stages']
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+    assert stages['a']['peak_mb'] > 15
+    assert stages['b']['peak_mb'] < 5
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from loaders import apply_schema, career_stats_schema, load_career_stats, season_start_year
+
+
+def test_only_whole_numbers_become_integers():
+    df = pd.DataFrame({
+        'GP': [82.0, 70.0, 3.0],
+        'PTS': [25.4, 18.0, 2.5],
+        'AST': [np.nan, 4.0, 1.0],
+        'FGM': [40000, 1, 2],
+    })
+    df = apply_schema(df, career_stats_schema)
+    assert df['GP'].dtype == np.int16 and df['GP'].tolist() == [82, 70, 3]
+    # Per game averages keep their fractions instead of being cut down to int16
+    assert df['PTS'].dtype == np.float32
+    np.testing.assert_allclose(df['PTS'], [25.4, 18.0, 2.5], rtol=1e-6)
+    assert df['AST'].dtype == np.float32 and np.isnan(df['AST'][0])
+    assert df['FGM'].dtype == np.int64 and df['FGM'][0] == 40000
+
+
+def test_career_stats_load_typed(tmp_path):
+    path = tmp_path / 'career.csv'
+    pd.DataFrame({
+        'PLAYER_ID': [1, 1, 2],
+        'SEASON_ID': ['2016-17', '2017-18', None],
+        'LEAGUE_ID': ['00', '00', '00'],
+        'GP': [82, 70, 3],
+        'PTS': [2000, 1500, 10],
+    }).to_csv(path, index=False)
+    df = load_career_stats(str(path))
+    assert df['PLAYER_ID'].dtype == np.int32 and df['PTS'].dtype == np.int16
+    assert df['LEAGUE_ID'].tolist() == ['00'] * 3
+    assert df['SEASON_START'].tolist() == [2016, 2017, -1]
+    np.testing.assert_array_equal(season_start_year(pd.Series(['1996-97', '1996-97'])), [1996, 1996])
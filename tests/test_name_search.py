@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from name_search import NameIndex, fold_name, levenshtein
+
+
+@pytest.fixture
+def index():
+    index = NameIndex()
+    index.add_frame(pd.DataFrame({
+        'player_name': ['Nikola Jokić', 'J.J. Redick', 'Larry Nance Jr.', 'Larry Nance', 'Giannis Antetokounmpo',
+                        'Anthony Davis', 'Anthony Edwards', None],
+        'player_id': [203999, 200755, 1626204, 77674, 203507, 203076, 1630162, 1],
+    }), 'player_name', 'player_id')
+    return index
+
+
+def test_folding():
+    assert fold_name('Jokić, Nikola') == 'nikola jokic'
+    assert fold_name("D'Angelo  Russell") == 'dangelo russell'
+    assert fold_name('J.J. Redick') == fold_name('JJ Redick')
+
+
+def test_levenshtein_matches_the_textbook_table():
+    rng = np.random.default_rng(0)
+    words = [''.join(rng.choice(list('abcde'), size=rng.integers(0, 9))) for _ in range(60)]
+    for a, b in zip(words[::2], words[1::2]):
+        table = np.arange(len(b) + 1)
+        for i, char in enumerate(a):
+            previous, table = table, np.empty_like(table)
+            table[0] = i + 1
+            for j in range(len(b)):
+                table[j + 1] = min(previous[j + 1] + 1, table[j] + 1, previous[j] + (char != b[j]))
+        assert levenshtein(a, b) == table[-1]
+        assert levenshtein(a, b, max_distance=2) == min(table[-1], 3)
+
+
+def test_accents_punctuation_and_typos_resolve(index):
+    assert index.resolve('Nikola Jokic') == 203999
+    assert index.resolve('Jokic, Nikola') == 203999
+    assert index.resolve('JJ Redick') == 200755
+    # One letter dropped and one swapped
+    assert index.resolve('Giannis Antetokounpo') == 203507
+    assert index.resolve('Nikloa Jokic') == 203999
+    assert index.resolve('Zzzz Qqqq') is None
+    np.testing.assert_array_equal(index.resolve_many(['JJ Redick', 'Nobody At All', 'JJ Redick']),
+                                  [200755, np.nan, 200755])
+
+
+def test_suffixes_and_prefixes(index):
+    # 'Larry Nance' is both the father's name and the son's name without Jr., so it can't be resolved
+    assert index.resolve('Larry Nance') is None
+    assert index.resolve('Larry Nance Jr') == 1626204
+    results = index.search('anth')
+    assert {result['player_id'] for result in results} == {203076, 1630162}
+    assert all(result['match'] == 'prefix' for result in results)
+    assert index.search('antetok')[0]['name'] == 'Giannis Antetokounmpo'
+    fuzzy = index.search('Antony Davis')[0]
+    assert fuzzy['player_id'] == 203076 and fuzzy['match'] == 'fuzzy' and fuzzy['distance'] == 1
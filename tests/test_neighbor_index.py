@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from neighbor_index import KDTreeIndex
+from similarity import SimilarityEngine, block_distances
+
+
+def random_seasons(n=3000, seed=0):
+    matrix = np.random.default_rng(seed).normal(size=(n, 14))
+    # A few seasons with a missing stat, which neither engine should ever return
+    matrix[::97, 3] = np.nan
+    return matrix
+
+
+@pytest.mark.parametrize('metric', ['mean_abs', 'euclidean'])
+def test_tree_matches_brute_force(metric):
+    matrix = random_seasons()
+    brute = SimilarityEngine(matrix=matrix, metric=metric, tree_threshold=None)
+    tree = SimilarityEngine(matrix=matrix, metric=metric, tree_threshold=1000)
+    assert tree.uses_tree() and not brute.uses_tree()
+
+    rows = np.arange(0, len(matrix), 37)
+    candidates = np.random.default_rng(1).random(len(matrix)) < 0.5
+    for kwargs in [{}, {'candidates': candidates}, {'exclude_self': False}]:
+        brute_idx, brute_dist = brute.top_k_rows(rows, k=10, **kwargs)
+        tree_idx, tree_dist = tree.top_k_rows(rows, k=10, **kwargs)
+        # The euclidean expansion leaves a season about 1e-8 away from itself instead of 0, hence the atol
+        np.testing.assert_allclose(tree_dist, brute_dist, atol=1e-6)
+        # Ties can come back in either order, so check the rows through their distances instead of by id
+        found = tree_idx >= 0
+        assert (found == (brute_idx >= 0)).all()
+        recomputed = np.take_along_axis(block_distances(matrix[rows], matrix, metric), np.maximum(tree_idx, 0), axis=1)
+        np.testing.assert_allclose(recomputed[found], tree_dist[found], atol=1e-6)
+        if 'candidates' in kwargs:
+            assert candidates[tree_idx[found]].all()
+
+
+def test_save_and_load_use_the_same_path(tmp_path):
+    matrix = random_seasons(500)
+    index = KDTreeIndex(matrix, leaf_size=16)
+    index.insert(random_seasons(40, seed=2))
+    path = tmp_path / 'seasons_index'
+    index.save(path)
+    loaded = KDTreeIndex.load(path)
+    rows = np.arange(0, len(index), 11)
+    for got, expected in zip(loaded.top_k_rows(rows, k=5), index.top_k_rows(rows, k=5)):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_engine_inserts_reach_the_tree():
+    matrix = random_seasons()
+    new = random_seasons(300, seed=3)
+    engine = SimilarityEngine(matrix=matrix)
+    assert engine.uses_tree()
+    engine.top_k_rows([0])
+    tree = engine.tree()
+
+    rows = engine.insert(new)
+    assert rows.tolist() == list(range(3000, 3300))
+    assert engine.tree() is tree and len(tree) == len(engine) == 3300
+    np.testing.assert_array_equal(engine.matrix, np.vstack([matrix, new]))
+
+    brute = SimilarityEngine(matrix=np.vstack([matrix, new]), tree_threshold=None)
+    queries = np.arange(2900, 3300, 7)
+    np.testing.assert_allclose(engine.top_k_rows(queries)[1], brute.top_k_rows(queries)[1])
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from normalization import RunningGroupStats, normalize, normalize_appended
+
+
+def seasons(season_ids, rows_per_season=30, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'season_id': np.repeat(season_ids, rows_per_season),
+        'pts': rng.uniform(0, 30, len(season_ids) * rows_per_season),
+        'ast': rng.uniform(0, 10, len(season_ids) * rows_per_season),
+    })
+
+
+@pytest.mark.parametrize('method', ['minmax', 'zscore'])
+def test_appended_rows_match_a_full_normalize(method):
+    df = seasons(['2015-16', '2016-17'])
+    running = RunningGroupStats.fit(df, ['pts', 'ast'], by='season_id')
+    df, _ = normalize(df, ['pts', 'ast'], by='season_id', method=method)
+
+    # A whole new season leaves every earlier row alone
+    new_season = seasons(['2017-18'], seed=1)
+    appended, rescaled, _, affected = normalize_appended(df, new_season, running, method=method)
+    assert rescaled.empty
+    assert affected['season_id'].tolist() == ['2017-18']
+    df = pd.concat([df, appended], ignore_index=True)
+
+    # More games for an existing season rescale that season's earlier rows, which come back instead of landing in df
+    more = seasons(['2016-17'], rows_per_season=5, seed=2)
+    before = df.copy()
+    appended, rescaled, _, affected = normalize_appended(df, more, running, method=method)
+    pd.testing.assert_frame_equal(df, before)
+    assert affected['season_id'].tolist() == ['2016-17']
+    assert (df.loc[rescaled.index, 'season_id'] == '2016-17').all() and len(rescaled) == 30
+    df.update(rescaled)
+    df = pd.concat([df, appended], ignore_index=True)
+
+    expected, _ = normalize(df[['season_id', 'pts', 'ast']], ['pts', 'ast'], by='season_id', method=method)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_appending_to_a_frame_without_the_normalized_columns_is_rejected():
+    df = seasons(['2015-16'])
+    running = RunningGroupStats.fit(df, ['pts', 'ast'], by='season_id')
+    # df was never normalized, so there are no pts_norm/ast_norm columns to rescale
+    with pytest.raises(ValueError):
+        normalize_appended(df, seasons(['2015-16'], rows_per_season=5, seed=1), running)
+
+
+@pytest.mark.parametrize('by', ['season_id', ['season_id', 'position'], None])
+def test_normalize_matches_groupby_transform(by):
+    df = seasons(['2015-16', '2016-17', '2017-18']).sample(frac=1, random_state=0)
+    df['position'] = np.where(np.arange(len(df)) % 3 == 0, 'Guard', 'Forward')
+    df.loc[df.index[4], 'pts'] = np.nan
+    before = df.copy()
+
+    minmax, _ = normalize(df, ['pts', 'ast'], by=by)
+    zscore, stats = normalize(df, ['pts', 'ast'], by=by, method='zscore')
+    pd.testing.assert_frame_equal(df, before)
+    assert minmax.index.equals(df.index) and len(stats) == (1 if by is None else df.groupby(by).ngroups)
+
+    grouped = df.groupby(by) if by is not None else df.assign(_all=0).groupby('_all')
+    for col in ['pts', 'ast']:
+        low, high = grouped[col].transform('min'), grouped[col].transform('max')
+        np.testing.assert_allclose(minmax[col + '_norm'], (df[col] - low) / (high - low))
+        mean, std = grouped[col].transform('mean'), grouped[col].transform('std')
+        np.testing.assert_allclose(zscore[col + '_zscore'], (df[col] - mean) / std)
+    # A missing stat stays missing instead of pulling its group's statistics around
+    assert np.isnan(minmax.loc[df.index[4], 'pts_norm'])
+
+
+def test_stats_scale_new_rows_and_survive_save(tmp_path):
+    df = seasons(['2015-16', '2016-17'])
+    _, stats = normalize(df, ['pts'], by='season_id')
+    new = pd.DataFrame({'season_id': ['2016-17', '1999-00'], 'pts': [15.0, 15.0]})
+    scaled = stats.transform(new)
+    season = df[df['season_id'] == '2016-17']['pts']
+    assert scaled['pts_norm'][0] == pytest.approx((15 - season.min()) / (season.max() - season.min()))
+    # A season the statistics never saw can't be scaled
+    assert np.isnan(scaled['pts_norm'][1])
+
+    running = RunningGroupStats.fit(df.iloc[:40], ['pts'], by='season_id')
+    running.update(df.iloc[40:])
+    running.save(tmp_path / 'running.npz')
+    loaded = RunningGroupStats.load(tmp_path / 'running.npz').group_stats()
+    for name in ['count', 'min', 'max', 'mean', 'std']:
+        np.testing.assert_allclose(getattr(loaded, name), getattr(stats, name))
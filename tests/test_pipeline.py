@@ -0,0 +1,41 @@
+import importlib
+import sys
+
+import pandas as pd
+
+from pipeline import Pipeline
+
+
+def test_helper_module_edits_and_versions_invalidate_the_cache(tmp_path, monkeypatch):
+    helper_path = tmp_path / 'pipeline_helper.py'
+    helper_path.write_text('def scale(values):\n    return values * 2\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    helper = importlib.import_module('pipeline_helper')
+
+    def build(version=None):
+        pipeline = Pipeline(str(tmp_path / 'cache'))
+
+        @pipeline.stage(modules=[helper], version=version)
+        def scaled():
+            return pd.DataFrame({'x': helper.scale(pd.Series([1, 2, 3]))})
+
+        return pipeline
+
+    try:
+        assert build().run('scaled')['x'].tolist() == [2, 4, 6]
+        pipeline = build()
+        pipeline.run('scaled')
+        assert pipeline.report()['source'].tolist() == ['disk']
+
+        # The stage's own code is unchanged, but the helper it calls isn't
+        helper_path.write_text('def scale(values):\n    return values * 10\n')
+        importlib.reload(helper)
+        pipeline = build()
+        assert pipeline.run('scaled')['x'].tolist() == [10, 20, 30]
+        assert pipeline.report()['source'].tolist() == ['computed']
+
+        pipeline = build(version=2)
+        pipeline.run('scaled')
+        assert pipeline.report()['source'].tolist() == ['computed']
+    finally:
+        sys.modules.pop('pipeline_helper', None)
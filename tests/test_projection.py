@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from frames import season_frame
+from projection import neighbor_weights, project_player, project_season, weighted_projection
+from season_store import SeasonStore
+from similarity import SimilarityEngine, norm_cols, stats
+
+
+@pytest.mark.parametrize('weighting', ['inverse', 'inverse_square'])
+def test_duplicated_season_projects_finite_values(weighting):
+    store = SeasonStore(season_frame())
+    engine = SimilarityEngine(store.df)
+    row = store.row(1, '2016-17')
+    neighbor_rows, neighbor_distances = engine.top_k_rows([row], k=3)
+    assert neighbor_distances[0, 0] == 0
+
+    projected = weighted_projection(store, neighbor_rows, neighbor_distances, weighting=weighting)
+    assert np.isfinite(projected).all()
+    # The duplicate's next season is the player's own 2017-18, and an exact match takes all of the weight
+    expected = store.gather([store.row(1, '2017-18')], stats)[0]
+    np.testing.assert_allclose(projected[0], expected)
+
+
+def test_exact_matches_share_weight_equally():
+    distances = np.array([[0.0, 0.0, 0.5], [0.1, 0.2, np.inf]])
+    weights = neighbor_weights(distances, 'inverse')
+    np.testing.assert_array_equal(weights[0], [1, 1, 0])
+    np.testing.assert_allclose(weights[1], [10, 5, 0])
+
+
+def test_unusable_exact_match_falls_back_to_inverse_distance():
+    distances = np.array([[0.0, 0.5, 0.25]])
+    weights = neighbor_weights(distances, 'inverse_square', usable=np.array([[False, True, True]]))
+    np.testing.assert_allclose(weights[0, 1:], [4, 16])
+
+
+def test_unknown_max_season_is_rejected():
+    store = SeasonStore(season_frame())
+    engine = SimilarityEngine(store.df)
+    neighbor_rows, neighbor_distances = engine.top_k_rows([store.row(1, '2016-17')], k=3)
+    # A typo'd season used to count as no limit at all
+    with pytest.raises(ValueError):
+        weighted_projection(store, neighbor_rows, neighbor_distances, max_season='2017-81')
+    # Stopping at 2016-17 leaves no neighbor with a trusted next season
+    assert np.isnan(weighted_projection(store, neighbor_rows, neighbor_distances, max_season='2016-17')).all()
+
+
+def three_seasons(n_players=40, seed=3):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for player_id in range(1, n_players + 1):
+        for season_id in ['2015-16', '2016-17', '2017-18']:
+            values = rng.uniform(1, 20, len(stats))
+            rows.append(dict(player_id=player_id, player_name='Player {}'.format(player_id), season_id=season_id,
+                             **dict(zip(stats, values))))
+    df = pd.DataFrame(rows)
+    for col, norm_col in zip(stats, norm_cols):
+        df[norm_col] = df[col] / df[col].max()
+    return df
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_project_season_matches_one_player_at_a_time(workers, tmp_path):
+    store = SeasonStore(three_seasons())
+    engine = SimilarityEngine(store.df)
+    output = tmp_path / 'projected.csv'
+    df = project_season(store, engine, '2018-19', k=5, workers=workers, chunk_size=16, output=str(output))
+
+    assert (df['season_id'] == '2018-19').all()
+    assert list(df.columns[:3]) == ['player_name', 'player_id', 'season_id']
+    assert df['fantasy_pts'].is_monotonic_decreasing
+    projected = df.set_index('player_id')
+    for player_id in range(1, 41):
+        expected = project_player(store, engine, player_id, '2017-18', k=5, max_season='2017-18')
+        expected = [expected['proj_' + col] for col in stats]
+        # Players whose neighbors are all 2017-18 seasons have nothing to project from and are left out
+        if np.isnan(expected).all():
+            assert player_id not in projected.index
+        else:
+            np.testing.assert_allclose(projected.loc[player_id, stats].to_numpy(dtype=np.float64), expected)
+    pd.testing.assert_frame_equal(pd.read_csv(output), df.round(2), check_exact=False, atol=1e-9)
+
+    with pytest.raises(ValueError):
+        project_season(store, engine, '2015-16')
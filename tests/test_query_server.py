@@ -0,0 +1,81 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from frames import season_frame
+from query_server import LRUCache, QueryService, _plain, make_server
+from ranking import RankingIndex
+from season_store import SeasonStore
+from similarity import SimilarityEngine
+
+
+@pytest.fixture
+def service():
+    # Skip the CSV loading in __init__ and answer from the small test frame instead
+    service = QueryService.__new__(QueryService)
+    service.store = SeasonStore(season_frame().drop_duplicates(subset=['player_id', 'season_id']))
+    service.engine = SimilarityEngine(service.store.df)
+    service.ranking = RankingIndex(service.store.df.assign(combined_score=service.store.df['pts'], position='Guard'))
+    service.cache = LRUCache()
+    service.requests = 0
+    return service
+
+
+@pytest.fixture
+def get(service):
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def get(path):
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:{}/{}'.format(server.server_port, path)) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    yield get
+    server.shutdown()
+
+
+def test_plain_turns_nan_and_inf_into_null():
+    values = [np.nan, np.inf, -np.inf, np.float32(1.5), np.int64(2)]
+    assert [_plain(value) for value in values] == [None, None, None, 1.5, 2]
+
+
+def test_k_below_one_is_rejected(service):
+    with pytest.raises(ValueError):
+        service.similar(1, '2016-17', k=0)
+    with pytest.raises(ValueError):
+        service.project(1, '2016-17', k=-1)
+    assert len(service.similar(1, '2016-17', k=2)['neighbors']) == 2
+
+
+def test_unknown_season_is_rejected(service):
+    with pytest.raises(ValueError):
+        service.rank(score=10.0, season_id='1800-01')
+    assert service.rank(score=1000.0, season_id='2016-17')['season_rank'] == 1
+
+
+def test_status_codes(service, get, monkeypatch):
+    assert get('similar?player=1&season_id=2016-17&k=3')[0] == 200
+    status, body = get('nothing')
+    assert status == 404 and 'Unknown endpoint' in body['error']
+    assert get('similar?player=1&season_id=2016-17&k=0')[0] == 400
+
+    def broken(**params):
+        raise KeyError('player_id')
+
+    # A KeyError from inside an endpoint is a server error, not an unknown endpoint
+    monkeypatch.setattr(service, 'top', broken)
+    status, body = get('top?n=5')
+    assert status == 500 and 'KeyError' in body['error']
+
+
+def test_unknown_max_season_is_a_bad_request(get):
+    assert get('project?player=1&season_id=2016-17&max_season=2017-18')[0] == 200
+    status, body = get('project?player=1&season_id=2016-17&max_season=2071-18')
+    assert status == 400 and '2071-18' in body['error']
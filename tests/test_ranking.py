@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from ranking import RankingIndex
+
+
+def ranked_frame():
+    return pd.DataFrame({
+        'player_id': [1, 2, 3, 4, 5],
+        'season_id': ['2016-17', '2016-17', '2017-18', '2017-18', '2017-18'],
+        'position': ['Guard', 'Center', 'Guard', 'Forward', 'Guard'],
+        'combined_score': [3.0, np.nan, 5.0, 3.0, np.nan],
+    })
+
+
+def test_ranks_match_pandas_rank_with_unscored_rows():
+    df = ranked_frame()
+    expected = df['combined_score'].rank(ascending=False, method='min')
+    np.testing.assert_array_equal(RankingIndex(df).ranks(), expected.to_numpy())
+
+
+def test_unscored_seasons_have_no_rank():
+    index = RankingIndex(ranked_frame())
+    assert index.rank(2, '2016-17') is None
+    assert index.rank(1, '2016-17') == 2
+    assert index.rank(1, '2016-17', within_season=True) == 1
+    assert index.top(5)['rank'].isna().sum() == 2
@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+import response_cache
+from response_cache import CacheMiss, PlayerTTLPolicy, ResponseCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock)
+    return clock
+
+
+def payload(player_id, size=10):
+    return {'resultSets': [{'name': 'CommonPlayerInfo', 'headers': ['PERSON_ID'], 'rowSet': [[player_id]] * size}]}
+
+
+def test_entries_expire_after_their_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path), default_ttl=60)
+    cache.put('commonplayerinfo', {'PlayerID': 1}, payload(1))
+    cache.put('commonplayerinfo', {'PlayerID': 2}, payload(2), ttl=None)
+    clock.now += 59
+    assert cache.get('commonplayerinfo', {'PlayerID': 1}) == payload(1)
+
+    clock.now += 2
+    assert cache.get('commonplayerinfo', {'PlayerID': 1}) is None
+    # Offline runs still get the expired payload rather than nothing
+    assert cache.get('commonplayerinfo', {'PlayerID': 1}, allow_stale=True) == payload(1)
+    assert cache.get('commonplayerinfo', {'PlayerID': 2}) == payload(2)
+
+    calls = []
+    fresh = cache.fetch('commonplayerinfo', {'PlayerID': 1}, lambda: calls.append(1) or payload(1, size=3))
+    assert fresh == payload(1, size=3) and calls == [1]
+    with pytest.raises(CacheMiss):
+        cache.fetch('commonplayerinfo', {'PlayerID': 3}, lambda: calls.append(3), offline=True)
+    assert calls == [1]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path))
+    cache.put('commonplayerinfo', {'PlayerID': 1}, payload(1))
+    size = cache.stats()['bytes']
+    cache.close()
+
+    # Room for two payloads
+    cache = ResponseCache(str(tmp_path), max_bytes=int(size * 2.5))
+    clock.now += 1
+    cache.put('commonplayerinfo', {'PlayerID': 2}, payload(2))
+    clock.now += 1
+    # Reading player 1 makes player 2 the least recently used
+    assert cache.get('commonplayerinfo', {'PlayerID': 1}) is not None
+    clock.now += 1
+    cache.put('commonplayerinfo', {'PlayerID': 3}, payload(3))
+
+    assert cache.get('commonplayerinfo', {'PlayerID': 2}) is None
+    assert cache.get('commonplayerinfo', {'PlayerID': 1}) == payload(1)
+    assert cache.get('commonplayerinfo', {'PlayerID': 3}) == payload(3)
+    assert cache.stats()['entries'] == 2 and cache.stats()['bytes'] <= size * 2.5
+
+
+def test_retired_players_never_expire():
+    df_player_info = pd.DataFrame({
+        'PERSON_ID': [1, 2, 3],
+        'ROSTERSTATUS': ['Inactive', 'Inactive', 'Active'],
+        'TO_YEAR': [2001, 2018, 2018],
+    })
+    policy = PlayerTTLPolicy(df_player_info, active_ttl=3600, current_year=2018)
+    # Player 2 is off a roster this season but played in it, so they still refresh
+    assert [policy('playercareerstats', {'PlayerID': player_id}) for player_id in [1, 2, 3, 4]] == [
+        None, 3600, 3600, 3600
+    ]
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scoring import (categories, category_values, category_zscores, fantasy_points, points_leagues, points_values,
+                     scoring_matrix)
+from similarity import stats
+
+
+def projections(n=30, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.uniform(0.5, 10, (n, len(stats))), columns=['proj_' + col for col in stats])
+    df['proj_fga'] = df['proj_fgm'] * 2.2
+    df['proj_fta'] = df['proj_ftm'] * 1.3
+    return df
+
+
+def by_hand(row, scoring):
+    total = 0.0
+    for stat, weight in scoring.items():
+        for col in (['oreb', 'dreb'] if stat == 'reb' else [stat]):
+            total += weight * row['proj_' + col]
+    return total
+
+
+def test_points_match_scoring_each_row_by_hand():
+    df = projections()
+    values = points_values(df, prefix='proj_')
+    assert list(values.columns) == list(points_leagues)
+    for name, scoring in points_leagues.items():
+        expected = [by_hand(row, scoring) for _, row in df.iterrows()]
+        np.testing.assert_allclose(values[name], expected)
+    np.testing.assert_allclose(fantasy_points(df, prefix='proj_'), values['standard'])
+
+    # A stat the setup doesn't score can be missing without making the total NaN
+    df['proj_fg3a'] = np.nan
+    assert np.isfinite(fantasy_points(df, prefix='proj_')).all()
+
+
+def test_setups_as_a_frame_and_unknown_stats():
+    frame = pd.DataFrame({'pts': [1.0, 2.0], 'ast': [1.5, None]}, index=['a', 'b'])
+    names, matrix = scoring_matrix(frame)
+    assert names == ['a', 'b']
+    assert matrix[0, stats.index('ast')] == 1.5 and matrix[1, stats.index('ast')] == 0
+    with pytest.raises(ValueError):
+        scoring_matrix({'bad': {'dunks': 2}})
+
+
+def test_category_zscores():
+    df = projections()
+    z = category_zscores(df, prefix='proj_')
+    assert z.shape == (len(df), len(categories))
+    np.testing.assert_allclose(z.mean(axis=0), 0, atol=1e-9)
+    np.testing.assert_allclose(z.std(axis=0), 1)
+    # More turnovers is worse
+    tov = df['proj_tov'].to_numpy()
+    assert z[tov.argmax(), categories.index('tov')] == z[:, categories.index('tov')].min()
+
+    # Shooting the pool's percentage on any volume has no impact, making extra shots on top of it does
+    pool_rate = df['proj_fgm'].sum() / df['proj_fga'].sum()
+    df.loc[0, 'proj_fgm'] = df.loc[0, 'proj_fga'] * pool_rate + 2
+    z = category_zscores(df, prefix='proj_')
+    assert z[0, categories.index('fg_pct')] == z[:, categories.index('fg_pct')].max()
+
+    # The z-scores come from the pool only, here the top ten rows
+    z_pool = category_zscores(df, prefix='proj_', pool=10)
+    np.testing.assert_allclose(z_pool[:10].mean(axis=0), 0, atol=1e-9)
+    values = category_values(df, prefix='proj_', pool=10)
+    np.testing.assert_allclose(values['9cat'] - values['8cat'], z_pool[:, categories.index('tov')])
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from scrape_checkpoint import ScrapeCheckpoint
+from scraper import get_player_career_stats
+
+
+class FakeFetch:
+    """Stands in for fetch_career_stats, failing for the player ids in broken and recording every call."""
+
+    def __init__(self, broken=()):
+        self.broken = set(broken)
+        self.calls = []
+
+    def __call__(self, player_id, headers, cache=None, offline=False):
+        self.calls.append(player_id)
+        if player_id in self.broken:
+            raise ConnectionError('dropped')
+        return pd.DataFrame({'PLAYER_ID': [player_id, player_id], 'SEASON_ID': ['2016-17', '2017-18'], 'PTS': [10, 20]})
+
+
+def scrape(directory, fetch, player_ids=range(1, 7), **kwargs):
+    return get_player_career_stats(list(player_ids), headers={}, max_workers=2, retries=1, delay=0,
+                                   checkpoint_dir=str(directory), fetch=fetch, **kwargs)
+
+
+def test_resume_only_scrapes_what_is_missing(tmp_path):
+    # The first run dies partway: players 4 to 6 fail
+    first = FakeFetch(broken={4, 5, 6})
+    df = scrape(tmp_path, first)
+    assert sorted(df['PLAYER_ID'].unique()) == [1, 2, 3]
+    assert ScrapeCheckpoint(str(tmp_path)).summary() == {'done': 3, 'failed': 3}
+
+    # Leaving failed players alone makes the rerun a no-op
+    idle = FakeFetch()
+    scrape(tmp_path, idle, retry_failed=False)
+    assert idle.calls == []
+
+    # The next run picks up the failed players and nothing else
+    second = FakeFetch()
+    df = scrape(tmp_path, second)
+    assert sorted(second.calls) == [4, 5, 6]
+    assert sorted(df['PLAYER_ID'].unique()) == [1, 2, 3, 4, 5, 6] and len(df) == 12
+    checkpoint = ScrapeCheckpoint(str(tmp_path))
+    assert checkpoint.summary() == {'done': 6, 'failed': 0} and checkpoint.errors == {}
+
+
+def test_cut_off_manifest_line_is_ignored(tmp_path):
+    checkpoint = ScrapeCheckpoint(str(tmp_path))
+    checkpoint.record_done(1, pd.DataFrame({'PLAYER_ID': [1]}))
+    checkpoint.record_failed(2, ConnectionError('dropped'))
+    # The kernel died halfway through writing player 3's line
+    with open(checkpoint.manifest_path, 'a') as f:
+        f.write('{"player_id": 3, "sta')
+
+    reloaded = ScrapeCheckpoint(str(tmp_path))
+    assert reloaded.done_ids == [1] and reloaded.errors == {2: 'dropped'}
+    assert reloaded.pending([1, 2, 3]) == [2, 3]
+    assert reloaded.pending([1, 2, 3], retry_failed=False) == [3]
+    pd.testing.assert_frame_equal(reloaded.load_results(), pd.DataFrame({'PLAYER_ID': [1]}))
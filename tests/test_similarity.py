@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from similarity import SimilarityEngine, block_distances, feature_matrix, norm_cols
+
+
+def test_distances_match_the_per_row_formula():
+    rng = np.random.default_rng(0)
+    queries, matrix = rng.random((3, 14)), rng.random((20, 14))
+    matrix[5, 2] = np.nan
+    mean_abs = block_distances(queries, matrix)
+    euclidean = block_distances(queries, matrix, 'euclidean')
+    for i in range(3):
+        for j in range(20):
+            if j == 5:
+                # A season with a missing stat can't be compared, so it's never close
+                assert mean_abs[i, j] == np.inf and euclidean[i, j] == np.inf
+                continue
+            # fantasy_model.py's average percent error
+            assert mean_abs[i, j] == pytest.approx(np.mean(np.abs(queries[i] - matrix[j])))
+            assert euclidean[i, j] == pytest.approx(np.linalg.norm(queries[i] - matrix[j]))
+    with pytest.raises(ValueError):
+        block_distances(queries, matrix, 'cosine')
+
+
+@pytest.mark.parametrize('metric', ['mean_abs', 'euclidean'])
+def test_blocked_top_k_matches_a_full_sort(metric):
+    rng = np.random.default_rng(1)
+    matrix = rng.random((500, 14))
+    # Blocks smaller than the data, so the running merge across blocks is what gets tested
+    engine = SimilarityEngine(matrix=matrix, metric=metric, query_block=7, row_block=64, tree_threshold=None)
+    rows = np.arange(0, 500, 9)
+    candidates = rng.random(500) < 0.6
+    idx, dist = engine.top_k_rows(rows, k=5, candidates=candidates)
+
+    full = block_distances(matrix[rows], matrix, metric)
+    full[np.arange(len(rows)), rows] = np.inf
+    full[:, ~candidates] = np.inf
+    np.testing.assert_allclose(dist, np.sort(full, axis=1)[:, :5], atol=1e-9)
+    np.testing.assert_allclose(np.take_along_axis(full, idx, axis=1), dist, atol=1e-9)
+    assert (idx != rows[:, None]).all() and candidates[idx].all()
+
+
+def test_fewer_rows_than_k_leave_empty_slots():
+    engine = SimilarityEngine(matrix=np.array([[0.0, 0.0], [1.0, 1.0], [np.nan, 0.0]]), tree_threshold=None)
+    idx, dist = engine.top_k_rows([0], k=5)
+    assert idx.tolist() == [[1, -1, -1]]
+    assert dist[0, 0] == 1.0 and np.isinf(dist[0, 1:]).all()
+
+
+def test_rows_line_up_with_the_frame():
+    df = pd.DataFrame(np.random.default_rng(2).random((10, 14)), columns=norm_cols)
+    engine = SimilarityEngine(df, tree_threshold=None)
+    np.testing.assert_array_equal(engine.matrix, feature_matrix(df))
+    idx, dist = engine.top_k(df.iloc[[3]][norm_cols].to_numpy(), k=1)
+    # Without exclude the query's own season comes back first, at distance 0
+    assert idx[0, 0] == 3 and dist[0, 0] == 0
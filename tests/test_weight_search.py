@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+from backtest import Backtest
+from frames import repeated_seasons
+from weight_search import ProjectionObjective
+
+
+@pytest.mark.parametrize('weighting', ['inverse', 'inverse_square'])
+def test_objective_matches_backtest_with_exact_matches(weighting):
+    backtest = Backtest(repeated_seasons(), k_max=4, workers=1)
+    objective = ProjectionObjective(backtest, k=3, weighting=weighting)
+    result = objective.evaluate(np.ones((2, len(objective.cols))))
+    assert np.isfinite(result['loss']).all()
+    summary, _ = backtest.run(k=3, weighting=weighting)
+    np.testing.assert_allclose(result['fantasy_mae'], summary.loc['fantasy_pts', 'mae'], atol=1e-9)
@@ -18,10 +18,21 @@ To make things simple, we'll come up with one statistic called percent error to
 """
 
 # Import modules
+import os
+import sys
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+# The shared model modules live at the root of the repo, one folder up from this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from similarity import SimilarityEngine
+from ann import IVFPQIndex, recall_at_k
+from season_store import SeasonStore
+from projection import project_player, project_season
+from csv_cache import read_csv_cached
+from normalization import normalize
+
 # Make a list of all of the columns that we use for scoring in daily / weekly matchup.
 # There are two types of NBA fantasy leagues, but they take these statistics into consideration the same way.
 stats = [
@@ -29,8 +40,9 @@ stats = [
 ]
 
 # Read in per season stats, which account for injury time outages better than per game stats, and scrub them.
+# read_csv_cached parses the CSV once and keeps a binary copy next to it, so later runs skip the CSV parsing.
 csv = 'nbadata/nba-stats-csv/player_general_traditional_per_game_data.csv'
-df = pd.read_csv(
+df = read_csv_cached(
     csv, header=0
 )
 
@@ -60,22 +72,10 @@ We need to normalize our data. Scoring 22 ppg in 1993 isn't the same as scoring
 """
 
 
-def normalize_col(col):
-    normalized_input = (col - col.min()) / (col.max() - col.min())
-    return normalized_input
-
-# Create a new function which calls normalize_col and iterates through a dataframe
-
-
-def normalize_df(df):
-    for col in stats:
-        df['{}_norm'.format(col)] = normalize_col(df[col])
-    return df
-
-
-# Create a grouped df grouped by season_id to run our function on 
-df_normalized = grouped_df = df_no_outliers.groupby(
-    ['season_id'], group_keys=True).apply(normalize_df)
+# The normalize function in normalization.py does this for every season in one grouped pass. It works out the min and max
+# of each stat for every season at once, then scales each row with its season's numbers, instead of calling a Python
+# function season by season. season_stats keeps those per-season numbers in case we want to scale new rows the same way.
+df_normalized, season_stats = normalize(df_no_outliers, stats, by='season_id', method='minmax')
 """
 We need to calculate player distance, or percent error. This metric shows how close players' normalized stats are. Our goal is to
  find the ten players with the shortest distance across all stats. We'll create a function called called calc_distance that takes 
@@ -89,7 +89,7 @@ def calc_distance(u, v):
 
 
 # Test two players and see how our function works
-df_player_names = pd.read_csv(
+df_player_names = read_csv_cached(
     'nbadata/nba-stats-csv/player_info.csv')
 # Join the df_normalized with a df with names to see names
 df_normalized.reset_index(drop=True, inplace=True)
@@ -102,14 +102,11 @@ col_list = df_normalized.columns.tolist()
 col_list = col_list[0:1] + col_list[-1:] + col_list[1:-1]
 df_normalized = df_normalized[col_list]
 
-# Another function we need to create is one that finds a row of data based on a player id and season id. To find this data,
-# we need to iterate over the df until we find the row.
-
-
-def find_player(input_df, player_id, player_season):
-    for row in input_df.itertuples():
-        if player_season == row.season_id and player_id == row.player_id:
-            return row
+# Another thing we need is a way to find a row of data based on a player id and season id. Iterating over the df until we find
+# the row means a full scan for every lookup, so instead we build a SeasonStore once. It keys every row by (player_id, season_id)
+# so a lookup is a dictionary hit, and it links every row to the same player's next season for the projections further down.
+store = SeasonStore(df_normalized)
+df_normalized = store.df
 
 
 # We need to be able to use our functions to find players with similar seasons. We're going to take stats from two players and put
@@ -118,19 +115,13 @@ def find_player(input_df, player_id, player_season):
 # We'll compare to Michael Kidd-Gilchrist in 2013-2014
 current_player = 203077
 current_season = '2013-14'
-mkg_2013_14_vector = np.array([
-    (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'pts_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'min_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fgm_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fga_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fg3m_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fg3a_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'ftm_norm']).item(
-    ), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fta_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'oreb_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'dreb_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'ast_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'stl_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'tov_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'blk_norm']).item()
-])
+mkg_2013_14_vector = store.vector(current_player, current_season)
 # print(mkg_2013_14_vector)
 
 # We're going to use Jrue Holiday in 2016-17 as our test.
 current_player = 201950
 current_season = '2016-17'
-current_player_vector = np.array([
-    (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'pts_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'min_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fgm_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fga_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fg3m_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fg3a_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'ftm_norm']).item(
-    ), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'fta_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'oreb_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'dreb_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'ast_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'stl_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'tov_norm']).item(), (df_normalized.loc[(df_normalized['player_id'] == current_player) & (df_normalized['season_id'] == current_season), 'blk_norm']).item()
-])
+current_player_vector = store.vector(current_player, current_season)
 # print(jrue_2016_17_vector)
 
 # Now let's use the calc distance function for these two arrays. First we need to vectorize the function. This purpose is to
@@ -145,29 +136,23 @@ distance_vector = calc_distance_vector(
 avg_pct_error = np.sum(abs(distance_vector)) / len(distance_vector)
 # print(avg_pct_error)
 
-# Now that we have an approach for comparing two players, we can turn this into a for loop and compare multiple plaeyers.
-# Let's create an empty list with the distance numbers and append them one at a time as we loop through.
-player_distance = []
-
-# Loop over rows in a dataframe with itertuples method.
-for row in df_normalized.itertuples():
-    compared_player_vector = np.array([
-        row.pts_norm, row.min_norm, row.fgm_norm, row.fga_norm, row.fg3m_norm, row.fg3a_norm, row.ftm_norm, row.fta_norm, row.oreb_norm, row.dreb_norm, row.ast_norm, row.stl_norm, row.tov_norm, row.blk_norm
-    ])
-
-    calc_distance_vector = np.vectorize(calc_distance)
-    distance_vector = calc_distance_vector(
-        current_player_vector, compared_player_vector)
-    avg_pct_error = np.sum(abs(distance_vector)) / len(distance_vector)
-    player_distance.append(avg_pct_error)
-    player = row.player_name
-    # print('Done with ' + str(player) + '. Percent error was ' + str((round((1 - avg_pct_error), 3) * 100)) + '%.')
+# Now that we have an approach for comparing two players, we can compare every season at once. Looping over every row with
+# itertuples and np.vectorize takes seconds for a single player, so instead the SimilarityEngine holds all of the normalized
+# stats in one matrix and scores the current player against every season in a single vectorized pass.
+engine = SimilarityEngine(df_normalized)
+player_distance = engine.distances(current_player_vector)
 
 df_normalized['ranking'] = player_distance
 df_ranked = df_normalized.sort_values('ranking', ascending=True)
 df_ranked.reset_index(drop=True, inplace=True)
 # print(df_ranked)
 
+# The engine can also rinse and repeat for a whole season at once. This finds the ten most similar seasons for every
+# player in 2017-18 in one batch, leaving each player's own season out of their results.
+rows_2017_18 = np.flatnonzero(df_normalized['season_id'] == '2017-18')
+neighbor_rows, neighbor_distances = engine.top_k_rows(rows_2017_18, k=10)
+# print(df_normalized.iloc[neighbor_rows[0]])
+
 # Now that we can compare seasons and sort on player error, we can find the ten players with the
 # most similar seasons to a single player. Now we need to look at the next season for those ten
 # players, average that following season together, and use that to project our selected player's
@@ -177,32 +162,10 @@ df_ranked.reset_index(drop=True, inplace=True)
 # indicating similar player behavior, we'll weight that number heavier. We'll add logic to also
 # weight for the same player.
 
-# First, we need a list of every season id
-seasons_list = df_normalized['season_id'].unique().tolist()
-# print(seasons_list)
-
-# For loop to go over each stat, multipy value by weight, and get weighted avg
-projected_stats_dict = {}
-
-for col in stats:
-    sum_stat = 0
-    sum_weight = 0
-    for index, row in df_ranked[1:11].iterrows():
-        if row.season_id == '2017-18':
-            continue
-        if row.season_id == '2018-19':
-            continue
-        weight = (1 / row.ranking)
-        next_season_id = seasons_list[(seasons_list.index(row.season_id) + 1)]
-        if next_season_id == None:
-            continue
-        player_next_season = find_player(df_ranked, row.player_id, next_season_id)
-        if player_next_season == None:
-            continue
-        sum_stat += getattr(player_next_season, col) * weight
-        sum_weight += weight
-    projected_stats_dict['proj_season_id'] = seasons_list[(seasons_list.index(current_season) + 1)]
-    projected_stats_dict['proj_' + col] = (sum_stat / sum_weight)
+# The store already knows every player's next season, so the projection is a gather of the ten neighbors' next seasons
+# weighted by 1 / distance. 2018-19 was still being played when this data was pulled, so we only trust next seasons up to
+# 2017-18.
+projected_stats_dict = project_player(store, engine, current_player, current_season, k=10, max_season='2017-18')
 print(projected_stats_dict)
 
 """
@@ -211,62 +174,32 @@ and outputs projected stats for player's next season. Then, loop over every play
 their projected stats for next season. Compare to actuals to see accuracy.
 """
 
-def player_comparison(df, current_player_season, current_player_id):
-    # If player doesn't exist in dataframe, print that player can't be found
-    if ((df['season_id'] == current_player_season)  & (df['player_id'] == current_player_id)).any(False):
+def player_comparison(store, engine, current_player_season, current_player_id, k=10, max_season=None):
+    # If player doesn't exist in the store, print that player can't be found
+    if store.row(current_player_id, current_player_season) < 0:
         print('Can\'t find player with id {} and season {}'.format(current_player_id, current_player_season))
         return
-    
-    for row in df.itertuples():
-        if current_player_season == row['season_id'] and current_player_id == row['player_id']:
-            current_player_id = row.player_id
-            break
-
-    current_player_vector = np.array([df
-        (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'pts_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'min_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'fgm_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'fga_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'fg3m_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'fg3a_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'ftm_norm']).item(
-        ), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'fta_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df_normalized['season_id'] == current_player_season), 'oreb_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'dreb_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'ast_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'stl_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'tov_norm']).item(), (df.loc[(df['player_id'] == current_player_id) & (df['season_id'] == current_player_season), 'blk_norm']).item()
-    ])
-    print('Projecting player_id {0} for season {1}'.format(current_player_id, seasons_list[(seasons_list.index(row.season_id) + 1)]))
-    
-    player_distance = []
-
-    for row in df.itertuples():
-        compared_player_vector = np.array([
-            row.pts_norm, row.min_norm, row.fgm_norm, row.fga_norm, row.fg3m_norm, row.fg3a_norm, row.ftm_norm, row.fta_norm, row.oreb_norm, row.dreb_norm, row.ast_norm, row.stl_norm, row.tov_norm, row.blk_norm
-        ])
-        
-        calc_distance_vector = np.vectorize(calc_distance)
-        distance_vector = calc_distance_vector(
-            current_player_vector, compared_player_vector)
-        avg_pct_error = np.sum(abs(distance_vector)) / len(distance_vector)
-        player_distance.append(avg_pct_error)
-    
-    df['ranking'] = player_distance
-
-    df_ranked = df.sort_values('distance')
-
-    df_ranked.reset_index(drop=True, inplace=True)
-
-    stats = [
-        'pts', 'min', 'fgm', 'fga', 'fg3m', 'fg3a', 'ftm', 'fta', 'oreb', 'dreb', 'ast', 'stl', 'tov', 'blk'
-    ]
-
-    projected_stats_dict = {}
-
-    for col in stats:
-        sum_stat = 0
-        sum_weight = 0
-        for index, row in df_ranked[1:11].iterrows():
-            if row.season_id == '2018-19':
-                continue
-            weight = (1 / row.ranking)
-            next_season_id = seasons_list[(seasons_list.index(row.season_id) + 1)]
-            player_next_season = find_player(df_ranked, row.player_id, next_season_id)
-            if player_next_season == None:
-                continue
-            sum_stat += getattr(player_next_season, col) * weight
-            sum_weight += weight
-        projected_stats_dict['proj_season_id'] = seasons_list[(seasons_list.index(current_season) + 1)]
-        projected_stats_dict['proj_' + col] = (sum_stat / sum_weight)
-
-    return projected_stats
\ No newline at end of file
+
+    print('Projecting player_id {0} for season {1}'.format(
+        current_player_id, store.next_season_id(current_player_season)))
+    return project_player(store, engine, current_player_id, current_player_season, k=k, max_season=max_season)
+
+
+# Looping player_comparison over every player in the draft means one search per player. project_season does the whole
+# league in one run instead: every player with a 2017-18 season gets a 2018-19 projection, the neighbor searches are spread
+# over a process pool, and the table is written with a fantasy_pts column like projected_fantasy_pts_final_2018_19.csv.
+# The pool needs the __main__ guard so worker processes can import this script without starting their own pool.
+if __name__ == '__main__':
+    # Comparing rolling game windows instead of seasons means millions of vectors, which is too many to scan for every
+    # query. The IVFPQIndex in ann.py only scans the nprobe clusters of seasons closest to each query and keeps every season
+    # as 7 bytes, so it answers the same question approximately. More nprobe (and rerank, which rescores the best
+    # candidates with exact distances) gives better recall for more time. Here we check how many of the exact ten it finds.
+    # Training the index runs k-means, so it stays down here where the pool's worker processes don't repeat it.
+    approx_engine = IVFPQIndex.from_engine(engine, nprobe=16, rerank=10)
+    approx_rows, approx_distances = approx_engine.top_k_rows(rows_2017_18, k=10)
+    print('Approximate recall@10: {:.3f}'.format(recall_at_k(neighbor_rows, approx_rows)))
+
+    df_projected = project_season(
+        store, engine, '2018-19', k=10, output='nbadata/nba-stats-csv/projected_fantasy_pts_2018_19.csv'
+    )
+    print(df_projected.head(10))
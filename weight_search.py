@@ -0,0 +1,258 @@
+"""
+Search over weight vectors for season_ranking.ipynb's stats_weights and for the 14 stats in the player comparison model.
+
+Both sets of weights are hand picked: stats_weights in ranking.py, and the plain average over the 14 normalized stats in
+ fantasy_model.py (which says itself that blocks "may not be weighted as highly as points"). Trying another set used to
+ mean rerunning the whole notebook. Here every candidate is one row of a weight matrix W, so thousands of candidates are
+ scored in one pass:
+
+- RankingObjective: combined scores for every candidate are Z @ W.T, with Z the z-score matrix. A candidate is scored on
+  how stable its ranking is from one season to the player's next (Spearman correlation over consecutive seasons), with
+  the overlap of its top seasons against the current stats_weights ranking for reference.
+- ProjectionObjective: weighted distances to a pool of near neighbors are D @ W.T, with D the per stat absolute
+  differences. A candidate is scored on the backtest error of the projections its k nearest neighbors give. The pool is
+  the Backtest's k_max nearest neighbors under equal weights, so other weights rerank that pool instead of searching
+  every season again. Keep k_max a few times k.
+
+random_search, grid_search and coordinate_descent generate candidates in batches and stop when they run out of
+ candidates or time. Weights are moved multiplicatively, so every weight keeps its sign (turnovers stay negative).
+"""
+
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from projection import neighbor_weights
+from ranking import stats_weights
+from scoring import fantasy_scoring, scoring_matrix
+from similarity import stats
+
+
+def rank_columns(values):
+    """Rank (0 based) of every value within its column, for Spearman correlations."""
+    ranks = np.empty(values.shape, dtype=np.float64)
+    order = np.argsort(values, axis=0, kind='stable')
+    np.put_along_axis(ranks, order, np.arange(values.shape[0], dtype=np.float64)[:, None], axis=0)
+    return ranks
+
+
+def column_correlations(x, y):
+    """Pearson correlation between every column of x and the same column of y."""
+    x = x - x.mean(axis=0)
+    y = y - y.mean(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (x * y).sum(axis=0) / np.sqrt((x ** 2).sum(axis=0) * (y ** 2).sum(axis=0))
+
+
+class RankingObjective:
+    """
+    Scores stats_weights candidates on a season_ranking table that still has its *_zscore columns.
+
+    df: the notebook's df_stats right after normalize, with player_id and season_id
+    top_n: size of the top list compared against the base ranking
+    """
+
+    def __init__(self, df, base_weights=None, top_n=100, id_col='player_id', season_col='season_id'):
+        self.base_weights = dict(base_weights or stats_weights)
+        self.cols = list(self.base_weights)
+        self.base = np.array([self.base_weights[col] for col in self.cols])
+        self.top_n = top_n
+        # Missing z-scores (a group with a single season has no std) count as average
+        self.z = np.nan_to_num(df[self.cols].to_numpy(dtype=np.float64))
+
+        # Consecutive seasons of the same player: the seasons are in sorted order, so the next row in a player's sorted
+        # seasons is his following season when the season codes are one apart
+        season_codes = pd.factorize(df[season_col].astype(str), sort=True)[0]
+        player_ids = df[id_col].to_numpy(dtype=np.int64)
+        order = np.lexsort((season_codes, player_ids))
+        same_player = player_ids[order[1:]] == player_ids[order[:-1]]
+        next_season = season_codes[order[1:]] == season_codes[order[:-1]] + 1
+        pairs = same_player & next_season
+        self.first = order[:-1][pairs]
+        self.second = order[1:][pairs]
+
+        base_scores = self.z @ self.base
+        self.base_top = np.zeros(len(self.z), dtype=bool)
+        self.base_top[np.argsort(-base_scores, kind='stable')[:top_n]] = True
+
+    def evaluate(self, weights):
+        """Metrics for every row of weights (n_candidates x len(cols)), with loss = -stability."""
+        scores = self.z @ np.atleast_2d(weights).T
+        stability = column_correlations(rank_columns(scores[self.first]), rank_columns(scores[self.second]))
+        top = np.argpartition(-scores, self.top_n - 1, axis=0)[:self.top_n]
+        overlap = self.base_top[top].mean(axis=0)
+        return pd.DataFrame({'stability': stability, 'top_overlap': overlap, 'loss': -stability})
+
+
+class ProjectionObjective:
+    """
+    Scores per stat distance weights for the projection model with a Backtest's neighbors.
+
+    backtest: a backtest.Backtest, whose k_max is used as the pool of neighbors to rerank
+    k / weighting / min_gp: the projection settings, as in Backtest.run
+    """
+
+    def __init__(self, backtest, k=10, weighting='inverse', min_gp=10, scoring=None):
+        if k > backtest.k_max:
+            raise ValueError('k {} is bigger than the backtest pool of {}'.format(k, backtest.k_max))
+        self.cols = list(stats)
+        self.base = np.ones(len(stats))
+        self.k = k
+        self.weighting = weighting
+        store = backtest.store
+        matrix = backtest.engine(min_gp).matrix
+        neighbors = backtest.neighbors(min_gp)
+
+        diffs, next_values, valid, actuals = [], [], [], []
+        for code in backtest.season_codes:
+            rows = backtest.eval_rows[code]
+            neighbor_rows, _ = neighbors[code]
+            found = neighbor_rows >= 0
+            neighbor_rows = np.maximum(neighbor_rows, 0)
+            diffs.append(np.abs(matrix[neighbor_rows] - matrix[rows][:, None, :]))
+            # The same next season rules as projection.weighted_projection
+            next_rows = np.where(found, store.next_rows[neighbor_rows], -1)
+            late = store.season_index[np.maximum(next_rows, 0)] > code
+            next_rows = np.where(late, -1, next_rows)
+            values = store.gather(next_rows, stats)
+            valid.append((next_rows >= 0) & ~np.isnan(values).any(axis=2) & found)
+            next_values.append(np.nan_to_num(values))
+            actuals.append(backtest.actuals[code])
+        self.diffs = np.ascontiguousarray(np.nan_to_num(np.concatenate(diffs), nan=np.inf).transpose(0, 2, 1))
+        self.next_values = np.concatenate(next_values)
+        self.valid = np.concatenate(valid)
+        self.actual = np.concatenate(actuals)
+        _, points = scoring_matrix({'scoring': scoring or fantasy_scoring})
+        self.points = points[0]
+        self.actual_points = self.actual @ self.points
+
+    def evaluate(self, weights, batch=64):
+        """Metrics for every row of weights (n_candidates x 14), with loss = fantasy_mae."""
+        weights = np.atleast_2d(weights)
+        results = []
+        for start in range(0, len(weights), batch):
+            block = weights[start:start + batch]
+            block = block / block.sum(axis=1, keepdims=True)
+            # Weighted mean absolute difference to every pooled neighbor, laid out (players, candidates, pool) so each
+            # candidate's pool is contiguous for the sort below
+            distances = block @ self.diffs
+            np.copyto(distances, np.inf, where=~self.valid[:, None, :])
+            # Neighbor weights spread over the whole pool, zero outside each candidate's k nearest, so the projection is
+            # one batched matrix product
+            pooled = np.zeros(distances.shape)
+            if self.weighting == 'rank':
+                nearest = np.argsort(distances, axis=2, kind='stable')[:, :, :self.k]
+                ranks = np.broadcast_to(1 / np.arange(1, self.k + 1), nearest.shape)
+                found = np.isfinite(np.take_along_axis(distances, nearest, axis=2))
+                np.put_along_axis(pooled, nearest, np.where(found, ranks, 0), axis=2)
+            else:
+                # Every neighbor at or inside the kth distance (ties at the kth distance all count)
+                kth = np.sort(distances, axis=2)[:, :, self.k - 1:self.k]
+                near = (distances <= kth) & np.isfinite(distances)
+                # The same weights as the projection, exact matches included
+                np.copyto(pooled, neighbor_weights(distances, self.weighting, usable=near), where=near)
+            total = pooled.sum(axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                projected = (pooled @ self.next_values) / total[:, :, None]
+            errors = projected - self.actual[:, None, :]
+            point_errors = projected @ self.points - self.actual_points[:, None]
+            results.append(pd.DataFrame({
+                'fantasy_mae': np.nanmean(np.abs(point_errors), axis=0),
+                'fantasy_bias': np.nanmean(point_errors, axis=0),
+                'stat_mae': np.nanmean(np.abs(errors), axis=(0, 2)),
+            }))
+        results = pd.concat(results, ignore_index=True)
+        results['loss'] = results['fantasy_mae']
+        return results
+
+
+def _collect(objective, frames):
+    """One dataframe of every candidate tried, best first."""
+    if not frames:
+        return pd.DataFrame(columns=objective.cols + ['loss'])
+    results = pd.concat(frames, ignore_index=True)
+    return results.sort_values('loss', kind='stable').reset_index(drop=True)
+
+
+def _evaluate(objective, weights):
+    return pd.concat([pd.DataFrame(weights, columns=objective.cols), objective.evaluate(weights)], axis=1)
+
+
+def _search(objective, batches, seconds, label):
+    """Evaluate batches of candidates until they or the time run out."""
+    started = time.perf_counter()
+    frames = []
+    for weights in batches:
+        batch_started = time.perf_counter()
+        frames.append(_evaluate(objective, np.atleast_2d(weights)))
+        # Stop early if another batch like this one would go over the budget
+        now = time.perf_counter()
+        if seconds is not None and now - started + (now - batch_started) > seconds:
+            print(f"{label} stopped at the {seconds}s time budget")
+            break
+    return _collect(objective, frames)
+
+
+def random_search(objective, n=10000, scale=0.5, seconds=None, batch=256, base=None, seed=None):
+    """
+    Random candidates around base (the objective's current weights by default): every weight is multiplied by
+     exp(Normal(0, scale)). The base itself is the first candidate.
+    """
+    rng = np.random.default_rng(seed)
+    base = objective.base if base is None else np.asarray(base, dtype=np.float64)
+
+    def batches():
+        done = 0
+        while done < n:
+            size = min(batch, n - done)
+            weights = base * np.exp(rng.normal(0.0, scale, size=(size, len(base))))
+            if done == 0:
+                weights[0] = base
+            done += size
+            yield weights
+    return _search(objective, batches(), seconds, 'random_search')
+
+
+def grid_search(objective, cols=None, multipliers=(0.5, 1, 2), seconds=None, batch=256, base=None):
+    """Every combination of multipliers on cols (default all of them), applied to base."""
+    base = objective.base if base is None else np.asarray(base, dtype=np.float64)
+    cols = cols or objective.cols
+    positions = [objective.cols.index(col) for col in cols]
+    combinations = itertools.product(multipliers, repeat=len(positions))
+
+    def batches():
+        while True:
+            chunk = list(itertools.islice(combinations, batch))
+            if not chunk:
+                return
+            weights = np.tile(base, (len(chunk), 1))
+            weights[:, positions] *= np.array(chunk)
+            yield weights
+    return _search(objective, batches(), seconds, 'grid_search')
+
+
+def coordinate_descent(objective, steps=(0.5, 0.8, 1.25, 2), rounds=20, seconds=None, base=None):
+    """
+    Move one weight at a time: each round tries every weight times every step in one batch, and keeps the best
+     candidate if it beats the current weights. Stops when nothing improves, or after rounds / seconds.
+    """
+    started = time.perf_counter()
+    current = objective.base if base is None else np.asarray(base, dtype=np.float64)
+    frames = [_evaluate(objective, current[None, :])]
+    current_loss = frames[0]['loss'].iloc[0]
+    for _ in range(rounds):
+        if seconds is not None and time.perf_counter() - started > seconds:
+            print(f"coordinate_descent stopped at the {seconds}s time budget")
+            break
+        weights = np.repeat(current[None, :], len(current) * len(steps), axis=0)
+        for i, (j, step) in enumerate(itertools.product(range(len(current)), steps)):
+            weights[i, j] *= step
+        results = _evaluate(objective, weights)
+        frames.append(results)
+        best = int(np.nanargmin(results['loss'].to_numpy()))
+        if not results['loss'].iloc[best] < current_loss:
+            break
+        current, current_loss = weights[best], results['loss'].iloc[best]
+    return _collect(objective, frames)